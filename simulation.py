@@ -6,7 +6,6 @@ import os
 import sys
 import fileinput
 import re
-import random
 import math
 from operator import itemgetter, attrgetter
 import subprocess
@@ -16,32 +15,56 @@ from scipy.stats import binom
 from scipy.stats import nbinom
 from scipy.stats import norm
 from scipy.stats import poisson
-from scipy.stats import chisquare
+from scipy.stats import chi2 as chi2dist
+from scipy.optimize import brentq
 import numpy as np
 import matplotlib.pyplot as plt
 import time
 import argparse
-from dateutil import parser as dparser
 import calendar
+import datetime
 import bisect
 import heapq
 from heapq import heappush, heappop
 import resource
 import gc
+import multiprocessing
+import functools
+import tempfile
+import pickle
+import threading
+import queue
+import glob
+import hashlib
+import itertools
 
 # Multiple plots
 from mpl_toolkits.axes_grid1 import host_subplot
 import mpl_toolkits.axisartist as AA
 import pylab as P
 
-# MLE distribution fitting with RPy - python binding for R
-from rpy2.robjects import r
-from rpy2.robjects import IntVector 
-from rpy2.robjects.packages import importr
-  
-# Load the MASS library for distribution fitting
-# See more at: http://thomas-cokelaer.info/blog/2011/08/fitting-distribution-by-combing-r-and-python/#sthash.TiVb9HpI.dpuf 
-MASS = importr('MASS') 
+# MLE distribution fitting with RPy - python binding for R. Optional, negative binomial MLE
+# is computed natively, R is used only to cross-check it (--rmle).
+try:
+    from rpy2.robjects import r
+    from rpy2.robjects import IntVector 
+    from rpy2.robjects.packages import importr
+      
+    # Load the MASS library for distribution fitting
+    # See more at: http://thomas-cokelaer.info/blog/2011/08/fitting-distribution-by-combing-r-and-python/#sthash.TiVb9HpI.dpuf 
+    MASS = importr('MASS') 
+except ImportError:
+    MASS = None
+
+# Default random generator, used if no seeded one is set to the simulation objects
+defaultRng = np.random.default_rng()
+
+def rngStream(seed, *key):
+    '''
+    Returns NumPy random Generator for substream <key> of the seed, e.g. (stream, round).
+    Substreams with different keys are independent (SeedSequence spawn keys).
+    '''
+    return np.random.Generator(np.random.PCG64(np.random.SeedSequence(seed, spawn_key=tuple(key))))
 
 def coe(x):
     return 1.0 / (0.163321 * math.log(64.2568 * x)) 
@@ -60,14 +83,15 @@ def fibGenerator():
         a, b = b, a + b
         yield a
 
-def poissonProcGenerator(lmbd):
+def poissonProcGenerator(lmbd, rng=None):
     '''
     Generates samples from Poisson NAT (inc +1) process generator
     '''
-    x = np.random.poisson(lmbd)
+    if rng is None: rng = defaultRng
+    x = rng.poisson(lmbd)
     yield x
     while True:
-        x += 1 + np.random.poisson(lmbd)
+        x += 1 + rng.poisson(lmbd)
         yield x
             
 def f7(seq):
@@ -78,7 +102,32 @@ def f7(seq):
     seen_add = seen.add
     return [ x for x in seq if x not in seen and not seen_add(x)]
 
-def probRound(x):
+def f7rows(X, width, dupl=False):
+    '''
+    Vectorized f7() over rows of a matrix. Keeps first occurrences in each row in their order,
+    takes at most width of them and pads the rest of the row with its last kept element.
+    Returns (rows x width) matrix. If dupl is True, rows are only cut to the width.
+    '''
+    rows, cols = X.shape
+    if dupl:
+        keep = np.ones(X.shape, dtype=bool)
+    else:
+        order = np.argsort(X, axis=1, kind='stable')
+        srt   = np.take_along_axis(X, order, axis=1)
+        first = np.ones(X.shape, dtype=bool)
+        first[:, 1:] = srt[:, 1:] != srt[:, :-1]
+        keep  = np.zeros(X.shape, dtype=bool)
+        np.put_along_axis(keep, order, first, axis=1)
+    
+    pos = np.cumsum(keep, axis=1) - 1                    # target column of kept elements
+    sel = keep & (pos < width)
+    res = np.zeros((rows, width), dtype=X.dtype)
+    res[np.nonzero(sel)[0], pos[sel]] = X[sel]
+    ln  = np.minimum(pos[:, -1] + 1, width)              # number of kept elements per row
+    last = res[np.arange(rows), ln-1]
+    return np.where(np.arange(width)[None, :] < ln[:, None], res, last[:, None])
+
+def probRound(x, rng=None):
     '''
     Probabilistic rounding of a number. If x=1.2 with 80% it will be rounded to 1, 20% to 2
     '''
@@ -86,11 +135,20 @@ def probRound(x):
     cel = math.ceil(x)
     
     if flr == cel: return x
-    if random.random() <= (x-flr):
+    if rng is None: rng = defaultRng
+    if rng.random() <= (x-flr):
         return int(cel)
     else:
         return int(flr) 
 
+def probRoundArr(x, rng=None):
+    '''
+    Vectorized probRound() for NumPy arrays.
+    '''
+    if rng is None: rng = defaultRng
+    flr = np.floor(x)
+    return flr + ((x > flr) & (rng.random(len(x)) <= (x-flr)))
+
 def hashcode(s):
     '''
     Simple hashcode implementation for strings and integers.
@@ -120,6 +178,9 @@ class Strategy(object):
     '''
     Base abstract class for NAT strategy
     '''
+    # random generator, set per round by NatSimulation.roundRng()
+    rng = defaultRng
+    
     def init(self, params=None):
         raise Exception("Not implemented yet...")
     def reset(self, nats=[], sim=None, params=None):
@@ -131,6 +192,30 @@ class Strategy(object):
         Tells to strategy how long did silent period take just before start and guessed lambda.
         '''
         pass
+    def moves(self, party, steps):
+        '''
+        Returns moves for steps 0..steps-1 as a tuple of NumPy arrays (srcPorts, dstPorts).
+        Equivalent to calling next(party, step) for each step, strategies override it
+        with a vectorized version.
+        '''
+        mv = [self.next(party, step) for step in range(0, steps)]
+        return (np.array([x[0] for x in mv], dtype=np.int64), np.array([x[1] for x in mv], dtype=np.int64))
+
+class ReplayStrategy(Strategy):
+    '''
+    Replays moves recorded by Strategy.moves(), one (srcPorts, dstPorts) array pair per party.
+    '''
+    src = None
+    dst = None
+    def __init__(self, src, dst):
+        self.src = src
+        self.dst = dst
+    def init(self, params=None):
+        pass
+    def next(self, party, step):
+        return (int(self.src[party][step]), int(self.dst[party][step]))
+    def moves(self, party, steps):
+        return (self.src[party][0:steps], self.dst[party][0:steps])
 
 class Nat(object):
     '''
@@ -144,6 +229,9 @@ class Nat(object):
     pool = None
     poolLen = 0
     
+    # random generator, set per round by NatSimulation.roundRng()
+    rng = defaultRng
+    
     def init(self, params=None):
         raise Exception("Not implemented yet...") 
     def reset(self):
@@ -194,7 +282,292 @@ class Quartet: #(object):
         result = prime * result + hashcode(self.dstIP)
         result = prime * result + int(self.dstPort)
         return result
+
+class TimerWheel(object):
+    '''
+    Hierarchical timing wheel for expiration events.
+
+    Time is split into ticks of given granularity, level l has 2^bits slots, each covering
+    2^(bits*l) ticks. Item is placed on the lowest level covering its distance from the current
+    tick, slots of upper levels are cascaded down when lower level wraps. Scheduling and expiring
+    is amortized O(1), empty levels are skipped when advancing over long idle periods.
+    '''
+    bits = 8
+    levels = 3
+    # tick length (same unit as time, e.g. ms)
+    granularity = 1.0
+    # current tick, None until first advance()
+    now = None
+    # wheels[level][slot] = list of (tick, item)
+    wheels = None
+    # number of items on each level
+    counts = None
+    # items due at the current tick or earlier, returned by next advance()
+    due = None
+
+    def __init__(self, granularity, bits=8, levels=3):
+        self.granularity = float(granularity)
+        self.bits = bits
+        self.levels = levels
+        self.reset()
+
+    def reset(self):
+        '''
+        Drops all scheduled items, slot lists are allocated only once, later only non-empty ones are cleared.
+        '''
+        size = 1 << self.bits
+        self.now = None
+        self.due = []
+        if self.wheels == None:
+            self.wheels = [[[] for i in range(size)] for l in range(self.levels)]
+            self.counts = [0] * self.levels
+            return
+        for l in range(self.levels):
+            if self.counts[l] == 0: continue
+            wheel = self.wheels[l]
+            for slot in range(size):
+                if len(wheel[slot]) > 0: wheel[slot] = []
+            self.counts[l] = 0
+
+    def __len__(self):
+        return sum(self.counts) + len(self.due)
+
+    def schedule(self, when, item):
+        '''
+        Schedules item to be returned by advance() once time reaches when.
+        '''
+        tick = int(when // self.granularity)
+        self.insert(tick, item)
+
+    def insert(self, tick, item):
+        delta = tick - self.now if self.now != None else 0
+        if delta <= 0:
+            self.due.append(item)
+            return
+        bits = self.bits
+        for l in range(0, self.levels):
+            if delta < (1 << (bits*(l+1))) or l == self.levels-1:
+                if delta >= (1 << (bits*(l+1))):
+                    # beyond the wheel range, park in the furthest slot, reinserted on cascade
+                    slot = ((self.now + (1 << (bits*(l+1))) - 1) >> (bits*l)) & ((1 << bits) - 1)
+                else:
+                    slot = (tick >> (bits*l)) & ((1 << bits) - 1)
+                self.wheels[l][slot].append((tick, item))
+                self.counts[l] += 1
+                return
+
+    def cascade(self, l):
+        '''
+        Moves items from the current slot of level l to lower levels.
+        '''
+        bits = self.bits
+        slot = (self.now >> (bits*l)) & ((1 << bits) - 1)
+        if slot == 0 and l+1 < self.levels: self.cascade(l+1)
+        bucket = self.wheels[l][slot]
+        if len(bucket) == 0: return
+        self.wheels[l][slot] = []
+        self.counts[l] -= len(bucket)
+        for tick, item in bucket: self.insert(tick, item)
+
+    def advance(self, when):
+        '''
+        Moves current time to when, returns list of items which became due.
+        '''
+        target = int(when // self.granularity)
+        if target == self.now and len(self.due) == 0: return []
+        if self.now == None: self.now = target
+        res = self.due
+        self.due = []
+        bits = self.bits
+        mask = (1 << bits) - 1
+        wheel0 = self.wheels[0]
+        while self.now < target:
+            if self.counts[0] == 0:
+                if sum(self.counts) == 0:
+                    self.now = target
+                    break
+                # nothing on level 0 - jump right before the next cascade of the first non-empty level
+                l = 1
+                while self.counts[l] == 0: l += 1
+                nxt = self.now | ((1 << (bits*l)) - 1)
+                if nxt >= target:
+                    self.now = target
+                    break
+                self.now = nxt
+            self.now += 1
+            if self.now & mask == 0: self.cascade(1)
+            slot = self.now & mask
+            if len(wheel0[slot]) > 0:
+                bucket = wheel0[slot]
+                wheel0[slot] = []
+                self.counts[0] -= len(bucket)
+                res.extend([item for tick, item in bucket])
+        if len(self.due) > 0:
+            res.extend(self.due)
+            self.due = []
+        return res
     
+class PortIndex(object):
+    '''
+    Free port index over contiguous NAT port pool.
+
+    Two segment trees (implicit binary heap layout) storing minimum and maximum of last access
+    times over pool index ranges. Free slot has time -inf, allocated slot has its last access time.
+    Slot is usable at time T if its stored time < T - timeout, so the first usable slot from a given
+    index is found by a single descent of the min tree in O(log n), the end of a run of usable slots
+    by a descent of the max tree. Point updates and run assignments take O(log n) tree operations.
+    '''
+    FREE = float('-inf')
+    # number of pool slots indexed
+    n = 0
+    # number of leaves (power of 2)
+    size = 0
+    # tree arrays, tree[1] is root, leaves are tree[size .. size+n-1]. Padding leaves never match.
+    tree = None
+    maxTree = None
+    # empty tree templates, reset copies paths of the touched leaves from them
+    empty = None
+    emptyMax = None
+    # span of leaves [dirtyLo, dirtyHi) changed since the last reset
+    dirtyLo = 0
+    dirtyHi = 0
+
+    def __init__(self, n):
+        self.n = n
+        self.size = 1
+        while self.size < n: self.size <<= 1
+
+        self.empty = [float('inf')] * (2*self.size)
+        for i in range(self.size, self.size + n): self.empty[i] = self.FREE
+        for i in range(self.size-1, 0, -1): self.empty[i] = min(self.empty[2*i], self.empty[2*i+1])
+        self.emptyMax = [self.FREE] * (2*self.size)
+        self.tree = self.empty[:]
+        self.maxTree = self.emptyMax[:]
+        self.dirtyLo = n
+        self.dirtyHi = 0
+
+    def reset(self):
+        '''
+        Restores the empty index. Only nodes above the touched leaf span are copied from the templates,
+        incremental allocation touches a short prefix of the pool in most rounds.
+        '''
+        l = self.dirtyLo + self.size
+        r = self.dirtyHi + self.size
+        while 0 < l < r:
+            self.tree[l:r] = self.empty[l:r]
+            self.maxTree[l:r] = self.emptyMax[l:r]
+            l >>= 1
+            r = ((r-1) >> 1) + 1
+        self.dirtyLo = self.n
+        self.dirtyHi = 0
+
+    def update(self, idx, t):
+        '''
+        Sets last access time for pool index, FREE marks slot as free.
+        '''
+        if idx < self.dirtyLo: self.dirtyLo = idx
+        if idx >= self.dirtyHi: self.dirtyHi = idx+1
+        tree = self.tree
+        i = idx + self.size
+        tree[i] = t
+        i >>= 1
+        while i:
+            l = tree[2*i]
+            r = tree[2*i+1]
+            v = l if l < r else r
+            if tree[i] == v: break      # ancestors do not change
+            tree[i] = v
+            i >>= 1
+
+        tree = self.maxTree
+        i = idx + self.size
+        tree[i] = t
+        i >>= 1
+        while i:
+            l = tree[2*i]
+            r = tree[2*i+1]
+            v = l if l > r else r
+            if tree[i] == v: break
+            tree[i] = v
+            i >>= 1
+
+    def assign(self, lo, hi, t):
+        '''
+        Sets last access time t for the whole run of pool indices [lo, hi).
+        Nodes fully covered by the run are set by slice assignment, only the two
+        boundary nodes on each level are recomputed.
+        '''
+        if lo >= hi: return
+        if lo < self.dirtyLo: self.dirtyLo = lo
+        if hi > self.dirtyHi: self.dirtyHi = hi
+        for tree, op in ((self.tree, min), (self.maxTree, max)):
+            l = lo + self.size
+            r = hi + self.size
+            tree[l:r] = [t] * (r-l)
+            while l > 1:
+                pl = l >> 1
+                pr = (r-1) >> 1
+                if pr > pl+1: tree[pl+1:pr] = [t] * (pr-pl-1)
+                tree[pl] = op(tree[2*pl], tree[2*pl+1])
+                tree[pr] = op(tree[2*pr], tree[2*pr+1])
+                l = pl
+                r = pr+1
+
+    def findFree(self, start, thr):
+        '''
+        Returns first pool index >= start with stored time < thr, -1 if there is none.
+        '''
+        if start >= self.n: return -1
+        tree = self.tree
+        i = start + self.size
+        # climb up until we find a right-hand subtree containing usable slot
+        while tree[i] >= thr:
+            while i & 1:
+                if i == 1: return -1
+                i >>= 1
+            i += 1
+        # descend to the leftmost usable leaf
+        while i < self.size:
+            i <<= 1
+            if tree[i] >= thr: i += 1
+        return i - self.size
+
+    def findBusy(self, start, thr):
+        '''
+        Returns first pool index >= start with stored time >= thr, -1 if there is none.
+        '''
+        if start >= self.n: return -1
+        tree = self.maxTree
+        i = start + self.size
+        while tree[i] < thr:
+            while i & 1:
+                if i == 1: return -1
+                i >>= 1
+            i += 1
+        while i < self.size:
+            i <<= 1
+            if tree[i] < thr: i += 1
+        return i - self.size
+
+    def rangeMin(self, lo, hi):
+        '''
+        Returns minimum of stored times over pool indices [lo, hi), +inf for an empty range.
+        '''
+        tree = self.tree
+        res = float('inf')
+        l = lo + self.size
+        r = hi + self.size
+        while l < r:
+            if l & 1:
+                if tree[l] < res: res = tree[l]
+                l += 1
+            if r & 1:
+                r -= 1
+                if tree[r] < res: res = tree[r]
+            l >>= 1
+            r >>= 1
+        return res
+
 class SymmetricNat(Nat):
     '''
     Base class for symmetric NAT. 
@@ -203,8 +576,13 @@ class SymmetricNat(Nat):
     allocations = None 
     # port -> (quartet, expire time). Quartet may be null
     allocatedPorts = None
-    # priority queue (heap), priority=expire time, tuple stored=(expire time, port, quartet)
-    expireHeap = None
+    # expiration timer wheel (TimerWheel), one record per live allocation, record=(access time, port, quartet, ports).
+    # ports is None for a single allocation, or sequence of anonymous ports allocated at once by occupy().
+    expireWheel = None
+    # free port index (PortIndex), None = linear probing
+    portIndex = None
+    # first port of the pool, PortIndex works with port-portBase
+    portBase = 0
     
     # port is the key
     # port -> quartet, expire
@@ -214,13 +592,28 @@ class SymmetricNat(Nat):
         self.allocations = {}
         self.pool = list(range(1025, 65536))
         self.poolLen = len(self.pool)
+        self.portBase = self.pool[0]
         self.allocatedPorts = {}
-        self.expireHeap = []
+        self.expireWheel = TimerWheel(max(1, self.timeout) / 256.0)   # level 0 spans one timeout
         
     def reset(self):
         self.allocations = {}
         self.allocatedPorts = {}
-        self.expireHeap = []
+        granularity = max(1, self.timeout) / 256.0
+        if self.expireWheel.granularity == granularity: self.expireWheel.reset()
+        else: self.expireWheel = TimerWheel(granularity)     # timeout changed after init()
+        if self.portIndex != None: self.portIndex.reset()
+
+    def usePortIndex(self):
+        '''
+        Switches free port lookup from linear probing to PortIndex.
+        Pool has to be contiguous, it is mapped on the index as port-portBase.
+        '''
+        if self.pool != list(range(self.portBase, self.portBase + self.poolLen)):
+            raise Exception("Port index requires contiguous port pool")
+        self.portIndex = PortIndex(self.poolLen)
+        for port in self.allocatedPorts:
+            self.portIndex.update(port - self.portBase, self.allocatedPorts[port][1])
     
     def nextPort(self):
         '''
@@ -243,6 +636,7 @@ class SymmetricNat(Nat):
         Runs in O(portNum) in worst case but in average it runs fast since to take it longer
         there would have to be a long block of allocated non-expired connections - this is implemented 
         as it would be in routers with incremental/random allocation without more complex state structures. 
+        See SymmetricIncrementalNat for O(log n) lookup using PortIndex.
         '''
         tries=0                                                # pool exhaustion check
         port=-1
@@ -258,6 +652,7 @@ class SymmetricNat(Nat):
                     if (tup[0] != None):
                             del self.allocations[tup[0]]       # expired -> delete from allocation table
                     del self.allocatedPorts[port]              # delete from allocation set
+                    if self.portIndex != None: self.portIndex.update(port - self.portBase, PortIndex.FREE)
                     break                                      # slot is free now, can allocate
                 else: continue                       # slot is in use, continue with search
             else: break                              # slot is free, assign
@@ -278,6 +673,8 @@ class SymmetricNat(Nat):
         '''
         q = Quartet(srcIP, srcPort, dstIP, dstPort)
         if timeAdd == None: timeAdd = timeNow
+        # Timeout all expired entries - amortized O(1) with the timer wheel
+        self.cleanHeap(timeNow)
         
         # Check for existing allocation for a given quartet
         if q in self.allocations:
@@ -287,8 +684,10 @@ class SymmetricNat(Nat):
             if (tup[1] + self.timeout) < timeNow:
                 del self.allocatedPorts[port]     # delete from allocation set
                 del self.allocations[q]           # expired -> delete from allocation table
+                if self.portIndex != None: self.portIndex.update(port - self.portBase, PortIndex.FREE)
             else:
-                self.allocatedPorts[port] = (q, timeAdd)    # update last query access
+                self.allocatedPorts[port] = (tup[0], timeAdd)   # update last query access, keep quartet of the record
+                if self.portIndex != None: self.portIndex.update(port - self.portBase, timeAdd)
                 return port                                 # external port returned
         
         # If here -> not in allocation list, create a new allocation
@@ -301,47 +700,87 @@ class SymmetricNat(Nat):
         # Create a new allocation
         self.allocatedPorts[port] = (q, timeAdd)
         self.allocations[q] = port
-        # Add to heap
-        heappush(self.expireHeap, (timeAdd, port, q))
-        # Timeout all entries - internal table cleaning with probability 1:100
-        if random.randint(0, 100) == 0:
-            self.cleanHeap(timeNow)
+        if self.portIndex != None: self.portIndex.update(port - self.portBase, timeAdd)
+        # Schedule expiration
+        self.expireWheel.schedule(timeAdd + self.timeout, (timeAdd, port, q, None))
         return port
     
     def occupy(self, num, timeNow):
         '''
-        Simulates another connections created randomly
+        Simulates another connections created randomly.
+        All ports allocated by one call share one expiration record.
         '''
+        self.cleanHeap(timeNow)
+        ports = []
         for i in range(0, num):
             port = self.nextFreePort(timeNow)
             self.allocatedPorts[port] = (None, timeNow)
-            heappush(self.expireHeap, (timeNow, port, None))   # Add to heap
+            if self.portIndex != None: self.portIndex.update(port - self.portBase, timeNow)
+            ports.append(port)
+        if len(ports) > 0:
+            self.expireWheel.schedule(timeNow + self.timeout, (timeNow, ports[0], None, ports))
         return 1
     
+    def occupyPorts(self, ports, timeNow):
+        '''
+        Registers anonymous allocations for given free ports at once, with one expiration record.
+        Contiguous run of ports should be passed as range(), port index is then updated in one step.
+        '''
+        if len(ports) == 0: return
+        self.allocatedPorts.update(dict.fromkeys(ports, (None, timeNow)))
+        if self.portIndex != None:
+            if isinstance(ports, range):
+                self.portIndex.assign(ports[0] - self.portBase, ports[-1] - self.portBase + 1, timeNow)
+            else:
+                for port in ports: self.portIndex.update(port - self.portBase, timeNow)
+        self.expireWheel.schedule(timeNow + self.timeout, (timeNow, ports[0], None, ports))
+    
+    def releasePort(self, port):
+        '''
+        Removes (expired) allocation of the port from NAT tables.
+        '''
+        tup = self.allocatedPorts.pop(port)
+        if (tup[0] != None):
+            del self.allocations[tup[0]]                    # expired -> delete from allocation table
+        if self.portIndex != None: self.portIndex.update(port - self.portBase, PortIndex.FREE)
+    
     def freePorts(self):
         return (self.poolLen - len(self.allocatedPorts))
     
     def cleanHeap(self, timeNow):
         '''
-        Performs timeouting for all expired records - based on priority queue on access time
+        Performs timeouting for all expired records - based on expiration timer wheel.
+        Record of allocation refreshed in the meantime is rescheduled to its new expiration time,
+        records of allocations already gone are dropped.
         '''
-        while(len(self.expireHeap) > 0):
-            cur, port, q = self.expireHeap[0]
-            if (cur + self.timeout) >= timeNow: break   # if minimal is not expired -> return
+        for rec in self.expireWheel.advance(timeNow):
+            cur, port, q, ports = rec
+            if ports != None:
+                # Bulk record from occupy() - clean ports still holding this allocation
+                if (cur + self.timeout) >= timeNow:
+                    self.expireWheel.schedule(cur + self.timeout, rec)
+                    continue
+                anon = (None, cur)
+                dead = [p for p in ports if self.allocatedPorts.get(p) == anon]
+                for p in dead: del self.allocatedPorts[p]
+                if self.portIndex != None:
+                    if len(dead) == len(ports) and isinstance(ports, range):
+                        self.portIndex.assign(ports[0] - self.portBase, ports[-1] - self.portBase + 1, PortIndex.FREE)
+                    else:
+                        for p in dead: self.portIndex.update(p - self.portBase, PortIndex.FREE)
+                continue
             
-            # Expired - does it exist in real allocation table?
-            if port in self.allocatedPorts \
-                and cur == self.allocatedPorts[port][1] \
-                and q   == self.allocatedPorts[port][0]:
-                
+            # Does the allocation still exist in real allocation table?
+            tup = self.allocatedPorts.get(port)
+            if tup == None or tup[0] is not q: continue
+            if (tup[1] + self.timeout) < timeNow:
                 # Record exists and is expired, thus clean it
-                if (q != None):
-                    del self.allocations[q]             # expired -> delete from allocation table
+                del self.allocations[q]                 # expired -> delete from allocation table
                 del self.allocatedPorts[port]           # delete from allocation set
-            # Remove element from queue
-            heappop(self.expireHeap)
-            #sys.stdout.write("X")
-        #sys.stdout.flush()
+                if self.portIndex != None: self.portIndex.update(port - self.portBase, PortIndex.FREE)
+            else:
+                # refreshed - wait for the new expiration time
+                self.expireWheel.schedule(tup[1] + self.timeout, (tup[1], port, q, None))
     
     def trulyFreePorts(self, timeNow):
         self.cleanHeap(timeNow)
@@ -355,19 +794,156 @@ class SymmetricRandomNat(SymmetricNat):
         '''
         Randomly generates index to a pool and returns a port on the index.
         '''
-        return self.pool[random.randint(0, self.poolLen-1)]
+        return self.pool[int(self.rng.integers(0, self.poolLen))]
     
     def peekPort(self, prev=None):
         return (self.nextPort(), None)
     
+    def occupy(self, num, timeNow):
+        '''
+        Allocates num random free ports at once. Pool indices are drawn in bulk,
+        duplicates and used ports are dropped keeping the draw order, which gives the
+        same distribution as drawing ports one by one until a free one is found.
+        '''
+        self.cleanHeap(timeNow)
+        ports  = []
+        chosen = set()
+        thr    = timeNow - self.timeout
+        while len(ports) < num:
+            need  = num - len(ports)
+            free  = max(1, self.poolLen - len(self.allocatedPorts) - len(chosen))
+            draws = min(4*self.poolLen, max(16, int(need * 1.25 * self.poolLen / free)))
+            cand  = self.rng.integers(0, self.poolLen, size=draws)
+            u, first = np.unique(cand, return_index=True)
+            found = 0
+            for i in cand[np.sort(first)]:
+                port = self.pool[i]
+                if port in chosen: continue
+                tup = self.allocatedPorts.get(port)
+                if tup != None:
+                    if tup[1] >= thr: continue             # slot is in use
+                    self.releasePort(port)                 # expired, free it
+                chosen.add(port)
+                ports.append(port)
+                found += 1
+                if found == need: break
+            if found == 0:
+                print("Port pool exhausted")
+                raise Exception("Port pool exhausted")
+        self.occupyPorts(ports, timeNow)
+        return 1
+    
 class SymmetricIncrementalNat(SymmetricNat):
     # index of last allocated port. Index to pool[]
     lastPort = 0
+    # last free slot lookup (pool index, lastPort, valid until). Result does not change until the iterator 
+    # moves, the slot gets allocated or some slot skipped on the way expires.
+    freeCache = None
     
+    def init(self, params=None):
+        '''
+        params['portIndex'] = True switches free port lookup to PortIndex (O(log n)),
+        otherwise ports are probed linearly.
+        '''
+        super(SymmetricIncrementalNat, self).init(params)
+        if params != None and params.get('portIndex'): self.usePortIndex()
+
     def reset(self):
         super(SymmetricIncrementalNat, self).reset()
         self.lastPort = 0
+        self.freeCache = None
+        
+    def findFreeIndex(self, timeNow):
+        '''
+        Returns (pool index of next free slot, time until which the result holds).
+        Result holds while all slots skipped on the way are still in use, i.e. up to the earliest
+        expiration among them. Uses PortIndex, falls back to linear probing if disabled.
+        '''
+        thr   = timeNow - self.timeout                     # (t + timeout) < timeNow  <=>  t < thr
+        start = (self.lastPort + 1) % self.poolLen
+        if self.portIndex == None:
+            until = float('inf')
+            idx   = start
+            for tries in range(1, self.poolLen):
+                tup = self.allocatedPorts.get(self.pool[idx])
+                if tup == None or tup[1] < thr: return (idx, until)
+                if tup[1] + self.timeout < until: until = tup[1] + self.timeout
+                idx = (idx + 1) % self.poolLen
+            print("Port pool exhausted")
+            raise Exception("Port pool exhausted")
+
+        idx   = self.portIndex.findFree(start, thr)
+        if idx == -1 and start > 0:
+            idx = self.portIndex.findFree(0, thr)          # wrap around the pool
+        if idx == -1:
+            print("Port pool exhausted")
+            raise Exception("Port pool exhausted")
+        if idx >= start: busy = self.portIndex.rangeMin(start, idx)
+        else:            busy = min(self.portIndex.rangeMin(start, self.poolLen), self.portIndex.rangeMin(0, idx))
+        return (idx, busy + self.timeout)
+
+    def nextFreePort(self, timeNow, peek=False):
+        '''
+        Returns next free port in the sequence, see findFreeIndex().
+        Slot is free if it was never allocated or if its last access is older than timeout.
         
+        The lookup is cached - repeated calls without allocation (e.g. peekNext() in samplers) 
+        or allocation right after peekNext() do not search the pool again.
+        '''
+        c = self.freeCache
+        if c != None and c[1] == self.lastPort and timeNow <= c[2]:
+            tup = self.allocatedPorts.get(self.pool[c[0]])
+            if tup != None and (tup[1] + self.timeout) >= timeNow: c = None    # slot taken meanwhile
+        else: c = None
+        if c == None:
+            idx, until = self.findFreeIndex(timeNow)
+            self.freeCache = (idx, self.lastPort, until)
+        else:
+            idx = c[0]
+
+        port = self.pool[idx]
+        if port in self.allocatedPorts:
+            self.releasePort(port)                         # expired allocation, free it
+        # reflect to internal NAT state - move iterator
+        if peek==False:
+            self.lastPort = idx
+        return port
+
+    def occupy(self, num, timeNow):
+        '''
+        Allocates num next free ports. With PortIndex enabled, whole runs of free ports
+        are allocated at once - cost depends on number of runs of occupied ports on the way
+        (and expired allocations to be cleaned), not on num.
+        '''
+        if self.portIndex == None:
+            return super(SymmetricIncrementalNat, self).occupy(num, timeNow)
+
+        self.cleanHeap(timeNow)
+        thr   = timeNow - self.timeout
+        stale = -sys.float_info.max                        # matches any allocated slot
+        while num > 0:
+            start = (self.lastPort + 1) % self.poolLen
+            a = self.portIndex.findFree(start, thr)
+            if a == -1 and start > 0:
+                a = self.portIndex.findFree(0, thr)        # wrap around the pool
+            if a == -1:
+                print("Port pool exhausted")
+                raise Exception("Port pool exhausted")
+            # end of the run of usable slots, run does not wrap
+            b = self.portIndex.findBusy(a, thr)
+            if b == -1: b = self.poolLen
+            b = min(b, a + num)
+            # free expired allocations inside the run
+            i = self.portIndex.findBusy(a, stale)
+            while i != -1 and i < b:
+                self.releasePort(self.pool[i])
+                i = self.portIndex.findBusy(i+1, stale)
+
+            self.occupyPorts(range(self.pool[a], self.pool[a] + (b-a)), timeNow)
+            self.lastPort = b-1
+            num -= b-a
+        return 1
+
     def nextPort(self):
         '''
         Uses port pool array and pointer to last allocated port to obtain next in the sequence.
@@ -384,6 +960,338 @@ class SymmetricIncrementalNat(SymmetricNat):
         tmp = (prev + 1) % self.poolLen # linear port allocation rule here
         return (self.pool[tmp], tmp)           # just a shortcut
 
+class SymmetricArrayNat(Nat):
+    '''
+    Base class for symmetric NAT with compact array-backed state.
+    
+    Pool slot state is kept in NumPy arrays - last access time and owner quartet key.
+    Quartet is packed to an integer key: id of (srcIP, dstIP) pair << 32 | srcPort << 16 | dstPort.
+    Expiration is evaluated from slot access time on demand, so no expire heap is needed.
+    
+    Slots are stamped with a generation number, reset() only starts a new generation
+    and slots from older generations are treated as free - reset is O(1).
+    '''
+    FREE = float('-inf')
+    ANON = -1
+    # current generation, incremented by reset()
+    generation = 1
+    # pool index -> generation of the last allocation; slot is free if it differs from current one
+    portGen = None
+    # pool index -> last access time, FREE = free slot
+    portTime = None
+    # pool index -> quartet key of the allocation, ANON for anonymous ones (occupy)
+    portOwner = None
+    # allocation table; key = quartet key; value = pool index. Validated against portOwner on access.
+    allocations = None
+    # (srcIP, dstIP) -> id used in quartet keys, kept across resets. Quartets with ports out of 0..65535
+    # get an id of their own, keyed by the whole quartet.
+    hostPairs = None
+    # allocation table and host pair ids are dropped on reset only if they grow over this size 
+    # (all allocation entries are stale then)
+    compactSize = 65536
+    
+    def init(self, params=None):
+        self.pool = list(range(1025, 65536))
+        self.poolLen = len(self.pool)
+        self.generation = 1
+        self.portGen = np.zeros(self.poolLen, dtype=np.int64)
+        self.portTime = np.full(self.poolLen, self.FREE)
+        self.portOwner = np.full(self.poolLen, self.ANON, dtype=np.int64)
+        self.allocations = {}
+        self.hostPairs = {}
+    
+    def reset(self):
+        self.generation += 1
+        if len(self.allocations) > self.compactSize or len(self.hostPairs) > self.compactSize:
+            self.allocations = {}
+            self.hostPairs = {}
+    
+    def usable(self, idx, thr):
+        '''
+        Returns boolean mask of slots (index, slice or index array) free at time thr (last access < thr).
+        '''
+        return (self.portGen[idx] != self.generation) | (self.portTime[idx] < thr)
+    
+    def occupySlots(self, idx, timeNow):
+        '''
+        Marks slots (slice or index array) as anonymous allocations.
+        '''
+        self.portGen[idx]   = self.generation
+        self.portTime[idx]  = timeNow
+        self.portOwner[idx] = self.ANON
+    
+    def quartetKey(self, srcIP, srcPort, dstIP, dstPort):
+        '''
+        Packs quartet to an integer key. Ports have to fit to 16 bits, quartet with a port
+        out of range gets a host pair id of its own with zero ports in the key.
+        '''
+        srcPort, dstPort = int(srcPort), int(dstPort)
+        if 0 <= srcPort <= 0xFFFF and 0 <= dstPort <= 0xFFFF:
+            pair = (srcIP, dstIP)
+        else:
+            pair = (srcIP, srcPort, dstIP, dstPort)
+            srcPort, dstPort = 0, 0
+        pid = self.hostPairs.get(pair)
+        if pid == None:
+            pid = len(self.hostPairs)
+            self.hostPairs[pair] = pid
+        return (pid << 32) | (srcPort << 16) | dstPort
+    
+    def nextFreeIndex(self, timeNow, peek=False):
+        '''
+        Returns pool index of next free slot, moves allocation iterator if peek is False.
+        '''
+        raise Exception("Not implemented yet... This class is abstract, you have to override this method in a subclass")
+    
+    def nextFreePort(self, timeNow, peek=False):
+        return self.pool[self.nextFreeIndex(timeNow, peek)]
+    
+    def peekNext(self, timeNow):
+        return self.nextFreePort(timeNow, True)
+    
+    def alloc(self, srcIP, srcPort, dstIP, dstPort, timeNow, timeAdd=None, refreshOnly=False):
+        '''
+        Basic allocation method for new connection
+        '''
+        key = self.quartetKey(srcIP, srcPort, dstIP, dstPort)
+        if timeAdd == None: timeAdd = timeNow
+        
+        # Check for existing allocation for a given quartet, slot may have been reused or expired
+        idx = self.allocations.get(key)
+        if idx != None:
+            if self.portGen[idx] == self.generation and self.portOwner[idx] == key \
+                and (self.portTime[idx] + self.timeout) >= timeNow:
+                self.portTime[idx] = timeAdd                # update last query access
+                return self.pool[idx]                       # external port returned
+            del self.allocations[key]
+        
+        # New allocation is created only if desired
+        if refreshOnly: return -1
+        
+        idx = self.nextFreeIndex(timeNow)
+        self.portGen[idx]   = self.generation
+        self.portTime[idx]  = timeAdd
+        self.portOwner[idx] = key
+        self.allocations[key] = idx
+        return self.pool[idx]
+    
+    def freePorts(self):
+        return self.poolLen - int(np.count_nonzero((self.portGen == self.generation) & (self.portTime != self.FREE)))
+    
+    def cleanHeap(self, timeNow):
+        '''
+        Marks all expired slots as free.
+        '''
+        self.portTime[self.portTime < (timeNow - self.timeout)] = self.FREE
+    
+    def trulyFreePorts(self, timeNow):
+        self.cleanHeap(timeNow)
+        return self.freePorts()
+
+class SymmetricArrayRandomNat(SymmetricArrayNat):
+    '''
+    Symmetric NAT with random allocation function, array-backed state
+    '''
+    def nextFreeIndex(self, timeNow, peek=False):
+        thr = timeNow - self.timeout
+        for tries in range(0, self.poolLen+1):
+            idx = int(self.rng.integers(0, self.poolLen))
+            if self.portGen[idx] != self.generation or self.portTime[idx] < thr: return idx
+        print("Port pool exhausted")
+        raise Exception("Port pool exhausted")
+    
+    def occupy(self, num, timeNow):
+        '''
+        Allocates num random free slots at once, see SymmetricRandomNat.occupy().
+        '''
+        thr = timeNow - self.timeout
+        while num > 0:
+            free = np.count_nonzero(self.usable(slice(None), thr))
+            if free == 0:
+                print("Port pool exhausted")
+                raise Exception("Port pool exhausted")
+            draws = min(4*self.poolLen, max(16, int(num * 1.25 * self.poolLen / free)))
+            cand  = self.rng.integers(0, self.poolLen, size=draws)
+            cand  = cand[self.usable(cand, thr)]
+            u, first = np.unique(cand, return_index=True)
+            cand  = cand[np.sort(first)][0:num]
+            self.occupySlots(cand, timeNow)
+            num -= len(cand)
+        return 1
+
+class SymmetricArrayIncrementalNat(SymmetricArrayNat):
+    '''
+    Symmetric NAT with incremental allocation function, array-backed state
+    '''
+    # index of last allocated port. Index to pool[]
+    lastPort = 0
+    # number of slots checked at once when searching for a free slot, grows during the search
+    scanWindow = 256
+    
+    # last free slot lookup (pool index, lastPort, valid until), see SymmetricIncrementalNat
+    freeCache = None
+    
+    def reset(self):
+        super(SymmetricArrayIncrementalNat, self).reset()
+        self.lastPort = 0
+        self.freeCache = None
+    
+    def findFree(self, start, thr):
+        '''
+        Returns first pool index >= start with slot usable at time thr (last access < thr), -1 if there is none.
+        '''
+        if start < self.poolLen and (self.portGen[start] != self.generation or self.portTime[start] < thr): return start
+        w = self.scanWindow
+        i = start
+        while i < self.poolLen:
+            j = min(self.poolLen, i + w)
+            m = self.usable(slice(i, j), thr)
+            k = int(m.argmax())
+            if m[k]: return i + k
+            i = j
+            w *= 4
+        return -1
+    
+    def nextFreeIndex(self, timeNow, peek=False):
+        thr   = timeNow - self.timeout
+        c = self.freeCache
+        if c != None and c[1] == self.lastPort and timeNow <= c[2] and self.usable(c[0], thr):
+            idx = c[0]
+        else:
+            start = (self.lastPort + 1) % self.poolLen
+            idx   = self.findFree(start, thr)
+            if idx == -1 and start > 0:
+                idx = self.findFree(0, thr)                # wrap around the pool
+            if idx == -1:
+                print("Port pool exhausted")
+                raise Exception("Port pool exhausted")
+            # slots skipped on the way are all in use, result holds until the first of them expires
+            if idx >= start: busy = self.portTime[start:idx]
+            else:            busy = np.concatenate((self.portTime[start:], self.portTime[0:idx]))
+            until = (float(busy.min()) + self.timeout) if len(busy) > 0 else float('inf')
+            self.freeCache = (idx, self.lastPort, until)
+        if peek==False:
+            self.lastPort = idx
+        return idx
+    
+    def occupy(self, num, timeNow):
+        '''
+        Allocates num next free slots, whole runs of free slots at once.
+        '''
+        thr = timeNow - self.timeout
+        while num > 0:
+            a = self.nextFreeIndex(timeNow, True)
+            m = ~self.usable(slice(a, a+num), thr)
+            b = a + (int(m.argmax()) if m.any() else len(m))
+            self.occupySlots(slice(a, b), timeNow)
+            self.lastPort = b-1
+            num -= b-a
+        return 1
+
+def getNat(desc, params=None):
+    '''
+    Returns initialized NAT according to string identifier
+    '''
+    if desc == 'random':
+        nat = SymmetricRandomNat()
+    elif desc == 'array':
+        nat = SymmetricArrayIncrementalNat()
+    elif desc == 'arrayrandom':
+        nat = SymmetricArrayRandomNat()
+    else:
+        nat = SymmetricIncrementalNat()
+    nat.init(params)
+    return nat
+
+#
+# Move tables of deterministic strategies, cached across rounds.
+# Returned arrays are read-only, they are shared between strategy instances.
+#
+def readOnly(a):
+    a.flags.writeable = False
+    return a
+
+@functools.lru_cache(maxsize=8)
+def ijTable(steps=1500):
+    '''
+    IJ strategy offsets - every second port.
+    '''
+    return readOnly(np.arange(0, 2*steps, 2, dtype=np.int64))
+
+@functools.lru_cache(maxsize=8)
+def binomialTable(steps=1000):
+    '''
+    Binomial strategy offsets - expected values, round(1.5*step).
+    '''
+    return readOnly(np.round(1.5 * np.arange(0, steps)))
+
+@functools.lru_cache(maxsize=64)
+def simpleBaseTable(lmbd, t, steps=1000):
+    '''
+    Simple strategy offsets before probabilistic rounding, E[X] = step * (1 + lambda * T).
+    '''
+    return readOnly(np.arange(0, steps) * (1 + lmbd * t))
+
+@functools.lru_cache(maxsize=64)
+def poissonRates(lmbd, t, coe, steps=3001):
+    '''
+    Poisson strategy rates for steps, lambda * T * (1 + step * coe).
+    '''
+    return readOnly(lmbd * t * (1.0 + np.arange(0, steps) * coe))
+
+#
+# Probability mass tables of fitted models, cached across fits.
+#
+@functools.lru_cache(maxsize=1024)
+def pmfTable(dist, params, bins, shift=0):
+    '''
+    Probability mass function of a model over bins 0..bins-1, i.e. pmf(i+shift) for i in 0..bins-1.
+    dist is 'poisson' (params=(lambda,)), 'binom' (params=(n, p)) or 'nbinom' (params=(n, p)).
+    '''
+    k = np.arange(shift, shift+bins)
+    if dist == 'poisson':  return readOnly(poisson.pmf(k, *params))
+    elif dist == 'binom':  return readOnly(binom.pmf(k, *params))
+    elif dist == 'nbinom': return readOnly(nbinom.pmf(k, *params))
+    raise Exception("Unknown distribution %s" % dist)
+
+@functools.lru_cache(maxsize=16)
+def portPmfTable(rate, steps, ports, exclude=()):
+    '''
+    Exact port distribution of the process sampled by NatSimulation.portDistributionFunction().
+    Row i is pmf of port reached in step i (0..steps) over ports 0..ports-1, each step adds 1 + Po(rate) ports.
+    
+    Without excluded ports, port in step i is i + Po(i*rate). With excluded ports the process is a Markov chain
+    over ports and runs hitting an excluded port (below ports, in steps 1..steps) are rejected, as in sampling.
+    The distribution is thus conditioned on the whole run - probability of reaching port p in step i without
+    rejection (forward pass) is multiplied by probability of no rejection in the rest of the run (backward pass).
+    '''
+    k = np.arange(ports)
+    if len(exclude) == 0:
+        i = np.arange(steps+1)
+        return readOnly(poisson.pmf(k[None,:] - i[:,None], i[:,None] * rate))
+    
+    # increments 1 + Po(rate), truncated where the tail is negligible
+    jmax = min(ports, int(rate + 12*math.sqrt(rate)) + 30)
+    q = np.zeros(jmax + 2)
+    q[1:] = poisson.pmf(np.arange(0, jmax+1), rate)
+    ok = np.ones(ports)
+    ok[[e for e in exclude if 0 <= e < ports]] = 0
+    
+    # forward pass, F[i, p] = P(port p in step i, no rejection so far)
+    F = np.zeros((steps+1, ports))
+    F[0, 0] = 1
+    for i in range(1, steps+1):
+        F[i] = np.convolve(F[i-1], q)[0:ports] * ok
+    
+    # backward pass, G[i, p] = P(no rejection in steps i+1..steps | port p in step i). 
+    # Runs leaving the port range are not rejected anymore.
+    G = np.ones((steps+1, ports))
+    h = np.ones(ports + len(q))
+    for i in range(steps-1, -1, -1):
+        h[0:ports] = G[i+1] * ok
+        G[i] = np.correlate(h, q, 'valid')[0:ports]
+    return readOnly(F * G / G[0, 0])
+
 class TheirStragegy(Strategy):
     '''
     Strategy of changing source port - published by other team
@@ -401,6 +1309,9 @@ class TheirStragegy(Strategy):
     def next(self, party, step):
         if party==0: return (step,self.delta[0])
         if party==1: return (step,self.delta[1])
+    
+    def moves(self, party, steps):
+        return (np.arange(0, steps, dtype=np.int64), np.full(steps, self.delta[party], dtype=np.int64))
 
 class IJStragegy(Strategy):
     startPos=[1025,1025]
@@ -408,15 +1319,7 @@ class IJStragegy(Strategy):
     def init(self, params=None):
         pass
     def reset(self, nats=[], sim=None, params=[]):
-        self.b = []
-        c = 0
-        for step in range(0, 1500):
-            self.b.append(c)
-            #c = NatSimulation.poisson(sim.lmbd, 2 * sim.portScanInterval * (step))
-            #c += int(2.0 * sim.lmbd * sim.portScanInterval)
-            c += 2
-            #c += random.randint(0, 2)
-            #print "step=",step, "smpl=", sim.lmbd * 2 * sim.portScanInterval * (step)
+        self.b = ijTable(1500)   # c += 2 each step, cached
         
     def silent(self,  time1, time2, lmbd):
         #self.startPos=[int(lmbd * time1), int(lmbd * time2)]
@@ -427,6 +1330,10 @@ class IJStragegy(Strategy):
         if party==0: return (1025, int(self.startPos[0]+self.b[step]))
         if party==1: return (1025, int(self.startPos[1]+self.b[step]))
     
+    def moves(self, party, steps):
+        if steps > len(self.b): return super(IJStragegy, self).moves(party, steps)
+        return (np.full(steps, 1025, dtype=np.int64), int(self.startPos[party]) + self.b[0:steps])
+    
 class I2JStragegy(Strategy):
     '''
     Baby step, giant step strategy for low noise links. Works 100 % if lmbd*time is low.
@@ -462,6 +1369,9 @@ class I2JStragegy(Strategy):
         
         if party==0: return (1025, int(self.startPos[0]+step )) #int(self.startPos[0]+step-150*(step/100)))
         if party==1: return (1025, int(self.startPos[0]+2*step )) #int(self.startPos[1]+2*step-230*(step/100)))
+    
+    def moves(self, party, steps):
+        return (np.full(steps, 1025, dtype=np.int64), int(self.startPos[0]) + (party+1) * np.arange(0, steps, dtype=np.int64))
 
 class SimpleStrategy(Strategy):
     '''
@@ -475,12 +1385,8 @@ class SimpleStrategy(Strategy):
     def init(self, params=None):
         pass
     def reset(self, nats=[], sim=None, params=[]):
-        self.b = []
-        for step in range(0, 1000):
-            x = step * (1 + sim.lmbd * sim.portScanInterval)
-            x = probRound(x)    # probabilistic rounding
-            #x = round(x)
-            self.b.append(x)
+        # step * (1 + lambda * T), probabilistic rounding
+        self.b  = probRoundArr(simpleBaseTable(sim.lmbd, sim.portScanInterval, 1000), self.rng)
         self.ln = len(self.b)
         
     def silent(self,  time1, time2, lmbd):
@@ -491,6 +1397,11 @@ class SimpleStrategy(Strategy):
     def next(self, party, step):
         if party==0: return (1025, int(round(self.startPos[0]+self.b[min(step, self.ln-1)])))
         if party==1: return (1025, int(round(self.startPos[1]+self.b[min(step, self.ln-1)])))
+    
+    def moves(self, party, steps):
+        idx = np.minimum(np.arange(0, steps), self.ln-1)
+        dst = np.round(self.startPos[party] + self.b[idx])
+        return (np.full(steps, 1025, dtype=np.int64), dst.astype(np.int64))
         
 class FiboStrategy(Strategy):
     '''
@@ -570,7 +1481,7 @@ class BinomialStrategy(Strategy):
                 p  = (ex-vx) / ex
                 n  = ex / p
                 
-                x = np.random.binomial(n, p)  # (1+step*self.coef)
+                x = self.rng.binomial(n, p)  # (1+step*self.coef)
             
             # probabilistic rounding
             x = round(x)
@@ -582,7 +1493,8 @@ class BinomialStrategy(Strategy):
         return b
                 
     def gen(self):
-        self.b = [self.genPart(0), self.genPart(1)]
+        # sampling branch in genPart() is disabled (step > 1000 never holds), tables are deterministic
+        self.b = [binomialTable(1000), binomialTable(1000)]
         
     def silent(self,  time1, time2, lmbd):
         self.lmbd = lmbd
@@ -591,6 +1503,11 @@ class BinomialStrategy(Strategy):
     
     def next(self, party, step):
         return (0, int(self.startPos[party] + self.b[party][min(step, len(self.b[party])-1)]))
+    
+    def moves(self, party, steps):
+        idx = np.minimum(np.arange(0, steps), len(self.b[party])-1)
+        dst = self.startPos[party] + self.b[party][idx]
+        return (np.zeros(steps, dtype=np.int64), dst.astype(np.int64))
 
 class PoissonStrategy(Strategy):
     '''
@@ -608,9 +1525,20 @@ class PoissonStrategy(Strategy):
     #coef = 1.4127
     coef = 1.1772
     
+    # Move tables drawn in bulk by genTable(), one row per party and round, used by gen().
+    # Table is redrawn when used up or when lambda / port scan interval changes.
+    # Bulk of tableRows rows is drawn only from a generator already used for the previous table,
+    # with a new generator each round (seeded per round substreams) just one round is drawn.
+    tableRows = 64
+    table     = None
+    tableIdx  = 0
+    tableKey  = None
+    tableRng  = None
+    
     b = [[],[]]
     def init(self, params=None): 
         #self.reset()
+        self.table = None
         self.gen()
         #print self.b[0], "len=", len(self.b[0])
     
@@ -620,7 +1548,7 @@ class PoissonStrategy(Strategy):
         if len(nats)==2: self.nats = nats
         if self.sim!=None: self.lmbd = sim.lmbd
         
-        self.gen()
+        # move tables are taken in silent(), no need to generate them here
         pass
     
     def coe(self, x):
@@ -655,7 +1583,7 @@ class PoissonStrategy(Strategy):
         seen_add = seen.add
         
         for step in range(0, 3001):
-            x = int(  np.random.poisson(lmbd * t * (1.0+step*self.coe(lmbd*t)))  )
+            x = int(  self.rng.poisson(lmbd * t * (1.0+step*self.coe(lmbd*t)))  )
             #x = int(  np.random.poisson(lmbd * t * (1.0+step*self.coef))  )
             #x = round(  np.random.poisson(float(step) * (1.0 + lmbd*t))  )
             
@@ -674,8 +1602,35 @@ class PoissonStrategy(Strategy):
         #b = f7(b)
         return b
                 
+    def tableParams(self):
+        '''
+        Returns (lambda, port scan interval) the move tables are generated for.
+        '''
+        lmbd = self.sim.lmbd if self.sim!=None else self.lmbd
+        t    = self.sim.portScanInterval if self.sim != None else 10
+        return (lmbd, t)
+    
+    def genTable(self, rows):
+        '''
+        Draws rows move tables at once, equivalent to genPart() called for each row:
+        Poisson samples for all 3001 steps, first occurrences kept in order, cut after 1101
+        elements. Rows are padded with their last element, next() gives the same moves.
+        '''
+        lmbd, t = self.tableParams()
+        rates = poissonRates(lmbd, t, self.coe(lmbd*t))
+        X = self.rng.poisson(rates, size=(rows, len(rates)))
+        self.table    = f7rows(X, 1101, self.dupl)
+        self.tableIdx = 0
+        self.tableKey = (lmbd, t, self.dupl)
+    
     def gen(self):
-        self.b = [self.genPart(0), self.genPart(1)]
+        lmbd, t = self.tableParams()
+        if self.table is None or self.tableKey != (lmbd, t, self.dupl) or self.tableIdx + 2 > len(self.table) \
+            or self.tableRng is not self.rng:
+            self.genTable(self.tableRows if self.tableRng is self.rng else 2)
+            self.tableRng = self.rng
+        self.b = [self.table[self.tableIdx], self.table[self.tableIdx+1]]
+        self.tableIdx += 2
         
     def silent(self,  time1, time2, lmbd):
         self.lmbd = lmbd
@@ -690,6 +1645,10 @@ class PoissonStrategy(Strategy):
         
         #self.startPos[party] += 1+NatSimulation.poisson(self.lmbd, 10)#*(1+step*0.77))
         #return (0, int(self.startPos[party]))
+    
+    def moves(self, party, steps):
+        idx = np.minimum(np.arange(0, steps), len(self.b[party])-1)
+        return (np.full(steps, 1025, dtype=np.int64), int(self.startPos[party]) + self.b[party][idx])
 
 def getStrategy(desc, verbose=0):
     '''
@@ -720,22 +1679,97 @@ def getStrategy(desc, verbose=0):
     
     return strategy
 
-def nfline2tuple(line):
+class NfTimeParser(object):
     '''
-    Translates nfdump line of a format "fmt:%%ts;%%td;%%pr;%%sa;%%sp;%%da;%%dp" to a tuple defined by the format
+    Decoder of nfdump %ts time stamps of a fixed format "YYYY-MM-DD HH:MM:SS.mmm" to unix time in ms (UTC).
+    
+    Records are nearly sorted by time, so many consecutive records share the same second.
+    Time of the last seen date and second prefix is cached, only milliseconds are parsed then.
+    Time stamps of other formats are parsed by strptime.
     '''
-    tpl = [str(x).strip() for x in line.split(";")]
-    tstart = tpl[0]
+    
+    # formats accepted by the slow path
+    formats = ['%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S']
+    
+    # cached date prefix "YYYY-MM-DD" and its time in ms
+    dayKey = None
+    dayMs  = 0
+    
+    # cached second prefix "YYYY-MM-DD HH:MM:SS" and its time in ms
+    secKey = None
+    secMs  = 0
+    
+    def parse(self, ts):
+        '''
+        Converts time stamp string to unix time in ms.
+        '''
+        if len(ts) == 23 and ts[19] == '.' and ts[10] == ' ' and ts[4] == '-' and ts[7] == '-':
+            key = ts[:19]
+            if key != self.secKey:
+                if ts[:10] != self.dayKey:
+                    self.dayMs  = calendar.timegm((int(ts[0:4]), int(ts[5:7]), int(ts[8:10]), 0, 0, 0)) * 1000
+                    self.dayKey = ts[:10]
+                self.secMs  = self.dayMs + (int(ts[11:13]) * 3600 + int(ts[14:16]) * 60 + int(ts[17:19])) * 1000
+                self.secKey = key
+            return self.secMs + int(ts[20:23])
+        return self.parseSlow(ts)
+    
+    def parseSlow(self, ts):
+        '''
+        Converts time stamp string of any of formats to unix time in ms.
+        '''
+        for fmt in self.formats:
+            try:
+                return NatSimulation.dtimeToUtc(datetime.datetime.strptime(ts, fmt))
+            except ValueError:
+                pass
+        raise ValueError('Unknown nfdump time stamp format: "%s"' % ts)
+    
+    def parseArr(self, tsArr):
+        '''
+        Converts array of time stamp strings to NumPy int64 array of unix times in ms.
+        Whole block is converted by NumPy datetime64, on any non-ISO time stamp falls back to parse().
+        '''
+        try:
+            return np.array(tsArr, dtype='datetime64[ms]').astype(np.int64)
+        except ValueError:
+            return np.array([self.parse(x) for x in tsArr], dtype=np.int64)
+
+# Time stamp parser shared by the nfdump readers
+nfTimeParser = NfTimeParser()
+
+def nfline2tuple(line):
+    '''
+    Translates nfdump line of a format "fmt:%%ts;%%td;%%pr;%%sa;%%sp;%%da;%%dp" to a tuple defined by the format
+    '''
+    if isinstance(line, bytes): line = line.decode()
+    tpl = [x.strip() for x in line.split(";")]
     tdur   = float(tpl[1])
     
-    dtime = dparser.parse(tstart)              # Parse time from nfdump to datetime format
-    startUtc = NatSimulation.dtimeToUtc(dtime) # convert date time string to UTC
+    startUtc = nfTimeParser.parse(tpl[0])      # convert date time string to UTC
     lastData = int(startUtc + round(tdur)) 
     tpl.append(startUtc)
     tpl.append(lastData)
     
     return (tpl, startUtc) 
 
+def nflines2tuples(lines):
+    '''
+    Block version of nfline2tuple(), time stamps of all lines are converted at once.
+    Returns list of (tpl, startUtc), empty lines are skipped.
+    '''
+    tpls = [[x.strip() for x in (line.decode() if isinstance(line, bytes) else line).split(";")] for line in lines]
+    tpls = [x for x in tpls if len(x) > 1]
+    if len(tpls) == 0: return []
+    
+    starts = nfTimeParser.parseArr([x[0] for x in tpls]).tolist()
+    res = []
+    for tpl, startUtc in zip(tpls, starts):
+        tpl.append(startUtc)
+        tpl.append(int(startUtc + round(float(tpl[1]))))
+        res.append((tpl, startUtc))
+    return res
+
 class NfdumpAbstract:
     def deinit(self):
         pass
@@ -746,15 +1780,39 @@ class NfdumpSorter(NfdumpAbstract):
     '''
     Generator for reading a nfdump file by nfdump program, sorted by time of netflow 
     start - sorting on the fly by heap algorithm.
+    
+    With memLimit set, external merge sort is used instead: sorted runs of at most memLimit 
+    records are spilled to temporary files and merged, see externalGenerator().
+    
+    nfdump output is read and parsed by a background thread in large blocks, parsed batches
+    are passed through a bounded queue (see batches()), so nfdump keeps decoding while the 
+    consumer sorts and simulates.
     '''
     proc = None
     once = False
     tout = 300*1000
-    def __init__(self, filename, filt=None, activeTimeout=300*1000):
+    
+    # reader thread, its stop flag and maximum number of parsed batches waiting in the queue
+    reader = None
+    stopped = False
+    queueSize = 16
+    
+    # maximum number of records held in memory by external sort, 0 = heap sort within active timeout
+    memLimit = 0
+    # directory for temporary run files of external sort, None = system default
+    tmpDir = None
+    # size of a block of lines read and parsed at once [B]
+    blockSize = 1 << 20
+    # number of records serialized at once in a run file
+    spillBlock = 4096
+    
+    def __init__(self, filename, filt=None, activeTimeout=300*1000, memLimit=0, tmpDir=None):
         '''
         Initializes object for nfdumpSortedGenerator - creates a nfdump process 
         '''
         if self.once == True: raise Exception('Generator was not de-initialized, may be still running...')
+        self.memLimit = memLimit
+        self.tmpDir   = tmpDir
         
         cmdLine = 'nfdump -q -r "%s" -o "fmt:%%ts;%%td;%%pr;%%sa;%%sp;%%da;%%dp" "%s"' % (filename, filt if filt!=None else "")
         print("nfdump command line used: %s" % cmdLine)
@@ -772,18 +1830,70 @@ class NfdumpSorter(NfdumpAbstract):
     
     def deinit(self):
         '''
-        Kills subprocess if still exists
+        Kills subprocess if still exists, stops the reader thread
         '''
+        self.stopped = True
         if self.proc!=None:
             try:
                 self.proc.kill()
             except Exception:
                 pass
             pass
+            if self.reader!=None: self.reader.join(1.0)
+            self.reader = None
             self.proc = None
             self.once = False
         pass
     
+    def readerThread(self, q):
+        '''
+        Reader thread: reads nfdump output in blocks of blockSize bytes, parses them 
+        and puts batches of records (tpl, startUtc) to the queue. 
+        End of output is marked by None, exception is passed to the consumer.
+        '''
+        try:
+            while not self.stopped:
+                lines = self.proc.stdout.readlines(self.blockSize)
+                if not lines:
+                    break
+                self.enqueue(q, nflines2tuples(lines))
+        except Exception as e:
+            self.enqueue(q, e)
+            return
+        self.enqueue(q, None)
+    
+    def enqueue(self, q, item):
+        '''
+        Blocking put to the queue, gives up when the reader is stopped.
+        '''
+        while not self.stopped:
+            try:
+                q.put(item, True, 0.1)
+                return
+            except queue.Full:
+                pass
+    
+    def batches(self):
+        '''
+        Generator of parsed batches of records (tpl, startUtc) in the order of nfdump output,
+        runs the reader thread.
+        '''
+        q = queue.Queue(self.queueSize)
+        self.stopped = False
+        self.reader  = threading.Thread(target=self.readerThread, args=(q,))
+        self.reader.daemon = True
+        self.reader.start()
+        try:
+            while True:
+                batch = q.get()
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            self.stopped = True
+    
     def generator(self):
         '''
         Generator object producing nfdump lines for a given filename for nfdump file. 
@@ -794,31 +1904,16 @@ class NfdumpSorter(NfdumpAbstract):
         and taking minimal element if have enough elements and sufficient precision. 
         '''    
         if self.once == False: raise Exception('Generator is not initialized...')
-        
-        cnt = 0
-        isDead = False       # is producing program dead?
-        buff   = []
-        while(True):         # while there is something to run
-            cnt += 1
-            retcode = self.proc.poll() #returns None while subprocess is running
-            line = self.proc.stdout.readline()
-            
-            # Flag determines whether queue sort is consistent with absolute sort w.r.t. whole data set.  
-            isSorted = False
-            # Flag determines whether there was some line added to the queue => new event read.
-            lineAdded = False
-            
-            # Parse output format to tuple.
-            # Partial sort by heap.
-            #
-            # Read line if there is something to read and process didn't finish
-            # in previous round.
-            if line!=None and len(line)>0 and isDead==False:
-                tpl, startUtc = nfline2tuple(line)
-                
+        if self.memLimit > 0:
+            for tplpopped in self.externalGenerator():
+                yield tplpopped
+            return
+        
+        buff = []
+        for batch in self.batches():
+            for tpl, startUtc in batch:
                 # Add record to the priority queue sorted by first seen time
                 heappush(buff, (startUtc, tpl))
-                lineAdded = True
                 
                 # If time difference between current element and minimal one in queue is 
                 # greater than active timeout, we have probably enough data in queue
@@ -827,32 +1922,217 @@ class NfdumpSorter(NfdumpAbstract):
                 # when active timeout was expired). The next entry cannot be smaller. 
                 # Just to be sure - require at least 10 000 elements in priority queue.
                 if (startUtc - buff[0][0]) > self.tout and len(buff) >= 10000:
-                    isSorted=True 
-                    #print "Sorted event... cnt=%d, min=%s, curr=%s, diff=%s" % (cnt, buff[0][0], startUtc, (startUtc - buff[0][0]))
-
-            # If program is dead skip the line parsing in the next iteration and set data 
-            # in the priority queue as prepared to be processed.
-            if retcode is not None: 
-                isDead=True
-                isSorted=True
-
-            # If line was added and queue is not ready, then continue (still can read some data,
-            # program is still running, so wait to fill the queue)
-            if lineAdded and not isSorted and retcode is None: 
-                if (cnt % 1000) == 0: 
-                    sys.stdout.write('.')
-                    sys.stdout.flush()
-                continue
+                    yield heappop(buff)
             
-            # If there is nothing to process then we are done...
-            if len(buff)==0:
-                break
+            sys.stdout.write('.')
+            sys.stdout.flush()
+        
+        # Output is finished, all data in the priority queue are sorted
+        while len(buff) > 0:
+            yield heappop(buff)
+        
+        # End of the input processing
+        self.deinit()
+    
+    def externalGenerator(self):
+        '''
+        Generator of nfdump records completely sorted by external merge sort. 
+        
+        Records are read to runs of at most memLimit records, each full run is sorted and spilled to 
+        a temporary file, runs are k-way merged by heapq.merge at the end. Memory holds one run while 
+        reading and one block of spillBlock records per run while merging.
+        '''
+        runs = []
+        try:
+            run = []
+            for batch in self.batches():
+                for tpl, startUtc in batch:
+                    run.append((startUtc, tpl))
+                    if len(run) >= self.memLimit:
+                        runs.append(self.spill(run))
+                        run = []
+                        sys.stdout.write('r')
+                        sys.stdout.flush()
             
-            tplpopped = heappop(buff)
-            yield tplpopped
+            run.sort()
+            if len(runs) == 0:
+                for tplpopped in run:
+                    yield tplpopped
+            else:
+                if len(run) > 0: runs.append(self.spill(run))
+                run = None
+                for tplpopped in heapq.merge(*[self.runReader(f) for f in runs]):
+                    yield tplpopped
+        finally:
+            for f in runs: f.close()
         
         # End of the input processing
         self.deinit()
+    
+    def spill(self, run):
+        '''
+        Sorts the run and writes it to a temporary file (deleted on close), returns the file rewound.
+        '''
+        run.sort()
+        f = tempfile.TemporaryFile(dir=self.tmpDir)
+        for i in range(0, len(run), self.spillBlock):
+            pickle.dump(run[i:i+self.spillBlock], f, pickle.HIGHEST_PROTOCOL)
+        f.seek(0)
+        return f
+    
+    @staticmethod
+    def runReader(f):
+        '''
+        Yields records of a run file written by spill().
+        '''
+        while True:
+            try:
+                block = pickle.load(f)
+            except EOFError:
+                break
+            for tplpopped in block:
+                yield tplpopped
+
+def nfdumpDecodeFile(task):
+    '''
+    Worker of NfdumpMultiReader: decodes one nfdump file by nfdump program, 
+    returns list of its records (startUtc, tpl) sorted by flow start.
+    Raises exception if nfdump fails (e.g. unreadable or corrupted file), empty list means no matching records.
+    '''
+    filename, filt = task
+    cmdLine = 'nfdump -q -r "%s" -o "fmt:%%ts;%%td;%%pr;%%sa;%%sp;%%da;%%dp" "%s"' % (filename, filt if filt!=None else "")
+    proc = subprocess.Popen(cmdLine, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        err = err.decode(errors='replace') if isinstance(err, bytes) else err
+        raise Exception('nfdump failed on %s (exit code %d): %s' % (filename, proc.returncode, err.strip()))
+    recs = [(startUtc, tpl) for tpl, startUtc in nflines2tuples(out.splitlines())]
+    recs.sort()
+    return recs
+
+class NfdumpMultiReader(NfdumpAbstract):
+    '''
+    Generator for reading a set of nfdump files (e.g. 5 minute nfcapd files of a day) given by 
+    a directory or a glob pattern, as one stream sorted by time of netflow start.
+    
+    Files are decoded and sorted in worker processes, at most <window> files ahead of the merge. 
+    Decoded files are merged by heap in the order of file names. Record is taken from the heap only 
+    if it is older than the latest flow start in the files loaded so far minus active timeout, 
+    as NfdumpSorter assumes, the following files cannot contain older flows. Only files overlapping 
+    in time are held in memory.
+    '''
+    files   = None
+    filt    = None
+    tout    = 300*1000
+    workers = 0
+    pool    = None
+    once    = False
+    
+    # number of files being decoded ahead of the merge
+    window  = 8
+    
+    def __init__(self, pattern, filt=None, activeTimeout=300*1000, workers=0):
+        '''
+        Initializes object for generator - expands the file list
+        '''
+        if self.once == True: raise Exception('Generator was not de-initialized, may be still running...')
+        self.files   = NfdumpMultiReader.expand(pattern)
+        self.filt    = filt
+        self.tout    = activeTimeout
+        self.workers = workers
+        self.window  = max(self.window, 2 * workers)
+        if len(self.files) == 0: raise Exception('No nfdump files found: %s' % pattern)
+        print("nfdump files: %d, workers: %d" % (len(self.files), workers))
+        self.once    = True
+    
+    @staticmethod
+    def isMulti(pattern):
+        '''
+        Returns True if the nfdump source is a directory or a glob pattern.
+        '''
+        return pattern != None and (os.path.isdir(pattern) or any([c in pattern for c in '*?[']))
+    
+    @staticmethod
+    def expand(pattern):
+        '''
+        Returns sorted list of files of the directory or matching the glob pattern.
+        '''
+        if os.path.isdir(pattern): pattern = os.path.join(pattern, '*')
+        return sorted([x for x in glob.glob(pattern) if os.path.isfile(x)])
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.deinit()
+    
+    def deinit(self):
+        '''
+        Terminates worker processes if still exist
+        '''
+        if self.pool!=None:
+            try:
+                self.pool.terminate()
+                self.pool.join()
+            except Exception:
+                pass
+            self.pool = None
+        self.once = False
+    
+    def decoded(self):
+        '''
+        Generator of decoded files in the order of file names.
+        '''
+        tasks = [(f, self.filt) for f in self.files]
+        if self.workers <= 0:
+            for task in tasks:
+                yield nfdumpDecodeFile(task)
+            return
+        
+        self.pool = multiprocessing.Pool(self.workers)
+        pending = []
+        for task in tasks:
+            pending.append(self.pool.apply_async(nfdumpDecodeFile, (task,)))
+            if len(pending) >= self.window:
+                yield pending.pop(0).get()
+        while len(pending) > 0:
+            yield pending.pop(0).get()
+    
+    def generator(self):
+        '''
+        Yields records (startUtc, tpl) of all files sorted by flow start.
+        '''
+        if self.once == False: raise Exception('Generator is not initialized...')
+        
+        buff    = []                     # heap of (startUtc, tpl, file number, rest of file records)
+        horizon = None                   # records up to this time are complete
+        fileNo  = 0
+        for recs in self.decoded():
+            fileNo += 1
+            sys.stdout.write('f')
+            sys.stdout.flush()
+            if len(recs) == 0: continue
+            
+            # Emit records which cannot be preceded by records of this or the following files
+            while len(buff) > 0 and buff[0][0] < recs[0][0] and buff[0][0] < horizon:
+                startUtc, tpl, no, it = heappop(buff)
+                yield (startUtc, tpl)
+                nxt = next(it, None)
+                if nxt != None: heappush(buff, (nxt[0], nxt[1], no, it))
+            
+            it = iter(recs)
+            first = next(it)
+            heappush(buff, (first[0], first[1], fileNo, it))
+            horizon = recs[-1][0] - self.tout if horizon == None else max(horizon, recs[-1][0] - self.tout)
+        
+        # All files are loaded
+        while len(buff) > 0:
+            startUtc, tpl, no, it = heappop(buff)
+            yield (startUtc, tpl)
+            nxt = next(it, None)
+            if nxt != None: heappush(buff, (nxt[0], nxt[1], no, it))
+        
+        self.deinit()
 
 class NfdumpReader(NfdumpAbstract):
     '''
@@ -863,6 +2143,10 @@ class NfdumpReader(NfdumpAbstract):
     '''
     fo   = None
     once = False
+    
+    # size of a block of lines read and parsed at once [B]
+    blockSize = 1 << 20
+    
     def __init__(self, filename):
         '''
         Initializes object for generator - opens nfdump file for reading 
@@ -899,13 +2183,352 @@ class NfdumpReader(NfdumpAbstract):
         if self.once == False: raise Exception('Generator is not initialized...')
         
         while True:
-            line = self.fo.readline()
-            if not line:
+            lines = self.fo.readlines(self.blockSize)
+            if not lines:
                 break
-            tpl, startUtc = nfline2tuple(line)
-            yield (startUtc, tpl)
+            for tpl, startUtc in nflines2tuples(lines):
+                yield (startUtc, tpl)
+            
+        self.deinit()
+
+class NfdumpCache(object):
+    '''
+    Columnar binary cache of sorted nfdump records "fmt:%%ts;%%td;%%pr;%%sa;%%sp;%%da;%%dp".
+    
+    Cache is a directory with one raw little-endian file per column (see columns) and a text 
+    file meta.txt with the number of records, protocol name table and description of the source.
+    meta.txt is written last, so an interrupted conversion is not considered valid.
+    
+    Protocol is stored as an index to the protocol table. Ports "type.code" (ICMP) are stored 
+    as type << 8 | code, protocol table entry holds the protocol name and which of the ports are 
+    written this way. Records which cannot be stored (e.g. IPv6) are skipped.
+    '''
+    
+    # column name, dtype
+    columns = [('start', '<i8'), ('dur', '<i4'), ('proto', 'u1'), 
+               ('srcIP', '<u4'), ('srcPort', '<u2'), ('dstIP', '<u4'), ('dstPort', '<u2')]
+    
+    # number of records packed at once during conversion
+    blockSize = 65536
+    
+    @staticmethod
+    def sourceDesc(filename, filt=None):
+        '''
+        Description of the source file (or set of files, see NfdumpMultiReader) used to detect stale cache.
+        '''
+        if NfdumpMultiReader.isMulti(filename):
+            sts = [os.stat(x) for x in NfdumpMultiReader.expand(filename)]
+            return "%s|%d|%d|%d|%s" % (os.path.abspath(filename), len(sts), sum([x.st_size for x in sts]), max([int(x.st_mtime) for x in sts] + [0]), filt)
+        st = os.stat(filename)
+        return "%s|%d|%d|%s" % (os.path.abspath(filename), st.st_size, int(st.st_mtime), filt)
+    
+    @staticmethod
+    def readMeta(dirname):
+        '''
+        Reads meta.txt of the cache, returns None if cache does not exist.
+        '''
+        fname = os.path.join(dirname, 'meta.txt')
+        if not os.path.isfile(fname): return None
+        meta = {'records': 0, 'protos': [], 'source': None}
+        with open(fname, 'r') as f:
+            for line in f:
+                key, _, val = line.rstrip('\n').partition(' ')
+                if key == 'records': meta['records'] = int(val)
+                elif key == 'proto': 
+                    name, _, dotted = val.partition(' ')
+                    meta['protos'].append((name, dotted[0:1] == '1', dotted[1:2] == '1'))
+                elif key == 'source': meta['source'] = val
+        return meta
+    
+    @staticmethod
+    def exists(dirname, source=None):
+        '''
+        Returns True if there is a valid cache in the directory (built from the given source if provided).
+        '''
+        meta = NfdumpCache.readMeta(dirname)
+        return meta != None and (source == None or meta['source'] == source)
+    
+    @staticmethod
+    def ip4ToInt(ip):
+        a, b, c, d = ip.split('.')
+        return (int(a) << 24) | (int(b) << 16) | (int(c) << 8) | int(d)
+    
+    @staticmethod
+    def portToInt(port):
+        if '.' in port:
+            typ, code = port.split('.')
+            return (int(typ) << 8) | int(code)
+        return int(port)
+    
+    @staticmethod
+    def build(nfgen, dirname, source=None):
+        '''
+        Converts nfdump records (startUtc, tpl) from generator nfgen to the cache in directory dirname.
+        Returns number of records stored.
+        '''
+        if not os.path.isdir(dirname): os.makedirs(dirname)
+        metaName = os.path.join(dirname, 'meta.txt')
+        if os.path.isfile(metaName): os.remove(metaName)
+        
+        files   = [open(os.path.join(dirname, c + '.bin'), 'wb') for c, dt in NfdumpCache.columns]
+        protos  = {}
+        cnt     = 0
+        skipped = 0
+        block   = [[] for c in NfdumpCache.columns]
+        try:
+            for startUtc, tpl in nfgen:
+                try:
+                    pkey = (tpl[2], '.' in tpl[4], '.' in tpl[6])
+                    rec  = (startUtc, int(round(float(tpl[1]) * 1000)), protos.get(pkey),
+                            NfdumpCache.ip4ToInt(tpl[3]), NfdumpCache.portToInt(tpl[4]), 
+                            NfdumpCache.ip4ToInt(tpl[5]), NfdumpCache.portToInt(tpl[6]))
+                except ValueError:
+                    skipped += 1
+                    continue
+                
+                if rec[2] == None:
+                    if len(protos) >= 256: raise Exception('Too many protocols for the cache')
+                    protos[pkey] = len(protos)
+                    rec = rec[:2] + (protos[pkey],) + rec[3:]
+                
+                for i in range(len(rec)): block[i].append(rec[i])
+                cnt += 1
+                if len(block[0]) >= NfdumpCache.blockSize:
+                    for i, (c, dt) in enumerate(NfdumpCache.columns): files[i].write(np.array(block[i], dtype=dt).tobytes())
+                    block = [[] for c in NfdumpCache.columns]
+                    sys.stdout.write('c')
+                    sys.stdout.flush()
             
+            for i, (c, dt) in enumerate(NfdumpCache.columns): files[i].write(np.array(block[i], dtype=dt).tobytes())
+        finally:
+            for f in files: f.close()
+        
+        with open(metaName, 'w') as f:
+            f.write("records %d\n" % cnt)
+            for pkey, code in sorted(protos.items(), key=itemgetter(1)): f.write("proto %s %d%d\n" % pkey)
+            if source != None: f.write("source %s\n" % source)
+        
+        print("\nNfdump cache %s: %d records stored, %d skipped" % (dirname, cnt, skipped))
+        return cnt
+
+class NfdumpCacheReader(NfdumpAbstract):
+    '''
+    Generator for reading columnar binary cache of sorted nfdump records (NfdumpCache).
+    
+    Columns are memory mapped, generator() yields the same records as NfdumpReader,
+    batches() yields blocks of records as NumPy arrays. protos = protocol table 
+    of the cache, list of (name, source port dotted, destination port dotted).
+    '''
+    cols   = None
+    protos = None
+    once   = False
+    
+    # number of records converted at once in generator()
+    blockSize = 65536
+    
+    def __init__(self, dirname):
+        '''
+        Initializes object for generator - maps cache columns to memory
+        '''
+        if self.once == True: raise Exception('Generator was not de-initialized, may be still running...')
+        meta = NfdumpCache.readMeta(dirname)
+        if meta == None: raise Exception('There is no nfdump cache in %s' % dirname)
+        
+        self.protos  = meta['protos']
+        self.records = meta['records']
+        self.cols    = {}
+        for c, dt in NfdumpCache.columns:
+            if self.records == 0: self.cols[c] = np.zeros(0, dtype=dt)
+            else: self.cols[c] = np.memmap(os.path.join(dirname, c + '.bin'), dtype=dt, mode='r', shape=(self.records,))
+        self.once = True
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
         self.deinit()
+    
+    def deinit(self):
+        '''
+        Releases memory mapped columns
+        '''
+        self.cols = None
+        self.once = False
+    
+    @staticmethod
+    def ip4Strings(ips):
+        '''
+        Converts NumPy array of packed IPv4 addresses to the list of dotted strings.
+        '''
+        uniq, inv = np.unique(ips, return_inverse=True)
+        uniq = uniq.astype(np.int64)
+        strs = np.array(["%d.%d.%d.%d" % t for t in zip((uniq >> 24).tolist(), ((uniq >> 16) & 255).tolist(), ((uniq >> 8) & 255).tolist(), (uniq & 255).tolist())], dtype=object)
+        return strs[inv].tolist()
+    
+    @staticmethod
+    def portStrings(ports, dotted):
+        '''
+        Converts NumPy array of ports to the list of strings, ports with dotted flag set are written as "type.code".
+        '''
+        strs = [str(x) for x in ports.tolist()]
+        for i in np.flatnonzero(dotted).tolist(): strs[i] = "%d.%d" % (ports[i] >> 8, ports[i] & 255)
+        return strs
+    
+    def batches(self, size=None):
+        '''
+        Yields blocks of at most size records as dictionaries column name -> NumPy array,
+        with additional column lastData computed in the same way as nfline2tuple() does.
+        '''
+        if self.once == False: raise Exception('Generator is not initialized...')
+        size = size if size != None else self.blockSize
+        
+        for i in range(0, self.records, size):
+            batch = dict([(c, np.asarray(self.cols[c][i:i+size])) for c, dt in NfdumpCache.columns])
+            batch['lastData'] = batch['start'] + np.rint(batch['dur'] / 1000.0).astype(np.int64)
+            yield batch
+        
+        self.deinit()
+    
+    def generator(self):
+        '''
+        Yields records (startUtc, tpl) of the same format as NfdumpReader does.
+        '''
+        if self.once == False: raise Exception('Generator is not initialized...')
+        
+        names  = [x[0] for x in self.protos]
+        dotted = [np.array([x[1] for x in self.protos] + [False], dtype=bool), np.array([x[2] for x in self.protos] + [False], dtype=bool)]
+        for b in self.batches():
+            tstart   = [x.replace('T', ' ') for x in np.datetime_as_string(b['start'].astype('datetime64[ms]'), unit='ms').tolist()]
+            tdur     = ["%.3f" % x for x in (b['dur'] / 1000.0).tolist()]
+            proto    = [names[x] for x in b['proto'].tolist()]
+            srcIP    = self.ip4Strings(b['srcIP'])
+            dstIP    = self.ip4Strings(b['dstIP'])
+            srcPort  = self.portStrings(b['srcPort'], dotted[0][b['proto']])
+            dstPort  = self.portStrings(b['dstPort'], dotted[1][b['proto']])
+            startUtc = b['start'].tolist()
+            lastData = b['lastData'].tolist()
+            for rec in zip(tstart, tdur, proto, srcIP, srcPort, dstIP, dstPort, startUtc, lastData):
+                yield (rec[7], list(rec))
+        
+        self.deinit()
+
+def nfdumpSave(nfgen, filename):
+    '''
+    Writes nfdump records (startUtc, tpl) from the generator to the file in the sorted nfdump 
+    format "fmt:%%ts;%%td;%%pr;%%sa;%%sp;%%da;%%dp" read by NfdumpReader. Returns number of records written.
+    '''
+    cnt = 0
+    with open(filename, 'w') as f:
+        for startUtc, tpl in nfgen:
+            f.write(";".join(tpl[0:7]) + "\n")
+            cnt += 1
+    return cnt
+
+class SampleTraceCache(object):
+    '''
+    Cache of NAT sample traces - blocks of new connection counts produced by 
+    NatSimulation.nfdumpSampleGenerator(), so netflow records do not have to be replayed 
+    through NAT again for the same capture and sampling parameters.
+    
+    Trace is a NumPy .npz file in the cache directory named by a hash of the key, holding 
+    all sample values as int32 (values), block boundaries (offsets) and the key itself.
+    '''
+    
+    @staticmethod
+    def fileName(dirname, key):
+        return os.path.join(dirname, 'trace_%s.npz' % hashlib.sha1(key.encode()).hexdigest())
+    
+    @staticmethod
+    def read(fname, key):
+        '''
+        Returns list of sample blocks of the trace, None if there is no trace for the key.
+        '''
+        if not os.path.isfile(fname): return None
+        with np.load(fname) as data:
+            if str(data['key']) != key: return None
+            values  = data['values']
+            offsets = data['offsets']
+        return [values[offsets[i]:offsets[i+1]].tolist() for i in range(len(offsets) - 1)]
+    
+    @staticmethod
+    def write(fname, key, blocks):
+        '''
+        Stores sample blocks as a trace, atomically.
+        '''
+        dirname = os.path.dirname(fname)
+        if dirname and not os.path.isdir(dirname): os.makedirs(dirname)
+        offsets = np.zeros(len(blocks) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(b) for b in blocks])
+        values  = np.concatenate(blocks) if len(blocks) > 0 else np.zeros(0, dtype=np.int32)
+        tmp = fname[:-4] + '.tmp.npz'
+        np.savez(tmp, values=values.astype(np.int32), offsets=offsets, key=np.array(key))
+        os.replace(tmp, fname)
+    
+    @staticmethod
+    def record(nfgen, fname, key, maxBlocks=-1):
+        '''
+        Passes sample blocks from the generator through and stores them as a trace when the generator 
+        is exhausted, or when the consumer stops after maxBlocks blocks (the generator stops there too).
+        '''
+        blocks = []
+        try:
+            for samplesRes in nfgen:
+                blocks.append(np.array(samplesRes, dtype=np.int32))
+                yield samplesRes
+        except GeneratorExit:
+            if maxBlocks > 0 and len(blocks) >= maxBlocks: 
+                SampleTraceCache.write(fname, key, blocks)
+            raise
+        SampleTraceCache.write(fname, key, blocks)
+
+class RunningMoments(object):
+    '''
+    Running mean and unbiased variance of a series of numbers or NumPy vectors (Welford's algorithm).
+    Values are not stored.
+    '''
+    n    = 0
+    mean = 0.0
+    m2   = 0.0
+    
+    def add(self, x):
+        x = np.asarray(x, dtype=float)
+        self.n += 1
+        delta = x - self.mean
+        self.mean = self.mean + delta / self.n
+        self.m2   = self.m2 + delta * (x - self.mean)
+    
+    def var(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else self.m2 * 0.0
+
+class QuantileSketch(object):
+    '''
+    Streaming quantiles of a series of numbers by a histogram of fixed-width bins over [lo, hi],
+    on log10 scale if log is set. Values outside of the interval are clamped, NaNs ignored.
+    Quantile resolution is one bin.
+    '''
+    def __init__(self, lo=0.0, hi=1.0, bins=10000, log=False):
+        self.log    = log
+        self.lo     = math.log10(lo) if log else lo
+        self.hi     = math.log10(hi) if log else hi
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.n      = 0
+    
+    def add(self, x):
+        if x != x: return
+        if self.log: x = math.log10(x) if x > 0 else self.lo
+        bins = len(self.counts)
+        idx  = int((x - self.lo) / (self.hi - self.lo) * bins)
+        self.counts[min(max(idx, 0), bins - 1)] += 1
+        self.n += 1
+    
+    def quantile(self, q):
+        '''
+        Returns q-quantile (middle of its bin), NaN if there are no values.
+        '''
+        if self.n == 0: return float('nan')
+        idx = int(np.searchsorted(np.cumsum(self.counts), q * self.n))
+        x   = self.lo + (min(idx, len(self.counts) - 1) + 0.5) * (self.hi - self.lo) / len(self.counts)
+        return 10 ** x if self.log else x
 
 class NatSimulation(object):
     
@@ -956,24 +2579,66 @@ class NatSimulation(object):
     # process in generator
     proc=None
     
-    @staticmethod
-    def poisson(lmbd, t):
+    # vectorized batch engine for simulation() - rounds evaluated at once in one batch
+    batch=False
+    batchRounds=250
+    
+    # type (getNat()) and parameters passed to Nat.init() of newly created NATs (e.g. in worker processes)
+    natType='incremental'
+    natParams=None
+    
+    # directory of columnar binary cache (NfdumpCache) of nfdump records, None = no cache
+    nfCache=None
+    
+    # records in memory for external sort of raw nfdump files (NfdumpSorter), 0 = heap sort
+    nfSortMem=0
+    nfSortTmp=None
+    
+    # worker processes decoding multiple raw nfdump files (NfdumpMultiReader)
+    nfWorkers=0
+    
+    # directory of NAT sample traces (SampleTraceCache), None = no cache
+    traceCache=None
+    
+    # fit negative binomial MLE in R (MASS.fitdistr) instead of natively, for validation
+    rMle=False
+    
+    # number of blocks fitted at once by goodMatchBatch() in nfdumpDistribution()
+    fitBatch=256
+    
+    # Random generator of the simulation. If seed is set, each round uses its own substream
+    # rngStream(seed, rngStreamId, roundOffset + round), see roundRng(). rngStreamId distinguishes
+    # independent runs (e.g. lambdas in benchmark), roundOffset is used when rounds are split to chunks.
+    rng=defaultRng
+    seed=None
+    rngStreamId=0
+    roundOffset=0
+    
+    def roundRng(self, rnd, nats=[], strategies=[]):
+        '''
+        Sets random generator for simulation round rnd to the simulation, NATs and strategies.
+        With seed set, results of the round do not depend on other rounds, process or order of evaluation.
+        '''
+        if self.seed != None: self.rng = rngStream(self.seed, self.rngStreamId, self.roundOffset + rnd)
+        for x in nats: x.rng = self.rng
+        for x in strategies: x.rng = self.rng
+        return self.rng
+    
+    def poisson(self, lmbd, t):
         '''
         Uses Numpy package to take sample from poisson distribution
         '''
-        return int(np.random.poisson(lmbd*t))
+        return int(self.rng.poisson(lmbd*t))
     
-    @staticmethod
-    def uniform(lmbd, t):
-        return random.random() * lmbd * t
+    def uniform(self, lmbd, t):
+        return self.rng.random() * lmbd * t
     
-    @staticmethod
-    def poissonSample(lmbd, t):
+    def poissonSample(self, lmbd, t):
         '''
         Generates number of events in Poisson process in time [0, t]
         source: http://www.math.wsu.edu/faculty/genz/416/lect/l05-45.pdf
         '''
-        u = random.random()
+        u = self.rng.random()
         N = 0
         p = math.exp(-lmbd * t)
         F = p
@@ -1001,7 +2666,7 @@ class NatSimulation(object):
         Simple wrapper for poission. Returns number of new connections
         created. It is assumed they are distributed according to Poisson distribution.
         '''
-        return int(np.random.poisson(self.lmbd*tim))
+        return int(self.rng.poisson(self.lmbd*tim))
     
     def poissonSimulate(self, T):
         '''
@@ -1012,7 +2677,7 @@ class NatSimulation(object):
         N = 0
         while t <= T:
             # U ~ U(0,1), uniform distribution
-            U = random.random()
+            U = self.rng.random()
             
             # next time of the event, exponential distribution
             t = t + (-(1/self.lmbd) * math.log(U))
@@ -1151,6 +2816,39 @@ class NatSimulation(object):
         '''
         return int((calendar.timegm(dtime.utctimetuple()) * 1000) + (dtime.microsecond/1000))
        
+    def nfdumpReader(self, filename=None, processedNfdump=None, filt=None, activeTimeout=300*1000):
+        '''
+        Returns nfdump reader object for the record source:
+         - processedNfdump is a directory with columnar cache -> NfdumpCacheReader,
+         - processedNfdump is a sorted text file               -> NfdumpReader,
+         - otherwise raw nfdump file filename is sorted on the fly -> NfdumpSorter,
+           directory or glob pattern of raw nfdump files       -> NfdumpMultiReader.
+        If nfCache is set, records of the source are converted to the cache in that directory 
+        first (only if there is no up-to-date cache yet) and read from the cache.
+        '''
+        if processedNfdump!=None and NfdumpCache.exists(processedNfdump):
+            return NfdumpCacheReader(processedNfdump)
+        
+        if self.nfCache!=None:
+            src = NfdumpCache.sourceDesc(processedNfdump, None) if processedNfdump!=None else NfdumpCache.sourceDesc(filename, filt)
+            if not NfdumpCache.exists(self.nfCache, src):
+                print("Building nfdump cache in %s" % self.nfCache)
+                nfdumpObj = NfdumpReader(processedNfdump) if processedNfdump!=None else self.rawNfdumpReader(filename, filt, activeTimeout)
+                NfdumpCache.build(nfdumpObj.generator(), self.nfCache, src)
+            return NfdumpCacheReader(self.nfCache)
+        
+        if processedNfdump!=None:
+            return NfdumpReader(processedNfdump)
+        return self.rawNfdumpReader(filename, filt, activeTimeout)
+    
+    def rawNfdumpReader(self, filename, filt=None, activeTimeout=300*1000):
+        '''
+        Returns reader of raw nfdump file(s) - single file or directory / glob pattern of files.
+        '''
+        if NfdumpMultiReader.isMulti(filename):
+            return NfdumpMultiReader(filename, filt, activeTimeout, self.nfWorkers)
+        return NfdumpSorter(filename, filt, activeTimeout, self.nfSortMem, self.nfSortTmp)
+    
     @staticmethod
     def nfline2tuple(line):
         '''
@@ -1174,6 +2872,107 @@ class NatSimulation(object):
         sampleEachSkip    = number of records
         maxBlockSize      = number of blocks to process (1 block = sampleSize samples)
         '''
+        for samplesRes in self.nfdumpSampleCore(natA, self.nfdumpRecords(nfgen, homeNet), T, sampleSize, 
+                                                recStartSkip, recEachSkip, maxBlockSize):
+            yield samplesRes
+    
+    def nfdumpSampleSource(self, natA, filename=None, processedNfdump=None, filt=None, homeNet='147.250.', T=10, sampleSize=1000, 
+                           recStartSkip=5000, recEachSkip=0, maxBlockSize=-1, activeTimeout=300*1000):
+        '''
+        Returns (nfdump reader object, generator of NAT sample blocks) for the record source.
+        With traceCache set, blocks are read from the NAT sample trace of the same source, NAT and 
+        sampling parameters, if there is one. Otherwise records are replayed and the trace is stored.
+        '''
+        if self.traceCache==None:
+            nfdumpObj = self.nfdumpReader(filename, processedNfdump, filt, activeTimeout)
+            return (nfdumpObj, self.nfdumpSamples(natA, nfdumpObj, homeNet, T, sampleSize=sampleSize, recStartSkip=recStartSkip, 
+                                                  recEachSkip=recEachSkip, maxBlockSize=maxBlockSize, activeTimeout=activeTimeout))
+        
+        src   = NfdumpCache.sourceDesc(processedNfdump, None) if processedNfdump!=None else NfdumpCache.sourceDesc(filename, filt)
+        key   = "%s|%s|%s|%d|%d|%s|%s|%s|%s|%s|%s|%s" % (src, homeNet, filt, T, sampleSize, recStartSkip, recEachSkip, maxBlockSize, activeTimeout,
+                                                      natA.__class__.__name__, natA.poolLen, natA.timeout)
+        fname = SampleTraceCache.fileName(self.traceCache, key)
+        blocks = SampleTraceCache.read(fname, key)
+        if blocks != None:
+            print("NAT sample trace loaded from %s, blocks: %d" % (fname, len(blocks)))
+            return (NfdumpAbstract(), iter(blocks))
+        
+        nfdumpObj = self.nfdumpReader(filename, processedNfdump, filt, activeTimeout)
+        nfgen     = self.nfdumpSamples(natA, nfdumpObj, homeNet, T, sampleSize=sampleSize, recStartSkip=recStartSkip, 
+                                       recEachSkip=recEachSkip, maxBlockSize=maxBlockSize, activeTimeout=activeTimeout)
+        return (nfdumpObj, SampleTraceCache.record(nfgen, fname, key, maxBlockSize))
+    
+    def nfdumpSamples(self, natA, nfdumpObj, homeNet='147.250.', T=10, sampleSize=1000, recStartSkip=5000, 
+                      recEachSkip=0, maxBlockSize=-1, activeTimeout=300*1000):
+        '''
+        Sample generator for the nfdump reader object, uses batches for the columnar cache.
+        '''
+        if isinstance(nfdumpObj, NfdumpCacheReader):
+            return self.nfdumpSampleBatchGenerator(natA, nfdumpObj.batches(), homeNet, T, sampleSize=sampleSize, recStartSkip=recStartSkip, 
+                                                   recEachSkip=recEachSkip, maxBlockSize=maxBlockSize)
+        return self.nfdumpSampleGenerator(natA, nfdumpObj.generator(), homeNet, T, sampleSize=sampleSize, recStartSkip=recStartSkip, 
+                                          recEachSkip=recEachSkip, maxBlockSize=maxBlockSize, activeTimeout=activeTimeout)
+    
+    @staticmethod
+    def nfdumpRecords(nfgen, homeNet):
+        '''
+        Translates nfdump records (startUtc, tpl) to records of nfdumpSampleCore(), incomplete records to None.
+        '''
+        for tplpopped in nfgen:
+            if tplpopped == None or tplpopped[1] == None or None in tplpopped[1][0:9]:
+                yield None
+                continue
+            tstart,tdur,proto,srcIP,srcPort,dstIP,dstPort,startUtc,lastData = tplpopped[1]
+            yield (startUtc, lastData, srcIP.startswith(homeNet), srcIP, srcPort, dstIP, dstPort)
+    
+    @staticmethod
+    def homeNetMask(homeNet):
+        '''
+        Converts home network given as a string prefix of dotted IPv4 address ("147.250.") or in CIDR 
+        notation ("147.250.0.0/16") to (network, mask) of integer addresses. 
+        Returns None if prefix does not end on an octet boundary (e.g. "147.25" or "147.250.1.1").
+        '''
+        if '/' in homeNet:
+            addr, _, bits = homeNet.partition('/')
+            mask = (0xFFFFFFFF << (32 - int(bits))) & 0xFFFFFFFF
+            return (NfdumpCache.ip4ToInt(addr) & mask, mask)
+        
+        octets = homeNet.split('.')
+        if octets[-1] != '' or len(octets) > 5: return None
+        octets = octets[:-1]
+        net  = 0
+        for o in octets: net = (net << 8) | int(o)
+        bits = 8 * len(octets)
+        mask = (0xFFFFFFFF << (32 - bits)) & 0xFFFFFFFF
+        return (net << (32 - bits), mask)
+    
+    def nfdumpSampleBatchGenerator(self, natA, batches, homeNet='147.250.',
+                                   T=10, sampleSize=1000, recStartSkip=5000, recEachSkip=0, maxBlockSize=-1):
+        '''
+        Batch variant of nfdumpSampleGenerator() with the same results. Consumes batches of records 
+        as NumPy arrays (NfdumpCacheReader.batches() or structured arrays with the same fields:
+        start, lastData, srcIP, srcPort, dstIP, dstPort with integer addresses).
+        
+        Flows from the home network are classified by integer network mask for the whole batch,
+        only NAT allocation and sampling is done record by record.
+        '''
+        cidr = self.homeNetMask(homeNet)
+        def records():
+            for b in batches:
+                if cidr != None: fromHome = (b['srcIP'].astype(np.int64) & cidr[1]) == cidr[0]
+                else:            fromHome = np.array([x.startswith(homeNet) for x in NfdumpCacheReader.ip4Strings(b['srcIP'])], dtype=bool)
+                for rec in zip(b['start'].tolist(), b['lastData'].tolist(), fromHome.tolist(), b['srcIP'].tolist(), 
+                               b['srcPort'].tolist(), b['dstIP'].tolist(), b['dstPort'].tolist()):
+                    yield rec
+        
+        for samplesRes in self.nfdumpSampleCore(natA, records(), T, sampleSize, recStartSkip, recEachSkip, maxBlockSize):
+            yield samplesRes
+    
+    def nfdumpSampleCore(self, natA, recs, T=10, sampleSize=1000, recStartSkip=5000, recEachSkip=0, maxBlockSize=-1):
+        '''
+        Sampling core of nfdumpSampleGenerator(), iterates over records 
+        (startUtc, lastData, fromHome, srcIP, srcPort, dstIP, dstPort), None records are counted but ignored.
+        '''
         #
         # Run NFdump and read line by line
         #
@@ -1191,13 +2990,10 @@ class NatSimulation(object):
         
         recCurSkipCnt = 0       # number of records designated for skipping 
         
-        # iterate over lines
-        for tplpopped in nfgen:
+        # iterate over records
+        for rec in recs:
             cnt += 1
-            if tplpopped == None or tplpopped[1] == None \
-                or tplpopped[1][0] == None or tplpopped[1][1] == None or tplpopped[1][2] == None \
-                or tplpopped[1][3] == None or tplpopped[1][4] == None or tplpopped[1][5] == None \
-                or tplpopped[1][6] == None or tplpopped[1][7] == None or tplpopped[1][8] == None:
+            if rec == None:
                 continue
             
             # Sample skip - beginning of the file may be non-ideal (already opened connections, ...)
@@ -1207,8 +3003,7 @@ class NatSimulation(object):
                     sys.stdout.flush()
                 continue
             
-            tstart,tdur,proto,srcIP,srcPort,dstIP,dstPort,startUtc,lastData = tplpopped[1]
-            fromHome = srcIP.startswith(homeNet)    # Is connection made from our network?
+            startUtc,lastData,fromHome,srcIP,srcPort,dstIP,dstPort = rec    # fromHome = is connection made from our network?
             
             # Skiping on record basis
             if recEachSkip >= 1:
@@ -1217,9 +3012,9 @@ class NatSimulation(object):
                 # No skip -> reset counter
                 recCurSkipCnt = 0
             
-            #print tplpopped[1], fromHome
+            #print rec
             # sample NAT state each X time units
-            if (startUtc/(T) > lastSampleTime):
+            if (startUtc//(T) > lastSampleTime):
                 # Get next port that would be allocated in this time
                 lastPort = natA.peekNext(startUtc)
                 # How many connections were made since last sample?
@@ -1227,12 +3022,9 @@ class NatSimulation(object):
                 # Initialize observation start if not start
                 if lastStart==-1: lastStart  = 0
                 else:             
-                    newTimeBlocks = startUtc/(T) - lastSampleTime
-                    if newTimeBlocks>1: # has to fill gaps where no event happened -> 0
-                        for tmpi in range(lastStart,lastStart+newTimeBlocks-1):
-                            #sys.stdout.write('g')
-                            samplesRes.append(0)
-                            #print "Sample: time=%s; utc=%s; new connections=%d, lastPortSampled=%d, curPortSampled=%d GAP" % (tmpi*self.portScanInterval, startUtc, 0, lastSamplePort, lastPort)
+                    newTimeBlocks = startUtc//(T) - lastSampleTime
+                    if newTimeBlocks>1: # has to fill gaps where no event happened -> 0, whole run at once
+                        samplesRes.extend(itertools.repeat(0, newTimeBlocks-1))
                     
                     lastStart += newTimeBlocks
                 #print "Sample: time=%s; utc=%s; new connections=%d, lastPortSampled=%d, curPortSampled=%d" % (lastStart*self.portScanInterval, startUtc, curSampleConn, lastSamplePort, lastPort)
@@ -1242,7 +3034,7 @@ class NatSimulation(object):
                 samplePort.append(lastPort)
                 
                 lastSamplePort = lastPort
-                lastSampleTime = startUtc/(T)
+                lastSampleTime = startUtc//(T)
                 
                 # collected samples
                 curTestSize = len(samplesRes)
@@ -1284,11 +3076,20 @@ class NatSimulation(object):
         yield samplesRes
         pass
     
-    def nfdumpDistribution(self, natA, filename=None, processedNfdump=None, homeNet='', filt=None, drawHist=True, sampleSize = 500, maxBlock=-1, skip=0, fileOut=None):
+    def nfdumpDistribution(self, natA, filename=None, processedNfdump=None, homeNet='', filt=None, drawHist=True, sampleSize = 500, maxBlock=-1, skip=0, fileOut=None,
+                           keepSeries=True, keepBlocks=False):
         '''
         Reads nfdump file with given filter and simulates NAT
         
         sampleSize - number of NAT port samples in one block
+        keepSeries - keep per block E[X], V[X], p-values and chi-squared values (for graphs) and per block
+                     statistics ('st', 'sr'); quantiles of p-values and chi-squared values are then exact
+        keepBlocks - keep per block statistics ('st', 'sr') also without keepSeries, with expected frequencies
+                     of fitted models ('m')
+        
+        Statistics over all blocks are computed on the fly, in constant memory: 
+        number of passed tests, mean and variance of E[X] and V[X], quantiles of p-values and chi-squared values
+        (approximate, QuantileSketch, unless keepSeries is set).
         '''
         
         #
@@ -1302,83 +3103,131 @@ class NatSimulation(object):
         statRes  =[]
         statAccum=[]
         statDesc =[]
+        hypotheses = None               # passes/not passed test, per distribution
+        pvals      = None               # p-values array, per distribution
+        chisq      = None               # chi-sqiared values array, per distribution
+        pvalsK     = None               # p-values array, keys
+        chisqK     = None               # chi-sqiared values array, keys
+        descStat   = RunningMoments()   # running moments of (E[X], V[X])
+        pvalSketch = None               # streaming quantiles of p-values, per distribution
+        chiSketch  = None               # streaming quantiles of chi-squared values, per distribution
+        blocks     = 0                  # number of evaluated blocks
         natA.reset()
         fileDesc = 't%04d_s%05d_sk%05d' % (self.portScanInterval, sampleSize, sampleSkip)
         
-        # Prepare nfdump record generator.
-        nfdumpObj       = None
-        nfdumpGenerator = None
-        if processedNfdump!=None:
-            nfdumpObj = NfdumpReader(processedNfdump)
-            nfdumpGenerator = nfdumpObj.generator()
-        else:
-            nfdumpObj = NfdumpSorter(filename, filt, activeTimeout)
-            nfdumpGenerator = nfdumpObj.generator()
-        
+        # Prepare nfdump record generator,
         # generates samples of NAT process w.r.t. new connections.
         print("Starting sampling; sampleSize=%04d; sampleSkip=%04d; maxBlock=%04d; T=%03d" % (sampleSize, sampleSkip, maxBlock, self.portScanInterval))
-        nfgen = self.nfdumpSampleGenerator(natA, nfdumpGenerator, homeNet, self.portScanInterval, 
-                                           sampleSize, sampleSkip, 0, maxBlock, activeTimeout)
+        nfdumpObj, nfgen = self.nfdumpSampleSource(natA, filename, processedNfdump, filt, homeNet, self.portScanInterval, 
+                                                   sampleSize=sampleSize, recStartSkip=sampleSkip, 
+                                                   recEachSkip=0, maxBlockSize=maxBlock, activeTimeout=activeTimeout)
         
         f = None
         if fileOut != None and len(fileOut)>0:
             f = open(fileOut + ("_s%04d_sk%04d_t%04d.txt" % (sampleSize, sampleSkip, self.portScanInterval)), 'a+')
         
+        # Blocks of samples are collected to batches, models are fitted to the whole batch at once
+        # Sample source is closed explicitly once the last block is consumed, so the sample trace
+        # is written here (errors surface in the loop below) and not when the generator is collected.
+        def blockBatches():
+            batch = []
+            curBlock = 0
+            try:
+                for samplesRes in nfgen:
+                    curBlock += 1
+                    if (curBlock-1) < skip: continue
+                    batch.append((curBlock, samplesRes))
+                    last = maxBlock > 0 and curBlock >= maxBlock
+                    if len(batch) >= self.fitBatch or last:
+                        yield batch
+                        batch = []
+                    if last: break
+                if len(batch) > 0: yield batch
+            finally:
+                if hasattr(nfgen, 'close'): nfgen.close()
+        
+        modelNames = ['Po', 'Po shifted', 'Bi', 'NB', 'NB MLE']
+        
         # iterate over new connection count samples
-        for samplesRes in nfgen:
-            # Process & analyze data
-            maxE = max(samplesRes)+1
-            curBlock+=1
-            curTestSize = len(samplesRes)
-            if (curBlock-1) < skip: continue
-            
+        for batch in blockBatches():
             # Convert list of port numbers in each sample to frequency distribution
-            distrib = [0] * (maxE)
-            sampleSizeR=len(samplesRes)
-            for i in samplesRes: 
-                distrib[i]+=1
+            hists = [np.bincount(samplesRes) for curBlock, samplesRes in batch]
+            bins  = np.array([len(h) for h in hists])
+            H     = np.zeros((len(batch), bins.max()))
+            for i, h in enumerate(hists): H[i, 0:len(h)] = h
+            fit   = self.goodMatchBatch(H, bins, keepExpected=drawHist or keepBlocks)
             
-            ssum, ex, var, stdev = self.calcPortDistribInfo(distrib, sampleSizeR)
-            files = [('distrib/nfdump_' + fileDesc + ("_%04d" % curBlock) + tmpf) for tmpf in ['.pdf', '.png', '.svg']]
+            for bi, (curBlock, samplesRes) in enumerate(batch):
+                # Process & analyze data
+                maxE = int(bins[bi])
+                curTestSize = len(samplesRes)
+                distrib = hists[bi].tolist()
+                sres = self.goodMatchBatchRow(fit, bi, maxE)
+                ssum, ex, var, stdev = sres['ssum'], sres['ex'], sres['var'], sres['stdev']
+                files = [('distrib/nfdump_' + fileDesc + ("_%04d" % curBlock) + tmpf) for tmpf in ['.pdf', '.png', '.svg']]
                         
-            print("Sampling done... max=%d, sampleSize=%d target=%d sum=%d" % (maxE, curTestSize, sampleSize, sum(distrib)))
-
-            # Negative binomial try - wise binning disabled.
-            (chi, pval, tmp_n, tmp_p, m2) = self.goodMatchNegativeBinomial(ex, var, distrib, maxE, sampleSizeR, False, wiseBinning=False)
-            print("Chi-Squared test on match with NB(%04d, %04.4f): Chi: %04.4f, p-value=%01.25f; alpha=0.05; hypothesis %s" % \
-                (tmp_n, tmp_p, chi, pval, "is REJECTED" if pval < 0.05 else "holds"))
+                print("Sampling done... max=%d, sampleSize=%d target=%d sum=%d" % (maxE, curTestSize, sampleSize, ssum))
+                print("\nBlock=%04d, Distribution: " % curBlock, distrib) 
+                print("E[x] = %04.2f;  V[x] = %04.2f;  stddev = %04.2f;  sum=%05d" % (ex, var, stdev, ssum))
+                for name, t in zip(modelNames, sres['distrib']):
+                    print("Chi-Squared test on match with %-10s (%s): Chi: %s, p-value=%01.25f; alpha=0.05; hypothesis %s r=%01.8f" % \
+                        (name, ", ".join([('%04.4f' % x) for x in t['par']]), ('%04.4f' % t['chi']).zfill(10), t['pval'], 
+                         "is REJECTED" if t['pval'] < 0.05 else "holds      ", t['r2']))
+                if drawHist:
+                    self.drawPortDistrib(distrib, maxE, sres['distrib'][0]['m'], sres['distrib'][4]['m'], None, files)
             
-            print("\nBlock=%04d, Distribution: " % curBlock, distrib) 
-            sres = self.histAndStatisticsPortDistrib(distrib, sampleSizeR, maxE, files, drawHist=drawHist)
-            statRes.append(sres)
-            statAccum.append(sres['distrib'])
-            statDesc.append((ex,var))
+                # Streaming statistics over blocks
+                dists = sres['distrib']
+                if hypotheses is None:
+                    hypotheses = np.array([0] * len(dists))
+                    pvals      = [[] for i in range(len(dists))]
+                    chisq      = [[] for i in range(len(dists))]
+                    pvalsK     = [[] for i in range(len(dists))]
+                    chisqK     = [[] for i in range(len(dists))]
+                    pvalSketch = [QuantileSketch() for i in range(len(dists))]
+                    chiSketch  = [QuantileSketch(1e-6, 1e12, log=True) for i in range(len(dists))]
             
-            print("=" * 180)
+                hypotheses += np.array( [(1 if (t['pval'] >= 0.05 and not np.isnan(t['pval'])) else 0) for t in dists] )
+                descStat.add((ex, var))
+                for i,t in enumerate(dists): 
+                    if t['pval'] != 0 and not np.isnan(t['pval']): 
+                        pvalSketch[i].add(t['pval'])
+                        if keepSeries:
+                            pvals[i].append(t['pval'])
+                            pvalsK[i].append(blocks)
+                    if t['chi']  != 0 and not np.isnan(t['chi']) : 
+                        chiSketch[i].add(t['chi'])
+                        if keepSeries:
+                            chisq[i].append(t['chi'])
+                            chisqK[i].append(blocks)
+                if keepSeries: statDesc.append((ex,var))
+                if keepSeries or keepBlocks:
+                    statRes.append(sres)
+                    statAccum.append(dists)
+                blocks += 1
             
-            #
-            # Data output, each line = one distrib
-            #
-            if f!=None:
-                # Write basic sample info.
-                line = 'S|%d|%01.3f|%01.3f|%d' % (curBlock, sres['ex'], sres['var'], sres['ssum'])
-                f.write(line + "\n")
-                
-                # Distribution fitting and hypothesis testing.
-                for did, dist in enumerate(sres['distrib']):
-                    line = '    D|%d|%01.18f|%03.3f|%03.8f|%s' % \
-                        (did, dist['pval'], dist['chi'], dist['r2'], "|".join([('%03.5f' % x) for x in dist['par']]))
+                print("=" * 180)
+            
+                #
+                # Data output, each line = one distrib
+                #
+                if f!=None:
+                    # Write basic sample info.
+                    line = 'S|%d|%01.3f|%01.3f|%d' % (curBlock, sres['ex'], sres['var'], sres['ssum'])
                     f.write(line + "\n")
-                pass
+                
+                    # Distribution fitting and hypothesis testing.
+                    for did, dist in enumerate(sres['distrib']):
+                        line = '    D|%d|%01.18f|%03.3f|%03.8f|%s' % \
+                            (did, dist['pval'], dist['chi'], dist['r2'], "|".join([('%03.5f' % x) for x in dist['par']]))
+                        f.write(line + "\n")
+                    pass
             
-                # Write whole sample for further statistical processing
-                line = '    R|' + "|".join([('%d' % x) for x in samplesRes])
-                f.write(line + "\n")
-                f.flush()
+                    # Write whole sample for further statistical processing
+                    line = '    R|' + "|".join([('%d' % x) for x in samplesRes])
+                    f.write(line + "\n")
+                    f.flush()
             
-            # State reset for next iteration
-            curTestSize = 0
-            if maxBlock > 0 and curBlock >= maxBlock: break
         
         #
         # Final data processing, main loop finished.
@@ -1394,30 +3243,28 @@ class NatSimulation(object):
         natA.reset()
         
         # Evalueate statistical resutls.
-        if (len(statAccum)==0): return
-        hypotheses = np.array([0]  * len(statAccum[0]))     # passes/not passed test
-        pvals      = [[] for i in range(len(statAccum[0]))] # p-values array
-        chisq      = [[] for i in range(len(statAccum[0]))] # chi-sqiared values array
-        pvalsK     = [[] for i in range(len(statAccum[0]))] # p-values array, keys
-        chisqK     = [[] for i in range(len(statAccum[0]))] # chi-sqiared values array, keys
-        for k, s in enumerate(statAccum):
-            hypotheses += np.array( [(1 if (t['pval'] >= 0.05 and not np.isnan(t['pval'])) else 0) for t in s] )
-            for i,t in enumerate(s): 
-                if t['pval'] != 0 and not np.isnan(t['pval']): 
-                    pvals[i].append(t['pval'])
-                    pvalsK[i].append(k)
-                if t['chi']  != 0 and not np.isnan(t['chi']) : 
-                    chisq[i].append(t['chi'])
-                    chisqK[i].append(k)
+        if (blocks==0): return
+        descVar = descStat.var()
+        if keepSeries:
+            # exact quantiles from kept series
+            pq  = [([float(x) for x in np.percentile(v, [25, 50, 75])] if len(v) > 0 else [float('nan')]*3) for v in pvals]
+            cq  = [([float(x) for x in np.percentile(v, [25, 50, 75])] if len(v) > 0 else [float('nan')]*3) for v in chisq]
+        else:
+            pq  = [[sk.quantile(q) for q in (0.25, 0.5, 0.75)] for sk in pvalSketch]
+            cq  = [[sk.quantile(q) for q in (0.25, 0.5, 0.75)] for sk in chiSketch]
         
         print("Hypothesis tests results (total=%d) " % curBlock, hypotheses)
-        print("Median p-value: ", [np.median(s) for s in pvals])
-        print("Median chi-squared value: ", [np.median(s) for s in chisq])
+        print("E[X] over blocks: mean=%04.4f var=%04.4f; V[X] over blocks: mean=%04.4f var=%04.4f" % (descStat.mean[0], descVar[0], descStat.mean[1], descVar[1]))
+        print("Median p-value: ", [q[1] for q in pq])
+        print("Median chi-squared value: ", [q[1] for q in cq])
         return {'n': curBlock,      'h': hypotheses, 
                 'pv': pvals,        'pk': pvalsK, 
                 'cv': chisq,        'ck': chisqK, 
                 'st': statAccum,    'sd': statDesc,
-                'sr': statRes}
+                'sr': statRes,
+                'agg': {'blocks': blocks, 
+                        'ex': (descStat.mean[0], descVar[0]), 'var': (descStat.mean[1], descVar[1]),
+                        'pq': pq, 'cq': cq}}
          
     def simulationCore(self, natSamples, strategies, nats, stopOnFirstMatch = False):
         '''
@@ -1425,60 +3272,70 @@ class NatSimulation(object):
         NAT connection samples and so on...
         '''
         
-        # number of iterations to do
-        iters = min(len(natSamples[0]), len(natSamples[1]))
+        asciiOut = self.ascii > 1 or (self.ascii==1 and self.simulationRounds==1)
+        dotOut   = self.dot > 1 or (self.dot==1 and self.simulationRounds==1)
         
-        mapA  = [{}, {}]                # mapping of the current port to index
-        scanA = [set([]), set([])]      # list of a tuple (assigned port, destination port)
-        portsA = [set([]), set([])]     # set of an allocated ports
-        totalLagA = [0, 0]              # total number of errors during protocol
-        stepMap = [{}, {}]              # maps step to allocated port
-        foundSomething = False
-        for i in range(0, iters):
+        if stopOnFirstMatch and not asciiOut and not dotOut:
+            # lean path - only pairs needed for the first match check are tracked
+            (res, mapA, totalLagA) = self.simulationCoreFirstMatch(natSamples, strategies, nats)
+            portsA  = [set([]), set([])]
+            scanA   = [set([]), set([])]
+            stepMap = [{}, {}]
+        else:
+            # number of iterations to do
+            iters = min(len(natSamples[0]), len(natSamples[1]))
+        
+            mapA  = [{}, {}]                # mapping of the current port to index
+            scanA = [set([]), set([])]      # list of a tuple (assigned port, destination port)
+            portsA = [set([]), set([])]     # set of an allocated ports
+            totalLagA = [0, 0]              # total number of errors during protocol
+            stepMap = [{}, {}]              # maps step to allocated port
+            foundSomething = False
+            for i in range(0, iters):
             
-            # A scan
-            #dstA  = b[i]#1*i #- stageChange*(stageNumA)/10.0# destination of scan o the other side
-            for party in [0,1]:
-                # Obtain next tuple (source port, destination port) from strategy
-                nextA = strategies[party].next(party, i)
-                dstA  = nextA[1]
-                # Obtain external NAT port by querying NAT for allocation a new connection
-                curA  = nats[party].alloc(party, nextA[0], party ^ 0x1, dstA, i*self.portScanInterval)
+                # A scan
+                #dstA  = b[i]#1*i #- stageChange*(stageNumA)/10.0# destination of scan o the other side
+                for party in [0,1]:
+                    # Obtain next tuple (source port, destination port) from strategy
+                    nextA = strategies[party].next(party, i)
+                    dstA  = nextA[1]
+                    # Obtain external NAT port by querying NAT for allocation a new connection
+                    curA  = nats[party].alloc(party, nextA[0], party ^ 0x1, dstA, i*self.portScanInterval)
                 
-                # Waiting between consecutive scans, compute number of new connections by 
-                # using Poisson process. Now generating new allocations to the new round/step of the protocol.
-                curLag = natSamples[party][i]
-                totalLagA[party] += curLag
+                    # Waiting between consecutive scans, compute number of new connections by 
+                    # using Poisson process. Now generating new allocations to the new round/step of the protocol.
+                    curLag = natSamples[party][i]
+                    totalLagA[party] += curLag
                 
-                # Reflect allocations meanwhile to the NAT
-                nats[party].occupy(curLag, i*self.portScanInterval)
+                    # Reflect allocations meanwhile to the NAT
+                    nats[party].occupy(curLag, i*self.portScanInterval)
                 
-                # Add protocol to the maps.
-                toAdd  = (curA, dstA) if party==0 else (dstA, curA)     # swap pair for other party - in order to find set intersection
-                scanA[party].add(toAdd)
-                portsA[party].add(curA)
-                mapA[party][curA] = i
-                stepMap[party][i] = (curA, dstA)
-                #print "A scan: %d [%03d] --> [%03d] lag=%02d i=%03d toAdd=%s" % (party, curA, dstA, curLag, i, str(toAdd))
+                    # Add protocol to the maps.
+                    toAdd  = (curA, dstA) if party==0 else (dstA, curA)     # swap pair for other party - in order to find set intersection
+                    scanA[party].add(toAdd)
+                    portsA[party].add(curA)
+                    mapA[party][curA] = i
+                    stepMap[party][i] = (curA, dstA)
+                    #print "A scan: %d [%03d] --> [%03d] lag=%02d i=%03d toAdd=%s" % (party, curA, dstA, curLag, i, str(toAdd))
                 
-                if stopOnFirstMatch and toAdd in scanA[party ^ 0x1]: 
-                    foundSomething = True
-            if foundSomething: break
+                    if stopOnFirstMatch and toAdd in scanA[party ^ 0x1]: 
+                        foundSomething = True
+                if foundSomething: break
+        
+            # OK is there any intersection in both sets?
+            res = list(scanA[0].intersection(scanA[1]))
+            # sort by minimum element in tuple
+            res.sort(key=lambda tup: min(tup[0], tup[1]))
         
         if not self.compact:
             print("TotalLags [%02d %02d]" % (totalLagA[0], totalLagA[1]))
         
-        # OK is there any intersection in both sets?
-        res = list(scanA[0].intersection(scanA[1]))
-        # sort by minimum element in tuple
-        res.sort(key=lambda tup: min(tup[0], tup[1]))
-        
         # ascii match
-        if self.ascii > 1 or (self.ascii==1 and self.simulationRounds==1):
+        if asciiOut:
             self.matchAscii(portsA, scanA, mapA, stepMap, res)
         
         # Generate DOT graph
-        if self.dot > 1 or (self.dot==1 and self.simulationRounds==1):
+        if dotOut:
             self.generateDot(portsA[0], portsA[1], scanA[0], scanA[1], mapA, res)
         
         # return tuple
@@ -1504,12 +3361,60 @@ class NatSimulation(object):
             
         return ret
         
+    def simulationCoreFirstMatch(self, natSamples, strategies, nats):
+        '''
+        Lean version of simulationCore() for stopOnFirstMatch without ASCII/DOT output.
+        Scan pairs are encoded to integers (port on A side << 32 | port on B side) and kept
+        in one dict per party, mapping pair to the last step it was scanned in.
+        
+        Returns (res, mapA, totalLagA) as simulationCore() does, mapA holds only ports from res.
+        Pairs in res with the same minimal port are ordered by the pair, as in simulationBatchEval().
+        '''
+        iters = min(len(natSamples[0]), len(natSamples[1]))
+        pairs = [{}, {}]
+        totalLagA = [0, 0]
+        interval = self.portScanInterval
+        found = False
+        for i in range(0, iters):
+            for party in [0,1]:
+                nextA = strategies[party].next(party, i)
+                dstA  = nextA[1]
+                curA  = nats[party].alloc(party, nextA[0], party ^ 0x1, dstA, i*interval)
+                
+                curLag = natSamples[party][i]
+                totalLagA[party] += curLag
+                nats[party].occupy(curLag, i*interval)
+                
+                key = (curA << 32 | dstA) if party==0 else (dstA << 32 | curA)
+                pairs[party][key] = i
+                if key in pairs[party ^ 0x1]:
+                    found = True
+            if found: break
+        
+        res  = [(key >> 32, key & 0xFFFFFFFF) for key in pairs[0].keys() & pairs[1].keys()]
+        res.sort(key=lambda tup: (min(tup[0], tup[1]), tup))
+        
+        # last step of result ports, port of party 0 is first in the pair, of party 1 second
+        mapA = [{}, {}]
+        want = [set([x[0] for x in res]), set([x[1] for x in res])]
+        for party in [0,1]:
+            if len(want[party]) == 0: continue
+            shift = 32 if party==0 else 0
+            for key, step in pairs[party].items():
+                port = (key >> shift) & 0xFFFFFFFF
+                if port in want[party] and step >= mapA[party].get(port, -1):
+                    mapA[party][port] = step
+        return (res, mapA, totalLagA)
+    
     def simulation(self, natA, natB, strategy):
         '''
         Simple simulation of NAT traversal algorithm.
         '''
         
         nats = [natA, natB]
+        if self.batch and self.simulationRounds != 1 and self.batchCompatible(nats):
+            return self.simulationBatch(natA, natB, strategy)
+        
         successCnt = 0.0
         stopOnFirstMatch = self.simulationRounds != 1
         getTime = lambda: int(round(time.time() * 1000))
@@ -1520,6 +3425,8 @@ class NatSimulation(object):
         successAcc = [0,0]              # accumulator for steps needed to connect if successfully
         realRounds = self.simulationRounds
         for sn in range(0, self.simulationRounds):
+            self.roundRng(sn, nats, [strategy])
+            
             # reset NATs
             nats[0].reset()
             nats[1].reset()
@@ -1547,7 +3454,7 @@ class NatSimulation(object):
             # do the simulation round
             natSamples = [[], []]
             for i in [0, 1]:
-                natSamples[i] = [int(x) for x in np.random.poisson(self.lmbd*self.portScanInterval, self.errors)] 
+                natSamples[i] = [int(x) for x in self.rng.poisson(self.lmbd*self.portScanInterval, self.errors)] 
             (res, portsA, mapA, scanA, totalLagA, stepMap) = self.simulationCore(natSamples, [strategy, strategy], nats, stopOnFirstMatch)
             
             # Stop early if poor performance
@@ -1590,7 +3497,261 @@ class NatSimulation(object):
         return (successCnt / realRounds    if realRounds > 0 else 0, 
                 successCnt, 
                 successAcc[0] / successCnt if successCnt > 0 else 0,
-                successAcc[1] / successCnt if successCnt > 0 else 0,)
+                successAcc[1] / successCnt if successCnt > 0 else 0,
+                realRounds)
+    
+    def batchCompatible(self, nats):
+        '''
+        Returns True if simulationBatch() computes the same results as simulation() for given NATs:
+        incremental allocation over a contiguous port pool and no expiration during one round.
+        '''
+        for nat in nats:
+            if not isinstance(nat, (SymmetricIncrementalNat, SymmetricArrayIncrementalNat)): return False
+            if nat.pool[nat.poolLen-1] - nat.pool[0] != nat.poolLen-1: return False
+            if (self.errors-1) * self.portScanInterval > nat.timeout: return False
+        return True
+    
+    def simulationBatchEval(self, K, NS, SRC, DST, poolBase, poolLen):
+        '''
+        Evaluates a chunk of rounds of the traversal algorithm at once, stopping on the first match.
+        
+        K    = (rounds x 2) ports occupied in silent period
+        NS   = (rounds x 2 x steps) new connections between consecutive steps (natSamples)
+        SRC  = (rounds x 2 x steps) source ports of strategy moves
+        DST  = (rounds x 2 x steps) destination ports of strategy moves
+        
+        With incremental NAT the external port allocated in step i is 
+        poolBase + K + #new allocations in steps 0..i + sum(NS[0..i-1]). Repeated quartet 
+        (same source and destination port) reuses the port allocated by its first occurrence.
+        
+        Returns (success, stepA, stepB, valid) arrays over rounds. Rounds that are not valid
+        (port pool would wrap around) have to be simulated by simulationCore().
+        '''
+        R, S = NS.shape[0], NS.shape[2]
+        steps = np.arange(0, S)
+        rows  = np.repeat(np.arange(0, R), S)
+        ext   = [None, None]
+        valid = np.ones(R, dtype=bool)
+        for party in [0,1]:
+            src, dst = SRC[:,party,:], DST[:,party,:]
+            
+            # First occurrence of a quartet in each round, lexsort by (round, src, dst, step).
+            order = np.lexsort((np.tile(steps, R), dst.ravel(), src.ravel(), rows))
+            srt   = np.stack((rows[order], src.ravel()[order], dst.ravel()[order]))
+            first = np.ones(R*S, dtype=bool)
+            first[1:] = np.any(srt[:,1:] != srt[:,:-1], axis=0)
+            firstPos  = np.maximum.accumulate(np.where(first, np.arange(0, R*S), 0))
+            firstStep = np.empty(R*S, dtype=np.int64)
+            firstStep[order] = order[firstPos] % S
+            firstStep = firstStep.reshape(R, S)
+            isNew = np.zeros(R*S, dtype=bool)
+            isNew[order] = first
+            isNew = isNew.reshape(R, S)
+            
+            # Pool index of a new allocation, duplicates take port of their first occurrence.
+            idx = K[:,party][:,None] + np.cumsum(isNew, axis=1) + (np.cumsum(NS[:,party,:], axis=1) - NS[:,party,:])
+            valid &= idx.max(axis=1) < poolLen
+            ext[party] = poolBase + np.take_along_axis(idx, firstStep, axis=1)
+        
+        # Scan pairs (port on A side, port on B side), swapped for B - as in simulationCore().
+        # Only pairs with both ports in 16-bit range can match, encoded as round<<32 | a<<16 | b.
+        pairs = [(ext[0], DST[:,0,:]), (DST[:,1,:], ext[1])]
+        keys, kstep = [], []
+        for a, b in pairs:
+            ok  = (a >= 0) & (a < 65536) & (b >= 0) & (b < 65536)
+            key = (rows.reshape(R, S)[ok] << 32) | (a[ok] << 16) | b[ok]
+            stp = np.broadcast_to(steps, (R, S))[ok]
+            order = np.lexsort((stp, key))              # minimal step for each pair
+            key, stp = key[order], stp[order]
+            first = np.ones(len(key), dtype=bool)
+            first[1:] = key[1:] != key[:-1]
+            keys.append(key[first])
+            kstep.append(stp[first])
+        
+        common, i0, i1 = np.intersect1d(keys[0], keys[1], assume_unique=True, return_indices=True)
+        mstep  = np.maximum(kstep[0][i0], kstep[1][i1])  # pair is matched once both sides have scanned it
+        mround = common >> 32
+        
+        # First matching step in each round, result = matching pair with minimal port.
+        stopStep = np.full(R, S, dtype=np.int64)
+        np.minimum.at(stopStep, mround, mstep)
+        success  = stopStep < S
+        sel    = mstep == stopStep[mround]
+        ma, mb = (common[sel] >> 16) & 0xFFFF, common[sel] & 0xFFFF
+        order  = np.lexsort((mb, ma, np.minimum(ma, mb), mround[sel]))
+        mr     = mround[sel][order]
+        first  = np.ones(len(mr), dtype=bool)
+        first[1:] = mr[1:] != mr[:-1]
+        resA, resB = np.zeros(R, dtype=np.int64), np.zeros(R, dtype=np.int64)
+        resA[mr[first]] = ma[order][first]
+        resB[mr[first]] = mb[order][first]
+        
+        # Step of the last allocation of the result ports until stop step (mapA in simulationCore).
+        stepRes = []
+        for party, port in [(0, resA), (1, resB)]:
+            hit = (ext[party] == port[:,None]) & (steps[None,:] <= stopStep[:,None])
+            stepRes.append(np.where(success, S - 1 - np.argmax(hit[:,::-1], axis=1), 0))
+        return (success, stepRes[0], stepRes[1], valid)
+    
+    def simulationBatch(self, natA, natB, strategy):
+        '''
+        Vectorized variant of simulation() for incremental NATs, see batchCompatible().
+        
+        Random samples are drawn round by round in the same order as simulation() draws them,
+        thus the same random stream (or the same seed) gives the same results. Per-step NAT allocations and the 
+        intersection search of simulationCore() are evaluated on (rounds x steps) matrices 
+        for batchRounds rounds at once.
+        '''
+        nats = [natA, natB]
+        successCnt = 0.0
+        getTime = lambda: int(round(time.time() * 1000))
+        simStart = getTime()
+        
+        successAcc = [0,0]              # accumulator for steps needed to connect if successfully
+        realRounds = self.simulationRounds
+        steps = self.errors
+        
+        # round after which simulation stops early if poor performance, same as in simulation()
+        fast = self.simulationRoundsFast if self.simulationRounds > self.simulationRoundsFast else -1
+        sn = 0
+        while sn < self.simulationRounds:
+            cnt = min(self.batchRounds, self.simulationRounds - sn)
+            if sn <= fast < sn+cnt: cnt = fast+1 - sn
+            
+            K   = np.zeros((cnt, 2), dtype=np.int64)
+            NS  = np.zeros((cnt, 2, steps), dtype=np.int64)
+            SRC = np.zeros((cnt, 2, steps), dtype=np.int64)
+            DST = np.zeros((cnt, 2, steps), dtype=np.int64)
+            for r in range(0, cnt):
+                self.roundRng(sn + r, nats, [strategy])
+                strategy.reset(nats, self)
+                
+                # generate silent period time and new connections, same order as in simulation()
+                curSilentA = self.silentPeriodBase + self.poisson(self.silentPeriodlmbd, 1)
+                curSilentB = self.silentPeriodBase + self.poisson(self.silentPeriodlmbd, 1)
+                K[r,0] = self.poisson(self.lmbd, curSilentA)
+                K[r,1] = self.poisson(self.lmbd, curSilentB)
+                strategy.silent(curSilentA, curSilentB, self.lmbd)
+                
+                for i in [0, 1]:
+                    NS[r,i,:] = self.rng.poisson(self.lmbd*self.portScanInterval, steps)
+                for i in [0, 1]:
+                    SRC[r,i,:], DST[r,i,:] = strategy.moves(i, steps)
+            
+            (success, stepA, stepB, valid) = self.simulationBatchEval(K, NS, SRC, DST, natA.pool[0], natA.poolLen)
+            
+            # Port pool wraps around in these rounds, replay them on real NATs.
+            for r in np.nonzero(~valid)[0]:
+                for i in [0, 1]:
+                    nats[i].reset()
+                    nats[i].occupy(int(K[r,i]), 0)
+                (res, portsA, mapA, scanA, totalLagA, stepMap) = self.simulationCore([NS[r,0,:].tolist(), NS[r,1,:].tolist()], 
+                                                                                   [ReplayStrategy(SRC[r], DST[r])]*2, nats, True)
+                success[r] = len(res) > 0
+                if success[r]:
+                    stepA[r] = mapA[0][res[0][0]]
+                    stepB[r] = mapA[1][res[0][1]]
+            
+            if self.compact:
+                sys.stdout.write("".join([('X' if x else '.') for x in success]))
+                sys.stdout.flush()
+            
+            # Stop early if poor performance
+            if sn <= fast < sn+cnt:
+                okFast = success[0:fast-sn]
+                if 2.0*(successCnt + okFast.sum()) < self.simulationRoundsFast:
+                    sys.stdout.write('Z')
+                    sys.stdout.flush()
+                    realRounds = fast+1
+                    successCnt    += float(okFast.sum())
+                    successAcc[0] += int(stepA[0:fast-sn][okFast].sum())
+                    successAcc[1] += int(stepB[0:fast-sn][okFast].sum())
+                    break
+            
+            successCnt    += float(success.sum())
+            successAcc[0] += int(stepA[success].sum())
+            successAcc[1] += int(stepB[success].sum())
+            sn += cnt
+        
+        simEnd = getTime()
+        simTotal = simEnd - simStart
+        
+        # Report results after simulation is done
+        print("\nSuccess count: %02.3f ; cnt=%03d; lmbd=%01.3f; scanInterval=%04d ms; base sleep=%04d; average steps: %04.3f %04.3f; time elapsed=%04.3f s" % \
+            (successCnt / realRounds    if realRounds > 0 else 0, 
+             successCnt, 
+             self.lmbd, 
+             self.portScanInterval, 
+             self.silentPeriodBase,
+             successAcc[0] / successCnt if successCnt > 0 else 0,
+             successAcc[1] / successCnt if successCnt > 0 else 0,
+             simTotal/1000.0))
+        
+        return (successCnt / realRounds    if realRounds > 0 else 0, 
+                successCnt, 
+                successAcc[0] / successCnt if successCnt > 0 else 0,
+                successAcc[1] / successCnt if successCnt > 0 else 0,
+                realRounds)
+    
+    def nfSimulationRound(self, natSamples, nats, strategies, sn, stopOnFirstMatch, lambdaSamples=20):
+        '''
+        One round of nfSimulation() on a pair of NAT sample blocks, natSamples items are replaced.
+        Returns (res, mapA) of simulationCore().
+        '''
+        T = self.portScanInterval
+        self.roundRng(sn, nats, strategies)
+        
+        # reset NATs
+        nats[0].reset()
+        nats[1].reset()
+        strategies[0].reset(nats, self)
+        strategies[1].reset(nats, self)
+        
+        #
+        # Measure lambda by using some nat samples for it.
+        # lmbd[0] = lambda for A network, thus interesting for B
+        #
+        lmbd    = [ (sum(natSamples[party][0:lambdaSamples]) / float(lambdaSamples          * T)) for party in [0,1] ]
+        lmbdAvg = [ (sum(natSamples[party])                  / float(len(natSamples[party]) * T)) for party in [0,1] ] # average lambda, just info for user 
+        natSamples[0] = natSamples[0][lambdaSamples:]
+        natSamples[1] = natSamples[1][lambdaSamples:]
+        
+        # generate silent period time, convert to NAT samples
+        curSilentA = (self.silentPeriodBase + self.poisson(self.silentPeriodlmbd, 1)) / float(T)
+        curSilentB = (self.silentPeriodBase + self.poisson(self.silentPeriodlmbd, 1)) / float(T) 
+        
+        # Generate new connections for silent period on both sides. For whole time frames use 
+        # NAT sample, for partial generate appropriate part according to lambda measurement...
+        kA = sum(natSamples[0][0:int(math.floor(curSilentA))]) + self.poisson(lmbd[0], int(T*(curSilentA - math.floor(curSilentA))))
+        kB = sum(natSamples[1][0:int(math.floor(curSilentB))]) + self.poisson(lmbd[1], int(T*(curSilentB - math.floor(curSilentB))))
+        
+        # reflect errors to NAT allocation - take ports from silent period
+        nats[0].occupy(kA, 0)
+        nats[1].occupy(kB, 0)
+        
+        # strip silent period
+        natSamples[0] = natSamples[0][int(math.floor(curSilentA)):]
+        natSamples[1] = natSamples[1][int(math.floor(curSilentB)):]
+        
+        # set silent period duration to the strategy
+        strategies[0].silent(int(curSilentB*T), 0, lmbd[1])
+        strategies[1].silent(0,                     int(curSilentA*T), lmbd[0])
+        
+        if not self.compact:
+            print("\n##%03d. C. s. period: [%03.3f, %03.3f]~[%04d, %04d]; lmbd est [%03.3f, %03.3f] s.p. est. [%03.3f, %03.3f] len [%d, %d] lmbdAvg [%03.3f, %03.3f]" \
+                % (sn, 
+                   curSilentA*T, curSilentB*T, 
+                   kA, kB, 
+                   lmbd[0], lmbd[1], 
+                   strategies[0].startPos[0], strategies[1].startPos[1], 
+                   len(natSamples[0]), len(natSamples[1]),
+                   lmbdAvg[0], lmbdAvg[1]
+                   ))
+            print(strategies[0])
+        
+        # do the simulation round 
+        (res, portsA, mapA, scanA, totalLagA, stepMap) = self.simulationCore(natSamples, strategies, nats, stopOnFirstMatch)
+        return (res, mapA)
     
     def nfSimulation(self, natA, natB, strategyA, strategyB, filename=None, processedNfdump=None, homeNet='', filt=None, recEachSkip=0, maxBlock=-1):
         '''
@@ -1619,20 +3780,11 @@ class NatSimulation(object):
         successAcc = [0,0]              # accumulator for steps needed to connect if successfully
         realRounds = self.simulationRounds
         
-        # Prepare nfdump record generator.
-        nfdumpObj       = None
-        nfdumpGenerator = None
-        if processedNfdump!=None:
-            nfdumpObj = NfdumpReader(processedNfdump)
-            nfdumpGenerator = nfdumpObj.generator()
-        else:
-            nfdumpObj = NfdumpSorter(filename, filt, activeTimeout)
-            nfdumpGenerator = nfdumpObj.generator()
-        
+        # Prepare nfdump record generator,
         # generates samples of NAT process w.r.t. new connections.
-        nfgen = self.nfdumpSampleGenerator(natA, nfdumpGenerator, homeNet, T, 
-                                           sampleSize=sampleSize, recStartSkip=sampleSkip, 
-                                           recEachSkip=recEachSkip, maxBlockSize=maxBlock, activeTimeout=activeTimeout)
+        nfdumpObj, nfgen = self.nfdumpSampleSource(natA, filename, processedNfdump, filt, homeNet, T, 
+                                                   sampleSize=sampleSize, recStartSkip=sampleSkip, 
+                                                   recEachSkip=recEachSkip, maxBlockSize=maxBlock, activeTimeout=activeTimeout)
         samplesMean = []
         while True:
             # sample NAT connections from Nfdump files
@@ -1646,60 +3798,11 @@ class NatSimulation(object):
             
             sn += 1
             
-            # reset NATs
-            nats[0].reset()
-            nats[1].reset()
-            strategyA.reset(nats, self)
-            strategyB.reset(nats, self)
-            
             # Lambda statistics
             samplesMean.append(np.mean(  [ (i / float(T)) for i in natSamples[0] ]  ))
             samplesMean.append(np.mean(  [ (i / float(T)) for i in natSamples[1] ]  ))
             
-            #
-            # Measure lambda by using some nat samples for it.
-            # lmbd[0] = lambda for A network, thus interesting for B
-            #
-            lmbd    = [ (sum(natSamples[party][0:lambdaSamples]) / float(lambdaSamples          * T)) for party in [0,1] ]
-            lmbdAvg = [ (sum(natSamples[party])                  / float(len(natSamples[party]) * T)) for party in [0,1] ] # average lambda, just info for user 
-            natSamples[0] = natSamples[0][lambdaSamples:]
-            natSamples[1] = natSamples[1][lambdaSamples:]
-            
-            # generate silent period time, convert to NAT samples
-            curSilentA = (self.silentPeriodBase + self.poisson(self.silentPeriodlmbd, 1)) / float(T)
-            curSilentB = (self.silentPeriodBase + self.poisson(self.silentPeriodlmbd, 1)) / float(T) 
-            
-            # Generate new connections for silent period on both sides. For whole time frames use 
-            # NAT sample, for partial generate appropriate part according to lambda measurement...
-            kA = sum(natSamples[0][0:int(math.floor(curSilentA))]) + self.poisson(lmbd[0], int(T*(curSilentA - math.floor(curSilentA))))
-            kB = sum(natSamples[1][0:int(math.floor(curSilentB))]) + self.poisson(lmbd[1], int(T*(curSilentB - math.floor(curSilentB))))
-            
-            # reflect errors to NAT allocation - take ports from silent period
-            nats[0].occupy(kA, 0)
-            nats[1].occupy(kB, 0)
-            
-            # strip silent period
-            natSamples[0] = natSamples[0][int(math.floor(curSilentA)):]
-            natSamples[1] = natSamples[1][int(math.floor(curSilentB)):]
-            
-            # set silent period duration to the strategy
-            strategyA.silent(int(curSilentB*T), 0, lmbd[1])
-            strategyB.silent(0,                     int(curSilentA*T), lmbd[0])
-            
-            if not self.compact:
-                print("\n##%03d. C. s. period: [%03.3f, %03.3f]~[%04d, %04d]; lmbd est [%03.3f, %03.3f] s.p. est. [%03.3f, %03.3f] len [%d, %d] lmbdAvg [%03.3f, %03.3f]" \
-                    % (sn, 
-                       curSilentA*T, curSilentB*T, 
-                       kA, kB, 
-                       lmbd[0], lmbd[1], 
-                       strategyA.startPos[0], strategyB.startPos[1], 
-                       len(natSamples[0]), len(natSamples[1]),
-                       lmbdAvg[0], lmbdAvg[1]
-                       ))
-                print(strategyA)
-            
-            # do the simulation round 
-            (res, portsA, mapA, scanA, totalLagA, stepMap) = self.simulationCore(natSamples, strategies, nats, stopOnFirstMatch)
+            (res, mapA) = self.nfSimulationRound(natSamples, nats, strategies, sn, stopOnFirstMatch, lambdaSamples)
             
             # fail -> nothing to do now
             if (len(res) == 0): 
@@ -1740,6 +3843,114 @@ class NatSimulation(object):
                 successAcc[0] / successCnt if successCnt > 0 else 0,
                 successAcc[1] / successCnt if successCnt > 0 else 0,)
     
+    def nfSamplePairs(self, nfgen, sampleSize):
+        '''
+        Yields pairs of consecutive NAT sample blocks from the generator for simulation rounds
+        as nfSimulation() takes them, pairs with a short block are skipped.
+        '''
+        while True:
+            try:
+                natSamples = [next(nfgen), next(nfgen)]
+            except StopIteration:
+                break
+            if len(natSamples[0]) < sampleSize or len(natSamples[1]) < sampleSize: continue
+            yield natSamples
+    
+    def nfBenchRounds(self, nats, strategies, rounds, stopOnFirstMatch):
+        '''
+        Simulates rounds [(round number, natSamples)] with given NATs and strategies,
+        returns (success count, accumulated steps of successful rounds for both sides).
+        '''
+        successCnt = 0.0
+        successAcc = [0,0]
+        for sn, natSamples in rounds:
+            (res, mapA) = self.nfSimulationRound(list(natSamples), nats, strategies, sn, stopOnFirstMatch)
+            if (len(res) == 0): 
+                continue
+            successCnt += 1.0
+            successAcc[0] += mapA[0][res[0][0]]
+            successAcc[1] += mapA[1][res[0][1]]
+        return (successCnt, successAcc)
+    
+    def nfBenchmark(self, snames, filename=None, processedNfdump=None, homeNet='', filt=None, recEachSkip=0, maxBlock=-1, workers=0, chunk=50):
+        '''
+        Evaluates strategies given by names on the same NAT sample pairs taken in one pass over netflow data,
+        as nfSimulation() would do for each of them. Rounds are simulated in process or in a pool of workers, 
+        in chunks of rounds. Returns dictionary strategy name -> result of nfSimulation().
+        '''
+        activeTimeout = 300*1000
+        sampleSize = 950
+        sampleSkip = 0
+        stopOnFirstMatch = self.simulationRounds != 1
+        getTime = lambda: int(round(time.time() * 1000))
+        simStart = getTime()
+        
+        # NAT for sampling, simulation uses its own NATs
+        natS = getNat(self.natType, self.natParams)
+        nfdumpObj, nfgen = self.nfdumpSampleSource(natS, filename, processedNfdump, filt, homeNet, self.portScanInterval, 
+                                                   sampleSize=sampleSize, recStartSkip=sampleSkip, 
+                                                   recEachSkip=recEachSkip, maxBlockSize=maxBlock, activeTimeout=activeTimeout)
+        
+        acc  = dict([(sname, [0.0, 0, 0]) for sname in snames])   # success count, steps A, steps B
+        sims = {}
+        for sname in snames:
+            strategies = [getStrategy(sname, 0), getStrategy(sname, 0)]
+            strategies[0].init(None)
+            strategies[1].init(None)
+            sims[sname] = ([getNat(self.natType, self.natParams), getNat(self.natType, self.natParams)], strategies)
+        
+        conf    = dict([(k, getattr(self, k)) for k in BENCH_CONF])
+        pool    = multiprocessing.Pool(workers) if workers > 0 else None
+        pending = []
+        seeds   = np.random.SeedSequence()          # independent streams of unseeded worker tasks
+        def account(sname, res):
+            acc[sname][0] += res[0]
+            acc[sname][1] += res[1][0]
+            acc[sname][2] += res[1][1]
+        def dispatch(rounds):
+            if len(rounds) == 0: return
+            for sname in snames:
+                if pool == None: account(sname, self.nfBenchRounds(sims[sname][0], sims[sname][1], rounds, stopOnFirstMatch))
+                else: 
+                    seed = int(seeds.spawn(1)[0].generate_state(1)[0])
+                    pending.append(pool.apply_async(nfBenchWorker, ((sname, rounds, stopOnFirstMatch, seed, conf),)))
+            # bounded number of chunks waiting in the pool
+            while len(pending) > 4 * workers * len(snames):
+                account(*pending.pop(0).get())
+        
+        sn     = 0
+        rounds = []
+        try:
+            for natSamples in self.nfSamplePairs(nfgen, sampleSize):
+                sn += 1
+                rounds.append((sn, natSamples))
+                if len(rounds) >= chunk:
+                    dispatch(rounds)
+                    rounds = []
+                    sys.stdout.write('.')
+                    sys.stdout.flush()
+            dispatch(rounds)
+            while len(pending) > 0:
+                account(*pending.pop(0).get())
+        finally:
+            if pool != None:
+                pool.close()
+                pool.join()
+            nfdumpObj.deinit()
+        
+        simTotal = getTime() - simStart
+        out = {}
+        for sname in snames:
+            successCnt, acc0, acc1 = acc[sname]
+            out[sname] = (successCnt / sn     if sn > 0 else 0, 
+                          successCnt, 
+                          acc0 / successCnt if successCnt > 0 else 0,
+                          acc1 / successCnt if successCnt > 0 else 0,)
+            print("\n%s: Success count: %02.3f ; cnt=%03d; rounds=%d; scanInterval=%04d ms; base sleep=%04d; average steps: %04.3f %04.3f" % \
+                (sname, out[sname][0], successCnt, sn, self.portScanInterval, self.silentPeriodBase, out[sname][2], out[sname][3]))
+        print("Time elapsed=%04.3f s" % (simTotal/1000.0))
+        return out
+    
     def matchAscii(self, portsA, scanA, mapA, stepMap, res):
         cnt = [[0]*3, [0]*3]
         for i in range(0, self.errors):     # step loop
@@ -1865,7 +4076,7 @@ class NatSimulation(object):
         i = 0
         while N <= poolsize and i < 5*poolsize:
             # U ~ U(0,1), uniform distribution
-            U = random.random()
+            U = self.rng.random()
             i+= 1
             
             # next time of the event, exponential distribution
@@ -1893,7 +4104,7 @@ class NatSimulation(object):
         try:
             while True:
                 # U ~ U(0,1), uniform distribution
-                U = random.random()
+                U = self.rng.random()
                 
                 # next time of the event, exponential distribution
                 nextEvt = (-(1/self.lmbd) * math.log(U)) 
@@ -2021,7 +4232,7 @@ class NatSimulation(object):
             if t > timeout: lmbdL = cLmbd
         return lmbdL
     
-    def portDistributionFunction(self, lmbd, t, isteps=[], exclude=[]):
+    def portDistributionFunction(self, lmbd, t, isteps=[], exclude=[], iterations=5000, exact=False):
         '''
         Measures distribution function of the ports on NAT with Poisson process.
         This matters since the whole nature of NAT is incremental. Number of 
@@ -2030,89 +4241,79 @@ class NatSimulation(object):
         makes a difference, also taking my port allocation into account. 
         
         For instance port 6 can be reached by 2,2,2 or 3,3. 
-        '''
-        iterations = 5000
         
+        Runs are simulated in chunks at once - port in step i of a run is the cumulative sum 
+        of 1 + Po(lmbd*t) increments over previous steps, i.e. matrix (runs x steps) of
+        Poisson samples is drawn and summed along steps.
+        
+        Exact distribution (portPmfTable()) is used as a reference in the statistics of each step.
+        With exact=True nothing is sampled, statistics are computed on the exact distribution scaled 
+        to iterations runs.
+        '''
         isteps  = set(isteps)
         maxStep = max(isteps) if len(isteps) > 0 else 1000
         
         sn = 0
         ports = int(maxStep * 10)
-        portDistrib = [0] * ports   # initializes to arrays to zeros of length <ports>
-        portDistribSteps = {}       # port distributions in particular steps
-        
-        # initialize port distributions 
-        for i in isteps: portDistribSteps[i] = [0] * ports 
-        
-        # Simulate the process. Each iteration generates process sample and
-        # adds data to accumulators.
+        steps = sorted(isteps)
+        pmf   = portPmfTable(lmbd*t, maxStep, ports, tuple(sorted(exclude)))
+        if exact: sn = iterations
+        stepIdx = np.array(steps, dtype=np.int64)
+        exclude = np.array(sorted(exclude), dtype=np.int64)
+        portDistrib = np.zeros(ports, dtype=np.int64)                   # port distribution over all steps
+        stepDistrib = np.zeros(len(steps) * ports, dtype=np.int64)      # port distributions in particular steps, flattened
+        
+        # Simulate the process. Each chunk of runs generates process samples and
+        # adds data to accumulators. Runs are limited by the chunk memory, (runs x steps) matrix.
+        chunk = max(1, min(iterations, (1 << 22) // (maxStep+1)))
+        accept = 1.0                                                    # ratio of runs not rejected by exclude
         while sn < iterations:
+            rows = min(chunk, int((iterations - sn) / accept) + 1)
             
-            # Speed optimization - sample poisson distribution
-            poissonSample = np.random.poisson(lmbd*t, max(maxStep+10, ports+10))
-            ssize = len(poissonSample)
-            
-            # 
-            portsArr = {}   # stores step -> port mapping in this simulation run
-            step    = 0
-            curPort = 0
-            fail    = False
-            while curPort < ports:             
-                # Select only those runs that does not trigger particular ports.
-                # This fixes probability of occuring such port to 0 and simulating
-                # port distribution function under this condition (conditional probability)
-                #
-                # How to set p.m.f. for some element x to 0: re-normalize p.m.f. to 1 again,
-                # multiply each element by 1/(1-p) where p is probability for element x.
-                #
-                # How it is done here: lets assume 1 step, left out y=2.
-                # Then p(1)_real = p(1) * sum_{step=0}^{\infty} P(y)^{step} = p(1) * (1 + p(y) + p(y)^2 + ...)
-                # Sum of a geometrical sequence gives us: sum_{step=0}^{\infty} P(y)^{step} = 1 / (1-p(y))
-                #
-                # Thus generating a) by scaling and b) by omitting and re-generating is equivalent, at least
-                # for the first step.   
-                #
-                if step!=0 and (curPort in exclude) and maxStep >= step: 
-                    fail = True
-                    break
-                
-                # Step optimization here, if we are interested only in results from
-                # particular step, it is not needed to compute
-                if (maxStep!=-1 and maxStep < step):
-                    break
-                
-                portsArr[step] = curPort
-                curPort += poissonSample[step] if step < ssize else np.random.poisson(lmbd*t)  #self.poisson(lmbd, t) # add new connections by Poisson process
-                curPort += 1                     # add my port, I made it by a new connection
-                step    += 1
+            # port in each step, run starts on port 0 in step 0
+            P = np.zeros((rows, maxStep+1), dtype=np.int64)
+            np.cumsum(self.rng.poisson(lmbd*t, (rows, maxStep)) + 1, axis=1, out=P[:,1:])
             
+            # Select only those runs that does not trigger particular ports.
+            # This fixes probability of occuring such port to 0 and simulating
+            # port distribution function under this condition (conditional probability)
             #
-            # Check if generated run complies our probabilistic distribution
-            # we want to get.
+            # How to set p.m.f. for some element x to 0: re-normalize p.m.f. to 1 again,
+            # multiply each element by 1/(1-p) where p is probability for element x.
             #
-            if (sn % 1000) == 0: 
-                sys.stdout.write('%04d;' % sn)  
-                sys.stdout.flush()
-            if fail: 
-                sys.stdout.write('x')
-                continue
+            # How it is done here: lets assume 1 step, left out y=2.
+            # Then p(1)_real = p(1) * sum_{step=0}^{\infty} P(y)^{step} = p(1) * (1 + p(y) + p(y)^2 + ...)
+            # Sum of a geometrical sequence gives us: sum_{step=0}^{\infty} P(y)^{step} = 1 / (1-p(y))
+            #
+            # Thus generating a) by scaling and b) by omitting and re-generating is equivalent, at least
+            # for the first step.   
+            #
+            # Ports out of the port range are not observed - run ends there.
+            if len(exclude) > 0:
+                fail = (np.isin(P[:,1:], exclude) & (P[:,1:] < ports)).any(axis=1)
+                accept = max(0.01, 1.0 - fail.mean())
+                P = P[~fail][0:iterations-sn]
+                sys.stdout.write('x' * int(fail.sum()))
+            else:
+                P = P[0:iterations-sn]
             
             # Add ports to distribution.
             # We are computing probability dostribution on ports in particular 
             # time step.
-            for step in portsArr:
-                curPort = portsArr[step]
-                
-                # Are we interested in particular port add sample 
-                # to distribution collector.
-                if step in isteps:
-                    portDistribSteps[step][curPort] += 1
-                
-                # Collecting to total distribution
-                if curPort!=0:
-                    portDistrib[curPort] += 1
-            sn += 1 
-        pass
+            S = P[:, stepIdx]
+            inRange = S < ports
+            stepDistrib += np.bincount((np.arange(len(steps)) * ports + S)[inRange], minlength=len(steps)*ports)
+            
+            # Collecting to total distribution
+            inRange = (P > 0) & (P < ports)
+            portDistrib += np.bincount(P[inRange], minlength=ports)
+            
+            sn += len(P)
+            sys.stdout.write('%04d;' % sn)  
+            sys.stdout.flush()
+        
+        portDistribSteps = dict(zip(steps, stepDistrib.reshape(len(steps), ports)))
+        if exact: portDistribSteps = dict([(step, iterations * pmf[step]) for step in steps])
         lmbdStr = ('%01.4f' % lmbd).replace('.', '_')
         print("Data sampling done...")
         
@@ -2123,11 +4324,13 @@ class NatSimulation(object):
         for step in portDistribSteps:
             print("\n", "="*80)
             print("Step %03d" % step)
-            self.histAndStatisticsPortDistrib(portDistribSteps[step], iterations, ports, 'distrib/step_%s_%03d__%04d.png' % (lmbdStr, t, step), drawHist=True, step=step)
+            self.histAndStatisticsPortDistrib(portDistribSteps[step], iterations, ports, 'distrib/step_%s_%03d__%04d.png' % (lmbdStr, t, step), drawHist=True, step=step,
+                                              dist=None if exact else pmf[step])
     
     def histAndStatisticsPortDistrib(self, portDistrib, iterations, ports, fname=None, histWidth=None, drawHist=False, step=-1, dist=None):
         '''
         Compute basic statistics of a given distribution, draws histrogram.
+        dist is an optional reference p.m.f. (e.g. exact one) to be tested along with fitted models.
         '''
         chi1, pval1, chi3, pval3, n3, p3, chi2, pval2, m2, l2, rr2 = 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0
         
@@ -2185,49 +4388,22 @@ class NatSimulation(object):
         print("Chi-Squared test on match with NB(%04d, %04.4f): Chi: %s, p-value=%01.25f; alpha=0.05; hypothesis %s r=%01.8f" % \
             (n5, p5, ('%04.4f' % chi5).zfill(10), pval5, "is REJECTED" if pval5 < 0.05 else "holds      ", rr5))
             
+        # Reference distribution, no parameters estimated
+        m6 = None
+        if dist is not None:
+            m6 = iterations * np.asarray(dist)[0:ports]
+            (chi6, pval6) = self.goodMatchDistribution(portDistrib, m6, ports, iterations)
+            rr6           = self.pearsonCorelation(m6, portDistrib)
+            print("Chi-Squared test on match with reference:   Chi: %s, p-value=%01.25f; alpha=0.05; hypothesis %s r=%01.8f" % \
+                (('%04.4f' % chi6).zfill(10), pval6, "is REJECTED" if pval6 < 0.05 else "holds      ", rr6))
+            
         #
         # Draw a histogram
         #
         if drawHist:
-            pos = np.arange(ports)
-            width = 1.0     # gives histogram aspect to the bar diagram
-            
-            ax = plt.axes()
-            ax.set_xticks(pos + (width / 2))
-            ax.set_xticklabels(list(range(0, ports)), rotation=90, size='xx-small')
-            
-            plt.xlabel('port')
-            plt.ylabel('frequency') #,rotation='horizontal')
-            plt.grid(True)
-
-            if histWidth != None:
-                ax.set_ylim([0,histWidth])
-            
-            (tlow, thigh, tmax) = self.unimodalLowIdx(portDistrib, 1)   # set limits on X axis to show only values above 0    
-            plt.xlim(tlow,thigh)
-            
-            plt.bar(pos, portDistrib, width, color='r')
-            plt.plot(pos, m1, 'g^', label="Po")
-            plt.plot(pos, m5, 'mp', label="NB")
-            #plt.plot(pos, m4, 'c>', label="BN")
-            
-            if step!=-1:
-                plt.plot(pos, m2, 'b^', label="$Po_2$")
-            
-            if fname != None:
-                if isinstance(fname, list):
-                    for fname_i in fname:
-                        try:
-                            plt.savefig(fname_i)
-                        except Exception as e:
-                            print("Error, cannot save to file %s Exception: " % fname_i, e)
-                else:
-                    plt.savefig(fname)
-                plt.close()
-            else:
-                plt.show()
+            self.drawPortDistrib(portDistrib, ports, m1, m5, m2 if step!=-1 else None, fname, histWidth, m6)
                 
-        return {'ssum' : ssum, 'ex': ex, 'var': var, 'stdev': stdev, 
+        res = {'ssum' : ssum, 'ex': ex, 'var': var, 'stdev': stdev, 
                 'distrib': [
                      {'chi': chi1, 'pval': pval1, 'm': m1, 'r2': rr1, 'par': [ex], 'lmbd': ex},             # Poisson
                      {'chi': chi2, 'pval': pval2, 'm': m2, 'r2': rr2, 'par': [l2], 'lmbd': l2},             # Poisson, shifted, variance based
@@ -2236,6 +4412,54 @@ class NatSimulation(object):
                      {'chi': chi5, 'pval': pval5, 'm': m5, 'r2': rr5, 'par': [n5,p5], 'n': n5, 'p': p5}     # Negative binomial, MLE
                     ]    
                 }
+        if m6 is not None:
+            res['distrib'].append({'chi': chi6, 'pval': pval6, 'm': m6, 'r2': rr6, 'par': []})         # Reference
+        return res
+    
+    def drawPortDistrib(self, portDistrib, ports, m1, m5, m2=None, fname=None, histWidth=None, mRef=None):
+        '''
+        Draws histogram of port distribution with expected frequencies of fitted Poisson (m1), 
+        negative binomial (m5), shifted Poisson (m2) models and reference distribution (mRef).
+        '''
+        pos = np.arange(ports)
+        width = 1.0     # gives histogram aspect to the bar diagram
+        
+        ax = plt.axes()
+        ax.set_xticks(pos + (width / 2))
+        ax.set_xticklabels(list(range(0, ports)), rotation=90, size='xx-small')
+        
+        plt.xlabel('port')
+        plt.ylabel('frequency') #,rotation='horizontal')
+        plt.grid(True)
+
+        if histWidth != None:
+            ax.set_ylim([0,histWidth])
+        
+        (tlow, thigh, tmax) = self.unimodalLowIdx(portDistrib, 1)   # set limits on X axis to show only values above 0    
+        plt.xlim(tlow,thigh)
+        
+        plt.bar(pos, portDistrib, width, color='r')
+        plt.plot(pos, m1, 'g^', label="Po")
+        plt.plot(pos, m5, 'mp', label="NB")
+        #plt.plot(pos, m4, 'c>', label="BN")
+        
+        if m2 is not None:
+            plt.plot(pos, m2, 'b^', label="$Po_2$")
+        if mRef is not None:
+            plt.plot(pos, mRef, 'k.', label="exact")
+        
+        if fname != None:
+            if isinstance(fname, list):
+                for fname_i in fname:
+                    try:
+                        plt.savefig(fname_i)
+                    except Exception as e:
+                        print("Error, cannot save to file %s Exception: " % fname_i, e)
+            else:
+                plt.savefig(fname)
+            plt.close()
+        else:
+            plt.show()
     
     def pearsonCorelation(self, model, observed):
         '''
@@ -2263,24 +4487,18 @@ class NatSimulation(object):
         E[X], V[X], stddev, sum
         '''
         
+        counts = np.asarray(portDistrib)
+        ports  = np.arange(len(counts), dtype=float)
+        
         # sum port distrib function
-        ssum = 0
-        for i in portDistrib: ssum+=i 
+        ssum = counts.sum()
         
         # expected value of distribution
-        ex = 0.0
-        for port, count in enumerate(portDistrib): 
-            p   = float(count) / float(iterations)
-            ex += p * float(port)
+        ex = float(np.dot(counts, ports)) / float(iterations)
         
         # sample unbiased variance of distribution = 1/(n-1) * Sum((x_i - E[x])^2)
-        var = 0.0
-        cn  = 0
-        for port, count in enumerate(portDistrib):
-            var += count * ((port - ex) * (port - ex))
-            cn  += count
-            
-        var = var / (float(cn)-1) if cn>1 else 0
+        var = float(np.dot(counts, (ports - ex) ** 2))
+        var = var / (float(ssum)-1) if ssum>1 else 0
         stdev = math.sqrt(var)
         return (ssum, ex, var, stdev)
     
@@ -2324,7 +4542,7 @@ class NatSimulation(object):
         n = int(n)
         
         # expected values - compute N * probability for each port assumed in range 0..bins
-        expected = [(iterations * binom.pmf(i, n, p)) for i in range(0, bins)]
+        expected = iterations * pmfTable('binom', (n, p), bins)
         (chi, pval) = self.goodMatchDistribution(observed, expected, bins, iterations, matchBoth, verbose, wiseBinning, ddof=1)
         return (chi, pval, n, p, expected)
     
@@ -2358,37 +4576,76 @@ class NatSimulation(object):
         '''
         
         # expected values - compute N * probability for each port assumed in range 0..bins
-        expected = [(iterations * nbinom.pmf(i, n, p)) for i in range(0, bins)]
+        expected = iterations * pmfTable('nbinom', (n, p), bins)
         (chi, pval) = self.goodMatchDistribution(observed, expected, bins, iterations, matchBoth, verbose, wiseBinning, ddof=1)
         return (chi, pval, n, p, expected)
     
+    def negativeBinomialMLE(self, observed):
+        '''
+        Maximum Likelihood Estimator of negative binomial parameters from histogram of counts
+        (observed[k] = number of observations of value k). Returns (size, mu) as MASS.fitdistr does.
+        
+        MLE of mu is the sample mean. Size r solves the score equation of the profile log-likelihood
+          sum_k h_k * (digamma(k+r) - digamma(r)) + N * log(r / (r+mu)) = 0,
+        solved by Brent's method on log(r), starting from the moment estimate mu^2 / (var-mu).
+        Data not over-dispersed (var <= mu) has no finite solution (Poisson limit) - raises exception.
+        '''
+        h = np.asarray(observed, dtype=float)
+        k = np.nonzero(h)[0]
+        h = h[k]
+        N = h.sum()
+        if N < 2: raise Exception("Too few observations")
+        mu  = float(np.dot(h, k)) / N
+        var = float(np.dot(h, (k - mu) ** 2)) / N
+        if var <= mu: raise Exception("Data is not over-dispersed, var=%f <= mean=%f" % (var, mu))
+        
+        def score(lr):
+            # digamma(k+r) - digamma(r) = sum_{j<k} 1/(r+j)
+            r = math.exp(lr)
+            q = 1.0 / (np.arange(0, k[-1]+1) + r)
+            return float(np.dot(h, (np.cumsum(q) - q)[k])) + N*math.log(r / (r + mu))
+        
+        # bracket the root around the moment estimate, score is positive left of the root
+        lo = hi = math.log(mu*mu / (var - mu))
+        for i in range(0, 64):
+            if score(lo) > 0: break
+            lo -= 1.0
+        for i in range(0, 64):
+            if score(hi) < 0: break
+            hi += 1.0
+        size = math.exp(brentq(score, lo, hi, xtol=1e-12))
+        return (size, mu)
+    
     def goodMatchNegativeBinomialMLE(self, observed, bins, iterations, matchBoth=True, verbose=False, wiseBinning=False):
         '''
         Performs Chi-Squared test that given data comes from negative binomial distribution.
         Number of bins to sample from poisson=0..bins.
         
         New method: use Maximum Likelihood Estimator - derivL(Theta, x) / derivTheta = 0, 
-        No closed form exists, solving iteratively in R.
+        No closed form exists, solved iteratively - see negativeBinomialMLE(), or in R if rMle is set.
         [http://web.njit.edu/all_topics/Prog_Lang_Docs/html/library/MASS/html/fitdistr.html]
         '''
         
-        obsArray = []
-        for a,b in enumerate(observed):
-            for i in range(0,b): obsArray.append(a)
-        
         params = None
         try:
-            x = IntVector(obsArray)
-            params = MASS.fitdistr(x, 'negative binomial')
+            if self.rMle:
+                obsArray = []
+                for a,b in enumerate(observed):
+                    for i in range(0,int(b)): obsArray.append(a)
+                x = IntVector(obsArray)
+                params = MASS.fitdistr(x, 'negative binomial')
+                params = (params[0][0], params[0][1])
+            else:
+                params = self.negativeBinomialMLE(observed)
         except Exception as e:
             print("Problem, exception here", e)
             return (0, 0, 0, 0, [0 for i in observed], params)
         
-        n = (params[0][0])
-        p = params[0][0] / (params[0][0] + params[0][1])
+        n = (params[0])
+        p = params[0] / (params[0] + params[1])
         
         # expected values - compute N * probability for each port assumed in range 0..bins
-        expected = [(iterations * nbinom.pmf(i, n, p)) for i in range(0, bins)]
+        expected = iterations * pmfTable('nbinom', (n, p), bins)
         (chi, pval) = self.goodMatchDistribution(observed, expected, bins, iterations, matchBoth, verbose, wiseBinning, ddof=1)
         return (chi, pval, n, p, expected, params)
         
@@ -2400,7 +4657,7 @@ class NatSimulation(object):
         Poisson distribution is shifted by a given factor.
         '''        
         # expected values - compute N * probability for each port assumed in range 0..bins
-        expected = [(iterations * poisson.pmf(i+shift, lmbd)) for i in range(0, bins)]
+        expected = iterations * pmfTable('poisson', (lmbd,), bins, shift)
         #print "shift=%d " % shift, expected
         #print [(i+shift) for i in range(0, bins)]
         #print "+"*80
@@ -2412,38 +4669,34 @@ class NatSimulation(object):
         Performs Chi-Squared test that given data comes from a given distribution.
         Number of bins to sample from distribution=0..bins
         '''       
-        # select only those values which N*np >= 5
-        idxExGt5 = [i for i,x in enumerate(expected) if x>=5]
-        if idxExGt5 == None or len(idxExGt5)==0:
-            return (0.0,0.0)
-        
-        idxObsGt5 = [i for i,x in enumerate(observed) if x>=5] if matchBoth else idxExGt5
-        if idxObsGt5 == None or len(idxObsGt5)==0:
-            return (0.0,0.0)
-        
-        # intersection on ports
-        bothGt5 = list(set(idxExGt5) & set(idxObsGt5))
-        bothGt5.sort()
-        if bothGt5 == None or len(bothGt5)<3:
+        observed = np.asarray(observed, dtype=float)
+        expected = np.asarray(expected, dtype=float)
+        n = min(len(observed), len(expected))
+        
+        # select only those values which N*np >= 5 (on both sides if matchBoth)
+        gt5 = expected[0:n] >= 5
+        if matchBoth: gt5 &= observed[0:n] >= 5
+        bothGt5 = np.nonzero(gt5)[0]
+        if len(bothGt5)<3:
             if verbose: print("Warning! too few matching indices: %d" % len(bothGt5))
             return (0.0,0.0)
         
-        # expected values having counts higher-and-equal than 5
-        expTest  = [expected[i] for i in bothGt5]
-        
-        # new observed array - select only those ports from passed array that are in idxExGt5
-        obsTest  = [observed[i] for i in bothGt5]
+        # expected and observed values having counts higher-and-equal than 5
+        expTest  = expected[bothGt5]
+        obsTest  = observed[bothGt5]
         
         if wiseBinning:
             obsTest, expTest = self.unimodalWiseBinning(observed, expected, True)
+            if len(obsTest) == 0: return (0.0,0.0)
         
         if verbose:
             print("matching both:\n", bothGt5)
             print("expected: \n", expTest)
             print("observed: \n", obsTest)
         
-        # perform chi-squared test on distribution
-        return chisquare(np.array(obsTest), f_exp=np.array(expTest), ddof=0)
+        # perform chi-squared test on distribution, k-1 degrees of freedom
+        chi = float(np.sum((obsTest - expTest) ** 2 / expTest))
+        return (chi, float(chi2dist.sf(chi, len(obsTest) - 1)))
 
     def unimodalLowIdx(self, observed, limit):
         '''
@@ -2452,20 +4705,17 @@ class NatSimulation(object):
         '''
         
         # 1. find maximum
-        beg,end,maxidx=-1,-1,-1
-        for i,val in enumerate(observed):
-            if maxidx==-1 or (observed[maxidx] < val): maxidx=i
+        observed = np.asarray(observed)
+        maxidx = int(observed.argmax())
             
         if observed[maxidx] < limit: 
             return (0.0,0.0,0.0)
         
-        # 2. iterate on both sides away from maximum - peak of an unimodal distribution
-        for i in range(0, len(observed)):
-            lft, rgt = maxidx-i, maxidx+i
-            if beg==-1 and lft>=0            and observed[lft]<limit: beg=lft
-            if end==-1 and rgt<len(observed) and observed[rgt]<limit: end=rgt
-        if beg==-1: beg=0
-        if end==-1: end=len(observed)-1
+        # 2. nearest values under limit on both sides of maximum - peak of an unimodal distribution
+        lft = np.nonzero(observed[0:maxidx] < limit)[0]
+        rgt = np.nonzero(observed[maxidx:] < limit)[0]
+        beg = int(lft[-1]) if len(lft) > 0 else 0
+        end = maxidx + int(rgt[0]) if len(rgt) > 0 else len(observed)-1
         
         return (beg,end,maxidx)
         
@@ -2480,7 +4730,9 @@ class NatSimulation(object):
         
         Iterate over observed (empirical) distribution and find r,k. Assumption - distribution is unimodal
         '''
-        obsTest, expTest = [], []
+        observed = np.asarray(observed, dtype=float)
+        expected = np.asarray(expected, dtype=float)
+        obsTest, expTest = np.zeros(0), np.zeros(0)
         
         beg,  end,  maxidx  = self.unimodalLowIdx(observed, 5)
         beg2, end2, maxidx2 = 0, 0, 0
@@ -2491,21 +4743,213 @@ class NatSimulation(object):
             if beg >= end: return (obsTest, expTest)
         
         if (end-beg)<=3: return (obsTest, expTest)
+        beg, end = int(beg), int(end)
         # 3. generate categories, handle boundary categories that are sums
-        
-        # Left border category
-        expTest.append(sum([j for i,j in enumerate(expected) if i<=beg]))
-        obsTest.append(sum([j for i,j in enumerate(observed) if i<=beg]))
-        # Inside
-        expTest.extend([j for i,j in enumerate(expected) if i>beg and i<end])
-        obsTest.extend([j for i,j in enumerate(observed) if i>beg and i<end])
-        # Right border category
-        expTest.append(sum([j for i,j in enumerate(expected) if i>=end]))
-        obsTest.append(sum([j for i,j in enumerate(observed) if i>=end]))
+        # Left border category, inside, right border category
+        expTest = np.concatenate(([expected[0:beg+1].sum()], expected[beg+1:end], [expected[end:].sum()]))
+        obsTest = np.concatenate(([observed[0:beg+1].sum()], observed[beg+1:end], [observed[end:].sum()]))
         #print "obs:", obsTest
         #print "exp:", expTest
         return (obsTest, expTest)
     
+    def goodMatchBatch(self, H, bins=None, iterations=None, step=-1, keepExpected=False):
+        '''
+        Batch version of statistics of histAndStatisticsPortDistrib() - fits all its models 
+        to many histograms at once, in a few vectorized passes.
+        
+        H is 2-D array of histograms (blocks x bins), histogram i uses bins H[i, 0:bins[i]] 
+        (default whole rows), iterations is array of sample sizes (default sums of histograms).
+        
+        Returns dict of arrays over blocks: ssum, ex, var, stdev and 'distrib' - list of models in
+        the order of histAndStatisticsPortDistrib() (Poisson, shifted Poisson, binomial, negative binomial,
+        negative binomial MLE), each with arrays chi, pval, r2, list par of parameter arrays and 
+        m = expected frequencies (blocks x bins) if keepExpected is set.
+        '''
+        H = np.asarray(H, dtype=float)
+        B, K = H.shape
+        bins  = np.full(B, K) if bins is None else np.asarray(bins)
+        if K == 0:
+            # only empty histograms, one empty bin keeps row operations defined
+            H = np.zeros((B, 1))
+            K = 1
+        k = np.arange(K)
+        valid = k[None,:] < bins[:,None]
+        H = np.where(valid, H, 0)
+        
+        #
+        # Basic statistics, see calcPortDistribInfo()
+        #
+        ssum = H.sum(1)
+        it   = ssum if iterations is None else np.asarray(iterations, dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ex   = H.dot(k) / it
+            var  = (H * (k[None,:] - ex[:,None]) ** 2).sum(1)
+        var  = np.where(ssum > 1, var / np.maximum(ssum - 1, 1), 0)
+        stdev = np.sqrt(var)
+        
+        res = {'ssum': ssum, 'ex': ex, 'var': var, 'stdev': stdev, 'distrib': []}
+        def model(E, active, matchBoth, wiseBinning, par, **kw):
+            E = np.where(valid & active[:,None], it[:,None] * E, 0)
+            chi, pval = self.goodMatchDistributionBatch(H, E, valid, bins, matchBoth, wiseBinning)
+            r2 = np.where(ssum > 0, self.pearsonCorelationBatch(E, H, valid, bins), 0)    # empty histogram
+            d  = {'chi': chi, 'pval': pval, 'r2': r2, 'par': par, 'm': E if keepExpected else None}
+            d.update(kw)
+            res['distrib'].append(d)
+        
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            # Poisson, lambda = E[X]
+            model(poisson.pmf(k[None,:], ex[:,None]), np.ones(B, dtype=bool), True, False, [ex], lmbd=ex)
+            
+            # Poisson, shifted by step or by E[X]-V[X] if V[X] < E[X]
+            if step != -1:
+                active = np.ones(B, dtype=bool)
+                l2, shift = ex - step, np.full(B, -step)
+            else:
+                active = var < ex
+                l2, shift = np.where(active, var, 0), -np.trunc(ex - var).astype(np.int64)
+            model(poisson.pmf(k[None,:] + shift[:,None], l2[:,None]), active, True, False, [l2], lmbd=l2)
+            res['distrib'][-1]['r2'][~active] = 0
+            
+            # Binomial, parameters from E[X], V[X], see goodMatchBinomial()
+            p = np.abs((ex - var) / ex)
+            n = np.abs(ex / ((ex - var) / ex))
+            active = (ex != 0) & np.isfinite(n)
+            n = np.where(active, np.trunc(n), 0)
+            p = np.where(active, p, 0)
+            model(binom.pmf(k[None,:], n[:,None], p[:,None]), active, True, True, [n, p], n=n, p=p)
+            
+            # Negative binomial, parameters from E[X], V[X], see goodMatchNegativeBinomial()
+            p = (2 - np.sqrt(4*ex/var)) / 2
+            active = (var != 0) & (ex >= 0) & (p != 0)
+            p = np.where(p < 0, (2 - np.sqrt(2*ex/var)) / 2, p)
+            p = np.where(p < 0, (2 - np.sqrt(ex/var)) / 2, p)
+            n = np.where(active, np.round(ex*(1-p)/p), 0)
+            p = np.where(active, 1-p, 0)
+            model(nbinom.pmf(k[None,:], n[:,None], p[:,None]), active, False, True, [n, p], n=n, p=p)
+            
+            # Negative binomial, MLE
+            size, mu, active = self.negativeBinomialMLEBatch(H)
+            n = np.where(active, size, 0)
+            p = np.where(active, size / (size + mu), 0)
+            model(nbinom.pmf(k[None,:], n[:,None], p[:,None]), active, False, True, [n, p], n=n, p=p)
+        return res
+    
+    def goodMatchBatchRow(self, fit, i, bins=None):
+        '''
+        Statistics of i-th histogram from goodMatchBatch() result in the format of histAndStatisticsPortDistrib(),
+        expected frequencies are cut to the given number of bins.
+        '''
+        res = {'ssum': float(fit['ssum'][i]), 'ex': float(fit['ex'][i]), 'var': float(fit['var'][i]), 
+               'stdev': float(fit['stdev'][i]), 'distrib': []}
+        for d in fit['distrib']:
+            t = {'chi': float(d['chi'][i]), 'pval': float(d['pval'][i]), 'r2': float(d['r2'][i]), 
+                 'par': [float(x[i]) for x in d['par']], 'm': None if d['m'] is None else d['m'][i, 0:bins]}
+            for key in ('lmbd', 'n', 'p'):
+                if key in d: t[key] = float(d[key][i])
+            res['distrib'].append(t)
+        return res
+    
+    def goodMatchDistributionBatch(self, O, E, valid, bins, matchBoth=True, wiseBinning=False):
+        '''
+        Chi-Squared tests of goodMatchDistribution() on rows of observed O and expected E (blocks x bins),
+        valid marks bins used by each row, bins holds their counts. Returns arrays (chi, pval).
+        '''
+        K = O.shape[1]
+        k = np.arange(K)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # select only those values which N*np >= 5 (on both sides if matchBoth)
+            gt5 = valid & (E >= 5)
+            if matchBoth: gt5 &= O >= 5
+            ok  = gt5.sum(1) >= 3
+            cnt = gt5.sum(1)
+            chi = np.where(gt5, (O - E) ** 2 / E, 0).sum(1)
+            
+            if wiseBinning:
+                # unimodalWiseBinning() with both sides, border categories are sums of outer bins
+                beg1, end1, ok1 = self.unimodalLowIdxBatch(O, valid, bins, 5)
+                beg2, end2, ok2 = self.unimodalLowIdxBatch(E, valid, bins, 5)
+                beg = np.maximum(beg1, beg2)
+                end = np.minimum(end1, end2)
+                ok &= ok1 & ok2 & ((end - beg) > 3)
+                beg = np.where(ok, beg, 0)
+                end = np.where(ok, end, 1)
+                
+                rows = np.arange(O.shape[0])
+                cO, cE = O.cumsum(1), E.cumsum(1)
+                lO, lE = cO[rows, beg], cE[rows, beg]
+                rO, rE = cO[:,-1] - cO[rows, end-1], cE[:,-1] - cE[rows, end-1]
+                inside = (k[None,:] > beg[:,None]) & (k[None,:] < end[:,None])
+                chi = np.where(inside, (O - E) ** 2 / E, 0).sum(1) + (lO - lE) ** 2 / lE + (rO - rE) ** 2 / rE
+                cnt = end - beg + 1
+            
+            chi  = np.where(ok, chi, 0.0)
+            pval = np.where(ok, chi2dist.sf(chi, np.maximum(cnt - 1, 1)), 0.0)
+        return (chi, pval)
+    
+    def unimodalLowIdxBatch(self, X, valid, bins, limit):
+        '''
+        unimodalLowIdx() on rows of X. Returns arrays (beg, end, ok), ok is False 
+        for rows with maximum under limit.
+        '''
+        K = X.shape[1]
+        k = np.arange(K)
+        Xv = np.where(valid, X, -np.inf)
+        maxidx = Xv.argmax(1)
+        ok = ~(Xv[np.arange(X.shape[0]), maxidx] < limit)
+        below = valid & (X < limit)
+        beg = np.where(below & (k[None,:] < maxidx[:,None]), k[None,:], 0).max(1)
+        end = np.where(below & (k[None,:] >= maxidx[:,None]), k[None,:], (bins-1)[:,None]).min(1)
+        return (beg, end, ok)
+    
+    def pearsonCorelationBatch(self, E, O, valid, bins):
+        '''
+        pearsonCorelation() on rows of model E and observed O.
+        '''
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dE = np.where(valid, E - (E.sum(1) / bins)[:,None], 0)
+            dO = np.where(valid, O - (O.sum(1) / bins)[:,None], 0)
+            return (dE * dO).sum(1) / (np.sqrt((dE ** 2).sum(1)) * np.sqrt((dO ** 2).sum(1)))
+    
+    def negativeBinomialMLEBatch(self, H, maxIter=100, tol=1e-10):
+        '''
+        negativeBinomialMLE() on rows of histograms H (blocks x bins). 
+        Score equation in log(size) is solved by Newton's method for all rows at once, 
+        steps leaving the bracket of the root known so far fall back to bisection.
+        Returns arrays (size, mu, ok), ok is False for rows with no solution.
+        '''
+        K = H.shape[1]
+        k = np.arange(K)
+        N   = H.sum(1)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            mu  = H.dot(k) / N
+            var = (H * (k[None,:] - mu[:,None]) ** 2).sum(1) / N
+            ok  = (N >= 2) & (var > mu)
+            mu  = np.where(ok, mu, 1)
+            u   = np.where(ok, np.log(mu*mu / (var - mu)), 0)
+            lo  = np.full(len(N), -np.inf)
+            hi  = np.full(len(N), np.inf)
+            for i in range(0, maxIter):
+                # digamma(k+r) - digamma(r) = sum_{j<k} 1/(r+j), similarly for trigamma
+                r  = np.exp(u)
+                q  = 1.0 / (k[None,:] + r[:,None])
+                s1 = np.cumsum(q, 1) - q
+                s2 = np.cumsum(q*q, 1) - q*q
+                f  = (H * s1).sum(1) + N*np.log(r / (r + mu))
+                d  = r * (N*mu / (r * (r + mu)) - (H * s2).sum(1))
+                # score is positive left of the root
+                lo = np.where(f > 0, u, lo)
+                hi = np.where(f < 0, u, hi)
+                un = u + np.clip(-f / d, -2, 2)
+                bad = ~((un > lo) & (un < hi))
+                mid = np.where(np.isinf(hi), lo + 2, np.where(np.isinf(lo), hi - 2, (lo + hi) / 2))
+                un = np.where(bad, mid, un)
+                un = np.where(ok & np.isfinite(un), un, u)
+                done = np.abs(un - u) <= tol * np.maximum(1, np.abs(u))
+                u = un
+                if done.all(): break
+            ok &= np.isfinite(u)
+            return (np.exp(u), mu, ok)
+    
     def myProcEstimator(self, lmbd=-1, T=-1):
         '''
         Conditional estimator assuming we weren't lucky in the previous guess
@@ -2634,7 +5078,7 @@ class NatSimulation(object):
         seen_add = seen.add
         for step in range(0, 3001):
             #for kk in range(0,100):
-                x = int(  np.random.poisson(lmbd * T * (1+step* 1.5 )))# coe(lmbd*T)))  )
+                x = int(  self.rng.poisson(lmbd * T * (1+step* 1.5 )))# coe(lmbd*T)))  )
                 if x not in seen and not seen_add(x): 
                     b.append(x)
                     if len(b)>1000: break
@@ -2644,7 +5088,7 @@ class NatSimulation(object):
             sys.stdout.write( charproc(r, rounds) )
             sys.stdout.flush()
             
-            natSamples = [round(x) for x in np.random.poisson(lmbd*T, self.errors)]
+            natSamples = [round(x) for x in self.rng.poisson(lmbd*T, self.errors)]
             procList   = [natSamples[0] + 1]
             for i in range(1, self.errors): procList.append(procList[i-1] + 1 + natSamples[i])
             
@@ -2669,7 +5113,7 @@ class NatSimulation(object):
             #
             # Test sampling value estimator
             #
-            natSamples2 = [round(x) for x in np.random.poisson(lmbd*T, self.errors)]
+            natSamples2 = [round(x) for x in self.rng.poisson(lmbd*T, self.errors)]
             procList2   = [natSamples2[0] + 1]
             for i in range(1, self.errors): procList2.append(procList2[i-1] + 1 + natSamples2[i])
             samMatch = list(set(procList) & set(procList2))
@@ -2695,7 +5139,7 @@ class NatSimulation(object):
             seen_add = seen.add
             for step in range(0, 0):#3001):
                 #for kk in range(0,100):
-                    x = int(  np.random.poisson(lmbd * T * (1+step* 1.5 )))# coe(lmbd*T)))  )
+                    x = int(  self.rng.poisson(lmbd * T * (1+step* 1.5 )))# coe(lmbd*T)))  )
                     if x not in seen and not seen_add(x): 
                         b.append(x)
                         if len(b)>1000: break
@@ -2773,6 +5217,132 @@ class NatSimulation(object):
     # Here ends the class
     pass
 
+# NatSimulation attributes copied to worker processes
+BENCH_CONF = ['dot', 'ascii', 'errors', 'portScanInterval', 'silentPeriodBase', 'silentPeriodlmbd', 
+              'simulationRoundsFast', 'compact', 'batch', 'batchRounds', 'natType', 'natParams', 'seed']
+
+def benchmarkWorker(task):
+    '''
+    Process pool worker for --benchmark. Simulates one chunk of rounds for one lambda
+    with its own NatSimulation, NATs, strategy and independently seeded random streams.
+    If NatSimulation seed is set, rounds use streams given by (seed, lambda index, round), 
+    so the result does not depend on chunking and equals serial simulation.
+    
+    task = (lambda index, chunk index, first round, lambda, rounds, seed, strategy name, coefficient finder, NatSimulation config)
+    '''
+    idx, chunk, offset, lmbd, rounds, seed, sname, coef, conf = task
+    
+    ns = NatSimulation()
+    for k in conf: setattr(ns, k, conf[k])
+    if ns.seed is None: ns.rng = np.random.default_rng(seed)
+    ns.rngStreamId = idx
+    ns.roundOffset = offset
+    ns.lmbd = lmbd
+    ns.simulationRounds = rounds
+    if chunk > 0: ns.simulationRoundsFast = -1  # only the first chunk decides on early stop
+    
+    natA = getNat(ns.natType, ns.natParams)
+    natB = getNat(ns.natType, ns.natParams)
+    strategy = getStrategy(sname)
+    strategy.init(None)
+    ns.roundRng(0, [natA, natB], [strategy])
+    try:
+        if coef: return (idx, chunk, ns.coefFinder(natA, natB, strategy, 0.10, 0.1))
+        else:    return (idx, chunk, ns.simulation(natA, natB, strategy))
+    except Exception as e:
+        print("Exception!", e)
+        return (idx, chunk, None)
+
+def nfBenchWorker(task):
+    '''
+    Process pool worker for --nfbench. Simulates a chunk of rounds of one strategy on given NAT sample pairs.
+    If NatSimulation seed is not set, the task uses its own random generator seeded by seed,
+    forked workers would share the generator state otherwise.
+    
+    task = (strategy name, [(round number, natSamples)], stop on first match, seed, NatSimulation config)
+    '''
+    sname, rounds, stopOnFirstMatch, seed, conf = task
+    ns = NatSimulation()
+    for k in conf: setattr(ns, k, conf[k])
+    if ns.seed is None: ns.rng = np.random.default_rng(seed)
+    
+    nats = [getNat(ns.natType, ns.natParams), getNat(ns.natType, ns.natParams)]
+    strategies = [getStrategy(sname, 0), getStrategy(sname, 0)]
+    strategies[0].init(None)
+    strategies[1].init(None)
+    return (sname, ns.nfBenchRounds(nats, strategies, rounds, stopOnFirstMatch))
+
+def benchmarkMerge(results, rounds):
+    '''
+    Merges simulation() results of round chunks of one lambda, rounds = requested rounds of each chunk.
+    If the first chunk stopped early due to poor performance, the whole lambda stops there as in simulation(),
+    results of later chunks are discarded (they were already simulated, chunks run in parallel).
+    '''
+    if any([r is None for r in results]): return None
+    if len(results) == 1 or results[0][4] < rounds[0]: return results[0]
+    
+    realRounds = sum([r[4] for r in results])
+    successCnt = sum([r[1] for r in results])
+    successAcc = [sum([r[2]*r[1] for r in results]), sum([r[3]*r[1] for r in results])]
+    return (successCnt / realRounds    if realRounds > 0 else 0, 
+            successCnt, 
+            successAcc[0] / successCnt if successCnt > 0 else 0,
+            successAcc[1] / successCnt if successCnt > 0 else 0,
+            realRounds)
+
+def benchmarkPool(ns, sname, lmbdArr, workers, chunk=0, coef=False, f=None):
+    '''
+    Runs --benchmark over lambdas in lmbdArr in a process pool with given number of workers.
+    Each lambda is split to chunks of at most <chunk> rounds (0 = no split), each chunk is one task
+    with its own seed. Result lines are written to f in the lambda order, as soon as all chunks 
+    of the lambda and all preceding lambdas are finished.
+    
+    Early stop is decided by the first chunk only, it stops after simulationRoundsFast+1 rounds and chunk
+    has to be longer to tell the stop from a finished chunk, shorter chunks are extended. When the first
+    chunk stops early, later chunks of the lambda are discarded.
+    '''
+    fast = ns.simulationRoundsFast if ns.simulationRounds > ns.simulationRoundsFast else -1
+    if 0 < chunk <= fast+1 and not coef:
+        print("Warning: chunk %d does not cover early stop after %d rounds, using chunk %d" % (chunk, fast+1, fast+2))
+        chunk = fast+2
+    
+    conf   = dict([(k, getattr(ns, k)) for k in BENCH_CONF])
+    chunks = []     # requested rounds of chunks, per lambda
+    for clmb in lmbdArr:
+        if chunk <= 0 or coef: chunks.append([ns.simulationRounds])
+        else: chunks.append([min(chunk, ns.simulationRounds - i) for i in range(0, ns.simulationRounds, chunk)])
+    
+    tasks = []
+    seeds = np.random.SeedSequence().spawn(sum([len(c) for c in chunks]))
+    for idx, clmb in enumerate(lmbdArr):
+        for ci, crounds in enumerate(chunks[idx]):
+            seed = int(seeds[len(tasks)].generate_state(1)[0])
+            tasks.append((idx, ci, sum(chunks[idx][:ci]), clmb, crounds, seed, sname, coef, conf))
+    print("Benchmark tasks: %d; workers: %d" % (len(tasks), workers))
+    
+    results = [[None] * len(c) for c in chunks]
+    done    = [0] * len(lmbdArr)
+    out     = []
+    nextIdx = 0
+    pool = multiprocessing.Pool(workers)
+    try:
+        for idx, ci, res in pool.imap_unordered(benchmarkWorker, tasks):
+            results[idx][ci] = res
+            done[idx] += 1
+            
+            # flush finished lambdas in sorted order
+            while nextIdx < len(lmbdArr) and done[nextIdx] == len(chunks[nextIdx]):
+                res = benchmarkMerge(results[nextIdx], chunks[nextIdx])
+                out.append((lmbdArr[nextIdx], res))
+                if res is not None and f is not None:
+                    f.write("%03.4f|%03.4f|%03.4f|%03.4f\n" % (lmbdArr[nextIdx], ns.portScanInterval, res[0], res[1] if coef else res[2]))
+                    f.flush()
+                nextIdx += 1
+    finally:
+        pool.close()
+        pool.join()
+    return out
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='NAT simulator.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-o','--output',    help='Output file name from finder', required=False, default='graph.txt')
@@ -2783,8 +5353,8 @@ if __name__ == "__main__":
     parser.add_argument('-e','--errors',    help='Maximum steps by algorithm', required=False, type=int, default=1000)
     parser.add_argument('-d','--dot',       help='Graphviz dot illustration', required=False, type=int, default=0)
     parser.add_argument('-a','--ascii',     help='Ascii illustration', required=False, type=int, default=0)
-    parser.add_argument('-n','--nfdump',    help='NFdump file', required=False, default=None)
-    parser.add_argument('-m','--nfdump_sorted',help='NFdump sorted file', required=False, default=None)
+    parser.add_argument('-n','--nfdump',    help='NFdump file, directory or glob pattern of files', required=False, default=None)
+    parser.add_argument('-m','--nfdump_sorted',help='NFdump sorted file or directory with nfdump cache', required=False, default=None)
     parser.add_argument('-f','--filter',    help='NFdump filter', required=False, default=None)
     parser.add_argument('-g','--hostnet',   help='NFdump host address', required=False, default="147.250.")
     parser.add_argument('-v','--verbose',   help='Verbosity level', required=False, default=0, type=int)
@@ -2804,17 +5374,30 @@ if __name__ == "__main__":
     parser.add_argument('--maxblock',       help='Maximum number of blocks to collect', required=False, default=-1, type=int)
     parser.add_argument('--skipblock',      help='How many blocks to skip', required=False, default=0, type=int)
     parser.add_argument('--eachskip',       help='Records skipped between samples', required=False, default=0.0, type=float)
+    parser.add_argument('--iterations',     help='Simulated runs of the process in port distribution function (--pdistrib)', required=False, default=5000, type=int)
+    parser.add_argument('--pexact',         help='Exact port distribution function instead of sampling (--pdistrib)', required=False, default=False, action='store_true')
+    parser.add_argument('--workers',        help='Number of worker processes for benchmark and for decoding of multiple nfdump files', required=False, default=0, type=int)
+    parser.add_argument('--chunk',          help='Rounds per worker task in benchmark, 0 = whole lambda', required=False, default=0, type=int)
+    parser.add_argument('--nat',            help='NAT type (incremental, random, array, arrayrandom); array = compact NumPy state', required=False, default='incremental')
+    parser.add_argument('--portidx',        help='Free port lookup by port index instead of linear probing (incremental NAT)', required=False, default=False, action='store_true')
+    parser.add_argument('--batch',          help='Vectorized batch engine for simulation rounds (incremental NAT)', required=False, default=False, action='store_true')
+    parser.add_argument('--nfcache',        help='Directory of binary columnar cache of nfdump records, created from -m/-n input if missing', required=False, default=None)
+    parser.add_argument('--nfstream',       help='Only statistics over all blocks in --nfdistrib, no per block series and graphs', required=False, default=False, action='store_true')
+    parser.add_argument('--tracecache',     help='Directory of NAT sample traces of netflow data, traces are reused by later runs', required=False, default=None)
+    parser.add_argument('--nfsort',         help='Sorts nfdump file (-n, -f) by flow start to the given file readable by -m', required=False, default=None)
+    parser.add_argument('--sortmem',        help='Records in memory for external sort of nfdump file, 0 = heap sort within active timeout (--nfsort uses 1000000)', required=False, default=0, type=int)
+    parser.add_argument('--tmpdir',         help='Directory for temporary files of external sort', required=False, default=None)
+    parser.add_argument('--rmle',           help='Negative binomial MLE by R MASS.fitdistr (requires rpy2) instead of the native one, for validation', required=False, default=False, action='store_true')
+    parser.add_argument('--seed',           help='Random seed; seeded runs are reproducible regardless of --workers, --chunk and --batch', required=False, default=None, type=int)
     
     args = parser.parse_args()
     
     ns = NatSimulation()
     
     # create a symmetric nat both for Alice and Bob
-    natA = SymmetricIncrementalNat()
-    natB = SymmetricIncrementalNat()
-    
-    natA.init(None)
-    natB.init(None)
+    natParams = {'portIndex': args.portidx}
+    natA = getNat(args.nat, natParams)
+    natB = getNat(args.nat, natParams)
     
     strategies=[getStrategy(args.strategy), getStrategy(args.strategy)]
     strategies[0].init(None)
@@ -2833,6 +5416,20 @@ if __name__ == "__main__":
     ns.portScanInterval = args.space
     ns.silentPeriodBase=500
     ns.silentPeriodlmbd=10
+    ns.batch = args.batch
+    ns.natType = args.nat
+    ns.natParams = natParams
+    ns.seed = args.seed
+    ns.nfCache = args.nfcache
+    ns.nfSortMem = args.sortmem
+    ns.nfSortTmp = args.tmpdir
+    ns.nfWorkers = args.workers
+    ns.traceCache = args.tracecache
+    if args.rmle and MASS == None:
+        print("--rmle requires rpy2 and R with MASS library")
+        sys.exit(1)
+    ns.rMle = args.rmle
+    if args.seed != None: ns.roundRng(0, [natA, natB], strategies)
     
     #
     # Port pool exhaustion computation
@@ -2852,6 +5449,16 @@ if __name__ == "__main__":
         print(ns.getLambdaExhaustionCDF(natA, args.exhaust_p))
 
     
+    #
+    # NFdump sort
+    # Sorts nfdump file by flow start using external sort and saves it in the format for -m.
+    #
+    if args.nfsort != None and args.nfdump != None:
+        if NfdumpMultiReader.isMulti(args.nfdump): nfdumpObj = NfdumpMultiReader(args.nfdump, args.filter, workers=args.workers)
+        else: nfdumpObj = NfdumpSorter(args.nfdump, args.filter, memLimit=args.sortmem if args.sortmem > 0 else 1000000, tmpDir=args.tmpdir)
+        cnt = nfdumpSave(nfdumpObj.generator(), args.nfsort)
+        print("\nSorted %d records to %s" % (cnt, args.nfsort))
+    
     #
     # NFdump
     # Computes port distribution function based on netflow network data.
@@ -2859,35 +5466,34 @@ if __name__ == "__main__":
     if args.nfdistrib:
         out = None
         if args.nfdump != None:
-            out = ns.nfdumpDistribution(natA, filename=args.nfdump, homeNet=args.hostnet, filt=args.filter, sampleSize=args.samples, maxBlock=args.maxblock, skip=args.skipblock, fileOut=args.output)
+            out = ns.nfdumpDistribution(natA, filename=args.nfdump, homeNet=args.hostnet, filt=args.filter, sampleSize=args.samples, maxBlock=args.maxblock, skip=args.skipblock, fileOut=args.output, keepSeries=not args.nfstream)
         if args.nfdump_sorted != None:
-            out = ns.nfdumpDistribution(natA, processedNfdump=args.nfdump_sorted, homeNet=args.hostnet, filt=args.filter, sampleSize=args.samples, maxBlock=args.maxblock, skip=args.skipblock, fileOut=args.output)
+            out = ns.nfdumpDistribution(natA, processedNfdump=args.nfdump_sorted, homeNet=args.hostnet, filt=args.filter, sampleSize=args.samples, maxBlock=args.maxblock, skip=args.skipblock, fileOut=args.output, keepSeries=not args.nfstream)
         
         #
         # Graph
         #
         styles = ['--bx', '-.g2', ':.r', '--|k', ':m+', '--1c']
+        if out != None and not args.nfstream:
+            # Process output to nicely looking graph
+            x = np.array(list(range(0,out['n'])))
+        
+            # e,x
+            ex = np.array([d[0] for d in out['sd']])
+            vx = np.array([d[1] for d in out['sd']])
+            plt.plot(x, ex, 'bv', label="E[X]")
+            plt.plot(x, vx, 'r+', label="V[X]")
+            graph(plt)
         
-        
-        # Process output to nicely looking graph
-        x = np.array(list(range(0,out['n'])))
-        
-        # e,x
-        ex = np.array([d[0] for d in out['sd']])
-        vx = np.array([d[1] for d in out['sd']])
-        plt.plot(x, ex, 'bv', label="E[X]")
-        plt.plot(x, vx, 'r+', label="V[X]")
-        graph(plt)
-        
-        # p-value with critical region
-        pk_p = np.array(out['pk'][0]) # poisson, key
-        pk_n = np.array(out['pk'][4]) # nbin, key
-        pv_p = np.array(out['pv'][0]) # poisson, value
-        pv_n = np.array(out['pv'][4]) # nbin, value
-        plt.plot(pk_p, pv_p, 'go', label="Po")
-        plt.plot(pk_n, pv_n, 'b^', label="NB")
-        plt.axhspan(0.0, 0.05, facecolor='r', alpha=0.5) # p-value reqion
-        graph(plt, y='p-value', loc=-1)
+            # p-value with critical region
+            pk_p = np.array(out['pk'][0]) # poisson, key
+            pk_n = np.array(out['pk'][4]) # nbin, key
+            pv_p = np.array(out['pv'][0]) # poisson, value
+            pv_n = np.array(out['pv'][4]) # nbin, value
+            plt.plot(pk_p, pv_p, 'go', label="Po")
+            plt.plot(pk_n, pv_n, 'b^', label="NB")
+            plt.axhspan(0.0, 0.05, facecolor='r', alpha=0.5) # p-value reqion
+            graph(plt, y='p-value', loc=-1)
         
         
         
@@ -2913,7 +5519,7 @@ if __name__ == "__main__":
     # Computes port distribution function for given NAT and parameters.
     #
     if args.pdistrib:
-        ns.portDistributionFunction(args.lmbd, args.space, list(range(1,180)), [])
+        ns.portDistributionFunction(args.lmbd, args.space, list(range(1,180)), [], iterations=args.iterations, exact=args.pexact)
         print("Port distribution done...")
     
     #
@@ -2938,16 +5544,15 @@ if __name__ == "__main__":
         SArr = ['their', 'i2j', 'poisson', 'simple']
         for T in TArr:
             print("="*80)
+            ns.portScanInterval = T
+            ns.compact = args.verbose == 0
+            
+            # all strategies are evaluated on the same NAT samples taken in one pass
+            results = ns.nfBenchmark(SArr, processedNfdump=args.nfdump_sorted, homeNet=args.hostnet, filt=args.filter, 
+                                     recEachSkip=args.eachskip, maxBlock=args.maxblock, workers=args.workers)
             for S in SArr:
-                ns.portScanInterval = T
-                strategies=[getStrategy(S,0), getStrategy(S,0)]
-                strategies[0].init(None)
-                strategies[1].init(None)
-                
+                res = results[S]
                 print("S=%s T=%d" % (S, T))
-                ns.compact = args.verbose == 0
-                
-                res = ns.nfSimulation(natA, natB, strategies[0], strategies[1], processedNfdump=args.nfdump_sorted, homeNet=args.hostnet, filt=args.filter, recEachSkip=args.eachskip, maxBlock=args.maxblock)
                 f.write("%03.4f|%03.4f|%03.4f|%03.4f\n" % (ns.lmbd, ns.portScanInterval, res[0], res[2])) # python will convert \n to os.linesep
                 f.flush()
                 
@@ -2985,13 +5590,18 @@ if __name__ == "__main__":
         print("Lambdas that will be benchmarked: \n", (", ".join(['%04.3f' % i for i in lmbdArr])))
         print("="*80)
         
-        for clmb in lmbdArr:
+        if args.workers > 0:
+            benchmarkPool(ns, args.strategy, lmbdArr, args.workers, args.chunk, args.strategy == 'poisson' and args.coef, f)
+            lmbdArr = []
+        
+        for idx, clmb in enumerate(lmbdArr):
             res = []
             mem = getMem()
             print("# Current lambda: %03.4f; Avg silent period: %04.4f; Mem: %04.2f MB" % (clmb, clmb * (ns.silentPeriodBase + ns.silentPeriodlmbd), mem))
             if args.lmbd_start!=-1 and clmb < args.lmbd_start: continue
             
             ns.lmbd = clmb
+            ns.rngStreamId = idx
             try:
                 if args.strategy == 'poisson' and args.coef:
                     res = ns.coefFinder(natA, natB, strategies[0], 0.10, 0.1)